@@ -0,0 +1,53 @@
+""" Helpers shared by the benchmark scripts
+
+Every benchmark writes a JSON document {"benchmark": name, "environment": {...}, "results": [...]}
+where each result has a unique "name" and a number of metrics, so that runs can be compared with
+benchmarks/compare.py.
+"""
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+# metrics compared by compare.py, +1 if larger values are better, -1 if smaller ones are
+METRICS = {
+    "bandwidth_GBps": +1,
+    "throughput_MBps": +1,
+    "best_time_s": -1,
+    "read_s": -1,
+    "reduce_s": -1,
+    "write_s": -1,
+    "wall_s": -1,
+    "peak_rss_MB": -1,
+}
+
+
+def environment() -> dict:
+    """ Versions and machine details that may explain differences between two runs """
+    import numba
+    env = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "numba_threads": numba.config.NUMBA_NUM_THREADS,
+    }
+    try:
+        import openpmd_api as api
+        env["openpmd_api"] = api.__version__
+        env["openpmd_variants"] = {variant: available
+                                   for variant, available in api.variants.items() if available}
+    except ImportError:
+        pass
+    return env
+
+
+def write_results(path: str, benchmark: str, results: list) -> None:
+    with open(path, 'w') as f:
+        json.dump({"benchmark": benchmark, "environment": environment(), "results": results}, f,
+                  indent=2)
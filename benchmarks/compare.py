@@ -0,0 +1,68 @@
+""" Compares two benchmark result files and flags regressions
+
+Results are matched by benchmark and name. A metric counts as a regression if it got worse by more
+than the threshold (relative to the baseline), the exit code is 1 if there is at least one.
+
+usage: python benchmarks/compare.py baseline.json current.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+
+from common import METRICS
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """ (name, metric, baseline value, current value, relative change, regression) of common metrics
+
+    The relative change is positive if the metric got better.
+    """
+    if baseline["benchmark"] != current["benchmark"]:
+        raise ValueError(f"can not compare a {baseline['benchmark']} benchmark to a "
+                         f"{current['benchmark']} one")
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        reference = baseline_results.get(result["name"])
+        if reference is None:
+            continue
+        for metric, direction in METRICS.items():
+            if metric not in result or metric not in reference or not reference[metric]:
+                continue
+            change = direction * (result[metric] - reference[metric]) / reference[metric]
+            rows.append((result["name"], metric, reference[metric], result[metric], change,
+                         change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files and flag "
+                                                 "regressions.")
+    parser.add_argument("baseline", type=str)
+    parser.add_argument("current", type=str)
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change (e.g. 0.1 for 10%%) beyond which a worse metric is a "
+                             "regression.")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    for key in sorted(set(baseline["environment"]) | set(current["environment"])):
+        if key != "time" and baseline["environment"].get(key) != current["environment"].get(key):
+            print(f"environment differs: {key}: {baseline['environment'].get(key)} -> "
+                  f"{current['environment'].get(key)}")
+    print(f"{'name':>36} {'metric':>16} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metric, reference, value, change, regression in rows:
+        print(f"{name:>36} {metric:>16} {reference:>12.4g} {value:>12.4g} {change:>+8.1%}"
+              f"{'  REGRESSION' if regression else ''}")
+    regressions = [row for row in rows if row[-1]]
+    print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} in {len(rows)} compared "
+          "metrics")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+""" End-to-end benchmark of OutputReducer.run
+
+Generates synthetic openPMD series (BP and HDF5, 1D/2D/3D, float32/float64, several mesh counts and
+sizes) in a work directory and reduces each of them by 2 along every axis in a fresh process. For
+every case it reports the busy time of the read, reduce and write stages, the wall time, the input
+throughput and the peak resident memory of that process, taken from the repetition with the shortest
+wall time.
+
+usage: python benchmarks/end_to_end.py [--quick] [--json results.json]
+                                       [--reducer-options '{"pipeline": true}']
+
+Compare two JSON files with benchmarks/compare.py.
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from common import write_results
+
+EXTENSIONS = {"bp": "bp", "hdf5": "h5"}
+AXES = ["x", "y", "z"]
+BIN = 2
+
+
+def case_name(case: dict) -> str:
+    return (f"{case['backend']}-{case['ndim']}d-{case['dtype']}-{case['meshes']}meshes-"
+            f"{case['cells'] / 1e6:g}Mcells")
+
+
+def case_shape(ndim: int, cells: int) -> list:
+    side = int(round(cells ** (1 / ndim)))
+    return [max(side // BIN, 1) * BIN for _ in range(ndim)]
+
+
+def write_series(path: str, case: dict) -> None:
+    """ Writes a series with case['meshes'] scalar meshes of random data in every iteration """
+    import openpmd_api as api
+    shape = case_shape(case["ndim"], case["cells"])
+    data = np.random.default_rng(0).random(shape).astype(case["dtype"])
+    series = api.Series(path, api.Access.create)
+    for it in range(case["iterations"]):
+        iteration = series.write_iterations()[it]
+        for mm in range(case["meshes"]):
+            mesh = iteration.meshes[f"field_{mm}"]
+            mesh.axis_labels = AXES[:case["ndim"]]
+            mesh.grid_spacing = [1.0 for _ in shape]
+            mesh.grid_global_offset = [0.0 for _ in shape]
+            mesh.grid_unit_SI = 1.0
+            mrc = mesh[api.Mesh_Record_Component.SCALAR]
+            mrc.reset_dataset(api.Dataset(data.dtype, data.shape))
+            mrc.store_chunk(data)
+        iteration.close()
+    del series
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(case: dict, case_dir: str, reducer_options: dict) -> dict:
+    """ Reduces the series of a case, in a separate process so that the peak memory is its own """
+    from field_reduce import OutputReducer
+    from field_reduce.downscale_kernel import get_operator, make_scratch
+
+    ext = EXTENSIONS[case["backend"]]
+    # compile (or load from numba's cache) the kernels outside the timed region
+    small = np.zeros([2 * BIN for _ in range(case["ndim"])], dtype=case["dtype"])
+    output = np.empty([2 for _ in range(case["ndim"])], dtype=case["dtype"])
+    scratch = make_scratch(output.shape, small.dtype, reducer_options.get("precision", "native"))
+    get_operator(reducer_options.get("default_operator", "mean"))(small, output, scratch)
+    import_rss = peak_rss_mb()
+    reducer = OutputReducer(os.path.join(case_dir, "in", f"data_%T.{ext}"),
+                            os.path.join(case_dir, "out", f"data_%T.{ext}"), BIN, BIN, BIN,
+                            checkpoint_path=os.path.join(case_dir, "checkpoint"), **reducer_options)
+    reducer.run()
+    reducer.finalize()
+    times = reducer.stage_times
+    shape = case_shape(case["ndim"], case["cells"])
+    input_bytes = int(np.prod(shape)) * np.dtype(case["dtype"]).itemsize * case["meshes"] * \
+        case["iterations"]
+    return dict(case,
+                name=case_name(case),
+                shape=shape,
+                input_bytes=input_bytes,
+                read_s=times.busy["read"],
+                reduce_s=times.busy["reduce"],
+                write_s=times.busy["write"],
+                wall_s=times.wall,
+                throughput_MBps=input_bytes / times.wall / 1e6,
+                import_rss_MB=import_rss,
+                peak_rss_MB=peak_rss_mb())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OutputReducer.run on synthetic openPMD "
+                                                 "series.")
+    parser.add_argument("--backends", nargs='+', choices=list(EXTENSIONS), default=list(EXTENSIONS))
+    parser.add_argument("--dims", nargs='+', type=int, choices=[1, 2, 3], default=[1, 2, 3])
+    parser.add_argument("--dtypes", nargs='+', choices=["float32", "float64"],
+                        default=["float32", "float64"])
+    parser.add_argument("--meshes", nargs='+', type=int, default=[1, 4],
+                        help="Numbers of meshes per iteration.")
+    parser.add_argument("--cells", nargs='+', type=float, default=[1e6, 8e6],
+                        help="Approximate numbers of cells per mesh.")
+    parser.add_argument("--iterations", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs per case, the fastest one is reported.")
+    parser.add_argument("--quick", action='store_true',
+                        help="Only 3D, float32, one mesh count and one small size, for a fast "
+                             "sanity check.")
+    parser.add_argument("--reducer-options", type=json.loads, default={},
+                        help="JSON object with keyword arguments for OutputReducer, e.g. "
+                             "'{\"pipeline\": true}'.")
+    parser.add_argument("--workdir", type=str, default=None,
+                        help="Directory for the synthetic series, a temporary directory (removed "
+                             "afterwards) if not set.")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Write the results to this JSON file.")
+    parser.add_argument("--verbose", action='store_true', help="Show the output of the reducer.")
+    # internal: run a single case in this process and write its result to a file
+    parser.add_argument("--run-case", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        case, case_dir, result_file = json.loads(args.run_case)
+        with open(result_file, 'w') as f:
+            json.dump(run_case(case, case_dir, args.reducer_options), f)
+        return
+
+    if args.quick:
+        args.dims, args.dtypes, args.meshes, args.cells = [3], ["float32"], [1], [1e6]
+    import openpmd_api as api
+    backends = [backend for backend in args.backends
+                if api.variants.get("adios2" if backend == "bp" else backend)]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="field_reduce_bench_")
+    results = []
+    print(f"{'case':>36} {'read [s]':>9} {'reduce [s]':>10} {'write [s]':>9} {'wall [s]':>9} "
+          f"{'MB/s':>8} {'peak RSS [MB]':>13}")
+    try:
+        for backend, ndim, dtype, meshes, cells in itertools.product(backends, args.dims,
+                                                                     args.dtypes, args.meshes,
+                                                                     args.cells):
+            case = {"backend": backend, "ndim": ndim, "dtype": dtype, "meshes": meshes,
+                    "cells": int(cells), "iterations": args.iterations}
+            case_dir = os.path.join(workdir, case_name(case))
+            shutil.rmtree(case_dir, ignore_errors=True)
+            write_series(os.path.join(case_dir, "in", f"data_%T.{EXTENSIONS[backend]}"), case)
+            result_file = os.path.join(case_dir, "result.json")
+            result = None
+            for _ in range(args.repeat):
+                # start from scratch, the checkpoint would make the reducer skip the already reduced
+                # iterations
+                shutil.rmtree(os.path.join(case_dir, "out"), ignore_errors=True)
+                if os.path.exists(os.path.join(case_dir, "checkpoint")):
+                    os.remove(os.path.join(case_dir, "checkpoint"))
+                subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case",
+                                json.dumps([case, case_dir, result_file]),
+                                "--reducer-options", json.dumps(args.reducer_options)],
+                               check=True, stdout=None if args.verbose else subprocess.DEVNULL)
+                with open(result_file) as f:
+                    run_result = json.load(f)
+                if result is None or run_result["wall_s"] < result["wall_s"]:
+                    result = run_result
+            results.append(result)
+            print(f"{result['name']:>36} {result['read_s']:>9.3f} {result['reduce_s']:>10.3f} "
+                  f"{result['write_s']:>9.3f} {result['wall_s']:>9.3f} "
+                  f"{result['throughput_MBps']:>8.1f} {result['peak_rss_MB']:>13.1f}", flush=True)
+            # the series of a case are not needed any more, keep the disk usage to a single case
+            shutil.rmtree(os.path.join(case_dir, "in"), ignore_errors=True)
+            shutil.rmtree(os.path.join(case_dir, "out"), ignore_errors=True)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        write_results(args.json, "end_to_end", [dict(result, reducer_options=args.reducer_options)
+                                                for result in results])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+""" Benchmark of the downscale kernels
+
+For 1D/2D/3D float32 and float64 inputs and both accumulation precisions this reports the bytes that
+have to move between memory and the cores per output cell (input bin + output cell, the scratch rows
+stay in cache) and the achieved bandwidth.
+
+usage: python benchmarks/kernels.py [--cells 2e7] [--repeat 5] [--json results.json]
+
+Compare two JSON files with benchmarks/compare.py.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from field_reduce.downscale_kernel import downscale, make_scratch
+
+from common import write_results
+
+BINS = {1: (8,), 2: (4, 4), 3: (2, 2, 2)}
+
+
+def input_shape(ndim: int, cells: int) -> tuple:
+    bins = BINS[ndim]
+    side = int(round(cells ** (1 / ndim)))
+    return tuple(max(side // bb, 1) * bb for bb in bins)
+
+
+def bench(ndim: int, dtype, precision: str, cells: int, repeat: int) -> dict:
+    shape = input_shape(ndim, cells)
+    input_arr = np.random.random(shape).astype(dtype)
+    output_arr = np.empty([ss // bb for ss, bb in zip(shape, BINS[ndim])], dtype=dtype)
+    scratch = make_scratch(output_arr.shape, dtype, precision)
+    # compile and warm up
+    downscale(input_arr, output_arr, scratch)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        downscale(input_arr, output_arr, scratch)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    bytes_moved = input_arr.nbytes + output_arr.nbytes
+    return {
+        "name": f"{ndim}d-{np.dtype(dtype).name}-{precision}",
+        "ndim": ndim,
+        "dtype": np.dtype(dtype).name,
+        "precision": precision,
+        "input_shape": list(shape),
+        "bins": list(BINS[ndim]),
+        "bytes_per_output_cell": bytes_moved / output_arr.size,
+        "scratch_bytes": scratch.nbytes,
+        "best_time_s": best,
+        "bandwidth_GBps": bytes_moved / best / 1e9,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the downscale kernels.")
+    parser.add_argument("--cells", type=float, default=2e7,
+                        help="Approximate number of input cells.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of timed runs, the best one is reported.")
+    parser.add_argument("--json", type=str, default=None,
+                        help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'dim':>3} {'dtype':>8} {'acc':>8} {'B/out cell':>10} {'scratch B':>10} "
+          f"{'time [ms]':>10} {'GB/s':>7}")
+    for ndim in (1, 2, 3):
+        for dtype in (np.float32, np.float64):
+            for precision in ("native", "float64"):
+                result = bench(ndim, dtype, precision, int(args.cells), args.repeat)
+                results.append(result)
+                print(f"{ndim:>3} {result['dtype']:>8} {precision:>8} "
+                      f"{result['bytes_per_output_cell']:>10.1f} {result['scratch_bytes']:>10} "
+                      f"{result['best_time_s'] * 1e3:>10.2f} {result['bandwidth_GBps']:>7.2f}")
+    if args.json:
+        write_results(args.json, "kernels", results)
+
+
+if __name__ == "__main__":
+    main()
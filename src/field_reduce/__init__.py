@@ -1,3 +1,18 @@
-from .field_reduce import main
-from .OutputReducer import OutputReducer
-from .downscale_kernel import downscale
+# the submodules are imported on first use, so that e.g. field-reduce --help does not load numba and
+# openPMD-api
+
+
+def __getattr__(name):
+    if name == "main":
+        from .field_reduce import main
+        return main
+    if name == "OutputReducer":
+        from .output_reducer import OutputReducer
+        return OutputReducer
+    if name == "Reduction":
+        from .reduction import Reduction
+        return Reduction
+    if name == "downscale":
+        from .downscale_kernel import downscale
+        return downscale
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,95 @@
+""" Builds the ahead-of-time compiled kernels
+
+usage: python -m field_reduce.aot [--output-dir DIR]
+
+Compiles serial versions of the built-in reduction kernels (see downscale_kernel) for float32 and
+float64 data in 1D, 2D and 3D, accumulating in the data's own precision or in float64, into the
+extension module field_reduce._aot_kernels. With it installed a run starts reducing right away
+instead of waiting for numba to compile the kernels it needs, which are compiled in the background
+meanwhile (see downscale_kernel.KernelCompiler). Outputs in another data type than the input (see
+encoding.OutputEncoding) always use the JIT compiled kernels.
+
+Needs numba's pycc and a C compiler. The module only fits the numba and numpy versions it was built
+with, rebuild it after upgrading them.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from numba.pycc import CC
+
+from .downscale_kernel import (BINNING_OPS, _make_binning_kernels, _make_decimate_kernels,
+                               aot_kernel_name)
+
+MODULE_NAME = "_aot_kernels"
+AOT_DTYPES = (np.float32, np.float64)
+NDIMS = (1, 2, 3)
+# numba signature codes of the data types
+TYPE_CODES = {np.dtype(np.float32): 'f4', np.dtype(np.float64): 'f8'}
+
+
+def _array_type(dtype, ndim: int) -> str:
+    return f"{TYPE_CODES[np.dtype(dtype)]}[{', '.join(':' * ndim)}]"
+
+
+# the exported functions take the bins as an int64 array, they unpack it into the tuple the kernels
+# expect
+
+def _wrap(kernel, ndim: int, scratch: bool):
+    if scratch:
+        if ndim == 1:
+            return lambda input_arr, output_arr, scratch, bins: kernel(
+                input_arr, output_arr, scratch, (bins[0],), None, None)
+        if ndim == 2:
+            return lambda input_arr, output_arr, scratch, bins: kernel(
+                input_arr, output_arr, scratch, (bins[0], bins[1]), None, None)
+        return lambda input_arr, output_arr, scratch, bins: kernel(
+            input_arr, output_arr, scratch, (bins[0], bins[1], bins[2]), None, None)
+    if ndim == 1:
+        return lambda input_arr, output_arr, bins: kernel(
+            input_arr, output_arr, None, (bins[0],), None, None)
+    if ndim == 2:
+        return lambda input_arr, output_arr, bins: kernel(
+            input_arr, output_arr, None, (bins[0], bins[1]), None, None)
+    return lambda input_arr, output_arr, bins: kernel(
+        input_arr, output_arr, None, (bins[0], bins[1], bins[2]), None, None)
+
+
+def make_module(output_dir: str) -> CC:
+    """ Declares all exported kernels of the module, see aot_kernel_name for their names """
+    cc = CC(MODULE_NAME)
+    cc.output_dir = output_dir
+    cc.verbose = True
+    for name, op in BINNING_OPS.items():
+        kernels = _make_binning_kernels(op, parallel=False)
+        for ndim in NDIMS:
+            scratch_ndim = 1 if ndim == 1 else 2
+            for dtype in AOT_DTYPES:
+                for scratch_dtype in sorted({np.dtype(dtype), np.dtype(np.float64)},
+                                            key=lambda dt: dt.itemsize):
+                    signature = (f"void({_array_type(dtype, ndim)}, {_array_type(dtype, ndim)}, "
+                                 f"{_array_type(scratch_dtype, scratch_ndim)}, i8[::1])")
+                    cc.export(aot_kernel_name(name, ndim, dtype, scratch_dtype), signature)(
+                        _wrap(kernels[ndim], ndim, scratch=True))
+    kernels = _make_decimate_kernels(parallel=False)
+    for ndim in NDIMS:
+        for dtype in AOT_DTYPES:
+            signature = f"void({_array_type(dtype, ndim)}, {_array_type(dtype, ndim)}, i8[::1])"
+            cc.export(aot_kernel_name('decimate', ndim, dtype),
+                      signature)(_wrap(kernels[ndim], ndim, scratch=False))
+    return cc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the ahead-of-time compiled kernels of "
+                                                 "field_reduce.")
+    parser.add_argument("--output-dir", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Directory the extension module is written to, the field_reduce "
+                             "package by default.")
+    args = parser.parse_args()
+    make_module(args.output_dir).compile()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+""" Parsers and choices of the command line options
+
+Kept free of numba and openPMD-api, so that field-reduce --help and invalid arguments are answered
+without loading them.
+"""
+import argparse
+
+from .encoding import get_encoding
+
+# the built-in reduction operators (see downscale_kernel.REDUCTION_OPERATORS), particle quantities
+# (see particles), backpressure policies (see backpressure) and ways to allocate large buffers (see
+# buffers)
+OPERATOR_NAMES = ('mean', 'sum', 'min', 'max', 'rms', 'decimate')
+PARTICLE_QUANTITIES = ('density', 'current', 'energy')
+BACKPRESSURE_POLICIES = ('skip', 'coarsen', 'decimate', 'meshes')
+LARGE_BUFFER_KINDS = ('malloc', 'mmap', 'hugepages')
+
+
+def parse_size(size: str) -> int:
+    """ Converts a human-readable size like '512M' or '4GB' into bytes
+
+    :param size: an integer number of bytes, optionally followed by K, M, G or T (binary multiples)
+    :return: number of bytes
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    value = size.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def parse_roi(entry: str) -> tuple:
+    """ Converts a region of interest along one axis like 'x=100:400' into ('x', (100.0, 400.0))
+
+    Either bound may be left out (e.g. 'z=:200') and is None then.
+    """
+    axis, sep, bounds = entry.partition('=')
+    start, sep_bounds, stop = bounds.partition(':')
+    if not sep or not sep_bounds or not axis:
+        raise ValueError(f"invalid region of interest {entry!r}, expected e.g. x=100:400")
+    return axis, tuple(float(bound) if bound.strip() else None for bound in (start, stop))
+
+
+def parse_output_dtype(entry: str) -> tuple:
+    """ Splits an --output-dtype entry like 'E=float32' into ('E', 'float32'), checking its type
+
+    An entry without a mesh name, like 'int16:1e-3', gives (None, 'int16:1e-3').
+    """
+    mesh_name, spec = entry.split('=', 1) if '=' in entry else (None, entry)
+    try:
+        get_encoding(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return mesh_name, spec
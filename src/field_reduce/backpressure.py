@@ -0,0 +1,89 @@
+""" Keeping up with a stream by degrading steps while the reduction falls behind the writer
+
+A reader that is slower than the writer of an SST stream makes the writer block once its queue is
+full, stalling the simulation. Whether the reduction keeps up shows in how long it waits for the
+next step: a writer that is slower has the step ready only later, one that is faster has it queued
+already. Backpressure keeps exponentially decaying sums of the time spent waiting for steps and the
+time spent processing them, the run counts as falling behind while the waiting is less than a margin
+of the total. Each step taken then is degraded by a policy:
+
+  skip      every n-th of the steps taken while behind is dropped unread
+  coarsen   the step is reduced with all bin factors multiplied by a factor
+  decimate  the step is reduced with the decimate operator, which reads only the first cell of
+            each bin
+  meshes    the low priority meshes are left out of the step
+
+Steps of a file based series on disk are always ready, so this is only meant for streams.
+"""
+from typing import Iterable, Optional
+
+from .arguments import BACKPRESSURE_POLICIES as POLICIES
+
+
+class Backpressure:
+    """ Decides which steps of a stream are degraded, see the module description
+
+    :param policy: one of POLICIES
+    :param margin: the run falls behind when waiting for steps takes less than this fraction of the
+        time
+    :param every: 'skip' drops every every-th step taken while behind, 1 drops all of them
+    :param factor: 'coarsen' multiplies the bin factors by this
+    :param meshes: meshes 'meshes' leaves out
+    :param decay: weight of the past in the decaying sums, per step
+    """
+
+    def __init__(self, policy: str, margin: float = 0.1, every: int = 2, factor: int = 2,
+                 meshes: Iterable[str] = (), decay: float = 0.7):
+        if policy not in POLICIES:
+            raise ValueError(f"backpressure policy has to be one of {POLICIES}, not {policy!r}")
+        if not 0.0 < margin < 1.0:
+            raise ValueError("the backpressure margin has to be between 0 and 1")
+        if every < 1:
+            raise ValueError("every has to be at least 1")
+        if factor < 2:
+            raise ValueError("the coarsening factor has to be at least 2")
+        meshes = list(meshes)
+        if policy == 'meshes' and not meshes:
+            raise ValueError("the 'meshes' policy needs the low priority meshes to leave out")
+        self.policy = policy
+        self.margin = margin
+        self.every = every
+        self.factor = factor
+        self.meshes = meshes
+        self.decay = decay
+        self.waited = 0.0
+        self.busy = 0.0
+        self.steps = 0
+        self._behind_steps = 0
+        # number of steps degraded by each policy (and skipped by 'skip')
+        self.degraded = 0
+
+    @property
+    def behind(self) -> bool:
+        """ Whether waiting for steps took less than the margin of the time lately """
+        total = self.waited + self.busy
+        return self.busy > 0.0 and self.waited < self.margin * total
+
+    def begin_step(self, wait: float) -> Optional[str]:
+        """ Records how long the reader waited for a step and decides how the step is processed
+
+        :return: the policy to degrade the step by, None to process it as usual
+        """
+        self.waited = self.decay * self.waited + wait
+        if not self.behind:
+            self._behind_steps = 0
+            return None
+        self._behind_steps += 1
+        if self.policy == 'skip' and self._behind_steps % self.every != 0:
+            return None
+        self.degraded += 1
+        return self.policy
+
+    def end_step(self, busy: float) -> None:
+        """ Records how long a step took from getting it to waiting for the next one
+
+        The first step is left out, it includes compiling the kernels and setting everything up.
+        """
+        self.steps += 1
+        if self.steps > 1:
+            self.busy = self.decay * self.busy + busy
@@ -0,0 +1,124 @@
+""" Pool of reusable data buffers
+
+Every iteration of a stream loads and writes record components of the same shapes and data types.
+Instead of allocating fresh arrays for them each time, which fragments the heap and makes the
+resident memory creep up over long runs, OutputReducer takes its buffers from a BufferPool and hands
+them back once nothing refers to them any more: input buffers after their reduction, output buffers
+after the flush that writes them.
+
+Large buffers may be memory mapped instead of coming from the heap, optionally advising the kernel
+to back them with transparent huge pages, which saves TLB misses when the kernels stream through
+them.
+"""
+import mmap
+import threading
+
+import numpy as np
+
+from .arguments import LARGE_BUFFER_KINDS
+
+
+def allocate(shape, dtype, kind: str = 'malloc') -> np.ndarray:
+    """ Allocates an uninitialized array
+
+    :param kind: 'malloc' allocates it on the heap like np.empty, 'mmap' maps anonymous memory,
+        which is returned to the operating system as soon as the array is freed, and 'hugepages' in
+        addition asks for transparent huge pages (where the platform supports it, otherwise it is
+        the same as 'mmap')
+    """
+    if kind not in LARGE_BUFFER_KINDS:
+        raise ValueError(f"large buffers have to be one of {LARGE_BUFFER_KINDS}, not {kind!r}")
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    if kind == 'malloc' or count == 0:
+        return np.empty(shape, dtype=dtype)
+    mapping = mmap.mmap(-1, count * dtype.itemsize)
+    if kind == 'hugepages' and hasattr(mmap, 'MADV_HUGEPAGE'):
+        try:
+            mapping.madvise(mmap.MADV_HUGEPAGE)
+        except OSError:
+            # transparent huge pages are disabled
+            pass
+    return np.frombuffer(mapping, dtype=dtype, count=count).reshape(shape)
+
+
+class BufferPool:
+    """ Hands out arrays by shape and data type, reusing those given back
+
+    Buffers that were not handed out again since the previous call of trim are freed by trim, so
+    that the pool follows changes of the iterations' layout. Thread safe.
+
+    :param reuse: if false every buffer is allocated anew and given back ones are dropped
+    :param large_buffers: how buffers of at least large_buffer_size bytes are allocated, see
+        allocate
+    :param large_buffer_size: size in bytes from which on buffers count as large
+    """
+
+    def __init__(self, reuse: bool = True, large_buffers: str = 'malloc',
+                 large_buffer_size: int = 1 << 26):
+        if large_buffers not in LARGE_BUFFER_KINDS:
+            raise ValueError(f"large buffers have to be one of {LARGE_BUFFER_KINDS}, not "
+                             f"{large_buffers!r}")
+        self.reuse = reuse
+        self.large_buffers = large_buffers
+        self.large_buffer_size = large_buffer_size
+        # (shape, dtype) -> idle buffers with the generation they were last handed out in
+        self._idle: dict[tuple, list] = {}
+        # buffers handed out by id, with their key and the generation they were handed out in
+        self._lent: dict[int, tuple] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    @property
+    def idle_bytes(self) -> int:
+        with self._lock:
+            return sum(buffer.nbytes for buffers in self._idle.values() for buffer, _ in buffers)
+
+    def acquire(self, shape, dtype) -> np.ndarray:
+        """ An uninitialized buffer of the given shape and data type, give it back with release """
+        key = (tuple(int(length) for length in shape), np.dtype(dtype))
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                buffer, _ = idle.pop()
+                self.reused += 1
+            else:
+                buffer = None
+                self.allocated += 1
+        if buffer is None:
+            nbytes = int(np.prod(key[0])) * key[1].itemsize
+            buffer = allocate(key[0], key[1],
+                              self.large_buffers if nbytes >= self.large_buffer_size else 'malloc')
+        if self.reuse:
+            with self._lock:
+                self._lent[id(buffer)] = (key, buffer, self._generation)
+        return buffer
+
+    def release(self, *buffers) -> None:
+        """ Gives buffers back, once nothing refers to them any more. Buffers given twice or not
+        from this pool, and None, are ignored. """
+        with self._lock:
+            for buffer in buffers:
+                lent = self._lent.pop(id(buffer), None) if buffer is not None else None
+                if lent is None:
+                    continue
+                key, buffer, generation = lent
+                self._idle.setdefault(key, []).append((buffer, generation))
+
+    def trim(self) -> None:
+        """ Frees the idle buffers that were not handed out since the previous call """
+        with self._lock:
+            for key in list(self._idle):
+                self._idle[key] = [(buffer, generation) for buffer, generation in self._idle[key]
+                                   if generation == self._generation]
+                if not self._idle[key]:
+                    del self._idle[key]
+            self._generation += 1
+
+    def clear(self) -> None:
+        """ Frees all idle buffers and forgets those handed out """
+        with self._lock:
+            self._idle.clear()
+            self._lent.clear()
@@ -0,0 +1,298 @@
+""" Checkpoint of the iterations completed by previous runs
+
+The checkpoint is a manifest: after a header line, every completed iteration is one line holding a
+JSON object with its index and the size and CRC-32 of each output file written for it, followed by a
+tab and the CRC-32 of the JSON text. Lines are only ever appended, in a single write that is synced
+to disk, so that several processes may record their iterations in the same file and a crash can at
+most leave a torn last line, which fails its checksum and is ignored. Rewriting the whole file
+(creating, converting or repairing it) goes through a temporary file that replaces the old one
+atomically.
+
+On restart the output files of every listed iteration are checked against the manifest (see
+verify_entry), iterations whose output is missing, truncated or changed are reduced again.
+"""
+import json
+import os
+import pathlib
+import queue
+import re
+import threading
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Optional
+
+import openpmd_api as api
+
+CHECKPOINT_HEADER = "# field-reduce checkpoint: completed iterations, one JSON object per line"
+# the header of older versions, which listed the bare iteration indices
+CHECKPOINT_PREFIX = "# field-reduce checkpoint"
+VERIFY_MODES = ('none', 'size', 'checksum')
+READ_SIZE = 1 << 24
+ITERATION_PATTERN = re.compile(r"%(0\d+)?T")
+
+
+def default_checkpoint_path(source_path: str) -> str:
+    """ field_reduce_checkpoint_<input_filename>, the file name without directory and extension """
+    return f"field_reduce_checkpoint_{pathlib.Path(source_path).stem}"
+
+
+def output_files(output_path: str, idx: int) -> list:
+    """ Files written for an iteration of a file based series, all files below a directory (ADIOS2)
+
+    :param output_path: path of the series, with %T (or e.g. %06T for zero padded indices)
+    :return: absolute paths of the files that exist, an empty list for other iteration encodings
+    """
+    if ITERATION_PATTERN.search(output_path) is None:
+        return []
+
+    def expand(match):
+        width = match.group(1)
+        return f"{idx:{width}d}" if width else str(idx)
+
+    path = os.path.abspath(ITERATION_PATTERN.sub(expand, output_path))
+    if os.path.isdir(path):
+        return sorted(os.path.join(directory, name) for directory, _, names in os.walk(path)
+                      for name in names)
+    return [path] if os.path.exists(path) else []
+
+
+def file_checksum(path: str, sync: bool = False) -> tuple:
+    """ Size and CRC-32 of a file
+
+    :param sync: if true the file is synced to disk first, so that it is not recorded before it is
+        durable
+    :return: (bytes, crc32)
+    """
+    crc = 0
+    nbytes = 0
+    with open(path, 'rb') as f:
+        if sync:
+            os.fsync(f.fileno())
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            nbytes += len(data)
+    return nbytes, crc
+
+
+def make_entry(idx: int, paths: Iterable[str] = (), sync: bool = False) -> dict:
+    """ Manifest entry of a completed iteration with the size and checksum of its output files """
+    files = []
+    for path in paths:
+        nbytes, crc = file_checksum(path, sync)
+        files.append({"path": path, "bytes": nbytes, "crc32": crc})
+    return {"iteration": idx, "files": files}
+
+
+def format_entry(entry: dict) -> str:
+    payload = json.dumps(entry, sort_keys=True)
+    return f"{payload}\t{zlib.crc32(payload.encode()):08x}\n"
+
+
+def parse_entry(line: str) -> Optional[dict]:
+    """ Entry of a manifest line, None if damaged. Bare indices of older versions have no files. """
+    if line.isdigit():
+        return {"iteration": int(line), "files": []}
+    payload, _, crc = line.rpartition("\t")
+    try:
+        if int(crc, 16) != zlib.crc32(payload.encode()):
+            return None
+        entry = json.loads(payload)
+        return {"iteration": int(entry["iteration"]), "files": list(entry["files"])}
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _sync_directory(path: str) -> None:
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        # directories can not be opened on some platforms (Windows), the rename is still atomic
+        # there
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_checkpoint(path: str, completed: Iterable) -> None:
+    """ Replaces a checkpoint file atomically by one listing the given completed iterations
+
+    :param completed: manifest entries (see make_entry) or bare iteration indices, which have no
+        files to verify
+    """
+    entries = [make_entry(entry) if isinstance(entry, int) else entry for entry in completed]
+    entries.sort(key=lambda entry: entry["iteration"])
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, 'w') as f:
+        f.write(f"{CHECKPOINT_HEADER}\n" + "".join(format_entry(entry) for entry in entries))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    _sync_directory(path)
+
+
+def append_checkpoint(path: str, idx: int, paths: Iterable[str] = ()) -> None:
+    """ Adds a completed iteration with the size and checksum of its output files to a checkpoint
+
+    A single synced append, so that several processes may record their iterations in the same file.
+    """
+    line = format_entry(make_entry(idx, paths, sync=True)).encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_checkpoint(path: str) -> tuple:
+    """ Reads a checkpoint file
+
+    :return: (entries by iteration, number of damaged lines, last iteration of an old single number
+        checkpoint or None)
+    """
+    with open(path, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if lines and not lines[0].startswith(CHECKPOINT_PREFIX):
+        return {}, 0, int(lines[0])
+    entries = {}
+    damaged = 0
+    for line in lines[1:]:
+        entry = parse_entry(line)
+        if entry is None:
+            damaged += 1
+        else:
+            entries[entry["iteration"]] = entry
+    return entries, damaged, None
+
+
+def verify_entry(entry: dict, verify: str = 'size') -> bool:
+    """ Checks that the output files of a manifest entry still exist, with the recorded size
+    ('size') or also the recorded checksum ('checksum'). Entries without files (other iteration
+    encodings, older versions) are trusted.
+    """
+    for record in entry["files"]:
+        try:
+            if os.path.getsize(record["path"]) != record["bytes"]:
+                return False
+            if verify == 'checksum' and \
+                    file_checksum(record["path"]) != (record["bytes"], record["crc32"]):
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def load_checkpoint(path: str, input_series: Optional[api.Series], first_iteration: int,
+                    verify: str = 'size', repair: bool = True,
+                    output_paths: Optional[Iterable[str]] = None) -> tuple:
+    """ Reads the iterations completed by previous runs from a checkpoint file
+
+    The checkpoint is only used if first_iteration is at its default (-1). The output of every
+    listed iteration is verified (see verify_entry, several iterations are checked in parallel),
+    those that fail are dropped and processed again. Older versions only stored the last completed
+    iteration, processing restarts after it as before. For file based series such a file is
+    converted to the list of the input's iterations up to it, otherwise to an empty list.
+
+    :param verify: how the output of the completed iterations is checked, 'none', 'size' or
+        'checksum'
+    :param repair: if true a missing, old or damaged checkpoint file (or one listing iterations that
+        failed the verification) is rewritten. Only one process may do this, while no other one
+        appends to the file.
+    :param output_paths: paths of the output series. If one of them is not file based (no %T), it is
+        created anew and holds none of the completed iterations, so the checkpoint is not resumed
+        from and all iterations are processed again. None trusts the checkpoint.
+    :return: set of completed iterations and the first iteration to process
+    """
+    if verify not in VERIFY_MODES:
+        raise ValueError(f"verify has to be one of {VERIFY_MODES}, not {verify!r}")
+    entries = {}
+    rewrite = not os.path.exists(path)
+    if first_iteration == -1 and not rewrite:
+        try:
+            entries, damaged, last = read_checkpoint(path)
+            overwritten = [output_path for output_path in (output_paths or [])
+                           if ITERATION_PATTERN.search(output_path) is None]
+            if overwritten and (entries or last is not None):
+                print(f"Warning: Not resuming from checkpoint file {path}, the output "
+                      f"{overwritten[0]} is not file based (%T in its path) and is created anew, "
+                      "all iterations are processed again",
+                      flush=True)
+                entries, last, rewrite = {}, None, True
+            if last is not None:
+                first_iteration = last + 1
+                print(f"Loaded checkpoint: resuming from iteration {first_iteration}", flush=True)
+                if input_series is not None and \
+                        input_series.iteration_encoding == api.Iteration_Encoding.file_based:
+                    entries = {idx: make_entry(idx)
+                               for idx in input_series.iterations if idx <= last}
+                rewrite = True
+            if damaged:
+                print(f"Warning: Ignoring {damaged} damaged line(s) of checkpoint file {path}",
+                      flush=True)
+                rewrite = True
+            if verify != 'none' and entries:
+                workers = min(len(entries), os.cpu_count() or 1, 16)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    valid = list(executor.map(partial(verify_entry, verify=verify),
+                                              entries.values()))
+                for entry, ok in zip(list(entries.values()), valid):
+                    if not ok:
+                        print(f"Warning: The output of iteration {entry['iteration']} is missing "
+                              "or does not match the checkpoint, it is processed again", flush=True)
+                        del entries[entry["iteration"]]
+                        rewrite = True
+            if last is None:
+                print(f"Loaded checkpoint: {len(entries)} iteration(s) completed already",
+                      flush=True)
+        except (ValueError, IOError) as e:
+            print(f"Warning: Failed to read checkpoint file {path}: {e}", flush=True)
+            rewrite = False
+    if repair and rewrite:
+        try:
+            write_checkpoint(path, entries.values())
+        except IOError as e:
+            print(f"Warning: Failed to write checkpoint file {path}: {e}", flush=True)
+    return set(entries), first_iteration
+
+
+class CheckpointWriter:
+    """ Records completed iterations in a checkpoint file from a background thread
+
+    Checksumming the output files and syncing them and the checkpoint to disk is left to the thread,
+    so that the next iteration does not wait for it. An iteration that is not recorded yet when the
+    process dies is simply processed again on restart. Failures are reported as warnings, like
+    before.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="field-reduce-checkpoint",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, idx: int, paths: Iterable[str] = ()) -> None:
+        """ Records an iteration whose output files are closed """
+        self._queue.put((idx, list(paths)))
+
+    def close(self) -> None:
+        """ Waits until all submitted iterations are recorded """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                append_checkpoint(self.path, *item)
+            except IOError as e:
+                print(f"Warning: Failed to write checkpoint file {self.path}: {e}", flush=True)
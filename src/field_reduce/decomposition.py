@@ -0,0 +1,273 @@
+# Chunk is copied from openpmd-pipe, the block decomposition is our own addition
+
+import math
+
+
+def _factorizations(n, ndim):
+    # all ways of writing n as an ordered product of ndim positive integers
+    if ndim == 1:
+        yield (n,)
+        return
+    for first in range(1, n + 1):
+        if n % first == 0:
+            for rest in _factorizations(n // first, ndim - 1):
+                yield (first,) + rest
+
+
+def rank_grid(mpi_size, bins):
+    """
+    Picks how many ranks to place along each axis, so that mpi_size ranks
+    share a grid with the given number of bins per axis as evenly as
+    possible. Minimizes the largest number of bins per rank first, then
+    the number of cut cells (the surface between blocks) and prefers
+    splitting the slow (first) axes, which keeps reads contiguous. Grids
+    with more ranks than bins along an axis (and hence idle ranks) are only
+    picked if there is no other choice.
+    """
+    best_key = None
+    best_grid = None
+    for grid in _factorizations(mpi_size, len(bins)):
+        work = 1
+        for b, g in zip(bins, grid):
+            work *= -(-b // g)
+        surface = 0
+        for axis, g in enumerate(grid):
+            surface += (g - 1) * math.prod(bins[:axis] + bins[axis + 1:])
+        empty = sum(max(g - b, 0) for b, g in zip(bins, grid))
+        key = (empty, work, surface, [-g for g in grid])
+        if best_key is None or key < best_key:
+            best_key = key
+            best_grid = list(grid)
+    return best_grid
+
+
+class Chunk:
+    """
+    A Chunk is an n-dimensional hypercube, defined by an offset and an extent.
+    Offset and extent must be of the same dimensionality (Chunk.__len__).
+    """
+
+    def __init__(self, offset, extent):
+        assert (len(offset) == len(extent))
+        self.offset = offset
+        self.extent = extent
+
+    def __len__(self):
+        return len(self.offset)
+
+    def slice1D(self, mpi_rank, mpi_size, divisible=1, dimension=None):
+        """
+        Slice this chunk into mpi_size hypercubes along one of its
+        n dimensions. The dimension is given through the 'dimension'
+        parameter. If None, the dimension with the largest extent on
+        this hypercube is automatically picked.
+        Returns the mpi_rank'th of the sliced chunks.
+        """
+        if dimension is None:
+            # pick that dimension which has the highest count of items
+            dimension = 0
+            maximum = self.extent[0]
+            for k, v in enumerate(self.extent):
+                if v > maximum:
+                    dimension = k
+        assert (dimension < len(self))
+        # no offset
+        assert (self.offset == [0 for _ in range(len(self))])
+        offset = [0 for _ in range(len(self))]
+        stride = self.extent[dimension] // mpi_size
+        rest = self.extent[dimension] % mpi_size
+
+        # local function f computes the offset of a rank
+        # for more equal balancing, we want the start index
+        # at the upper gaussian bracket of (N/n*rank)
+        # where N the size of the dataset in dimension dim
+        # and n the MPI size
+        # for avoiding integer overflow, this is the same as:
+        # (N div n)*rank + round((N%n)/n*rank)
+        def f(rank):
+            res = stride * rank
+            padDivident = rest * rank
+            pad = padDivident // mpi_size
+            if pad * mpi_size < padDivident:
+                pad += 1
+            offset_l = res + pad
+            if offset_l % divisible != 0:
+                offset_l += divisible - offset_l % divisible
+            return offset_l
+
+        offset[dimension] = f(mpi_rank)
+        extent = self.extent.copy()
+        if mpi_rank >= mpi_size - 1:
+            extent[dimension] -= offset[dimension]
+        else:
+            extent[dimension] = f(mpi_rank + 1) - offset[dimension]
+
+        return Chunk(offset, extent)
+
+    def downscaled(self, factors, partial=False):
+        """
+        Returns the chunk covering the same region after binning with the
+        given bin factor per dimension. The offset has to be a multiple of
+        the factors. Cells at the upper end not filling a whole bin are
+        dropped, or form a partial bin if 'partial' is set.
+        """
+        assert (len(factors) == len(self))
+        if partial:
+            extent = [-(-e // f) for e, f in zip(self.extent, factors)]
+        else:
+            extent = [e // f for e, f in zip(self.extent, factors)]
+        return Chunk([o // f for o, f in zip(self.offset, factors)], extent)
+
+    def bin_aligned(self, divisible, shape, partial=False):
+        """
+        Returns the chunk covering all bins whose first cell lies in this
+        chunk, given the bin size divisible[d] per dimension and the shape
+        of the whole domain. Chunks that tile a domain are mapped to bin
+        aligned chunks tiling its bins, at the price of reading up to one
+        bin minus one cell past the upper edges. Cells at the upper end of
+        the domain not filling a whole bin are left out, unless 'partial'
+        is set.
+        """
+        offset = []
+        extent = []
+        for o, e, d, n in zip(self.offset, self.extent, divisible, shape):
+            b = -(-n // d) if partial else n // d
+            start = min(-(-o // d), b) * d
+            end = min(-(-(o + e) // d) * d, b * d, n)
+            offset.append(start)
+            extent.append(max(end - start, 0))
+        return Chunk(offset, extent)
+
+    def intersection(self, other):
+        """
+        Returns the chunk covered by both this chunk and 'other', with an
+        extent of 0 along the dimensions in which they do not overlap.
+        """
+        offset = [max(o, p) for o, p in zip(self.offset, other.offset)]
+        end = [min(o + e, p + f) for o, e, p, f in
+               zip(self.offset, self.extent, other.offset, other.extent)]
+        return Chunk(offset, [max(e - o, 0) for o, e in zip(offset, end)])
+
+    def shifted(self, delta):
+        """
+        Returns this chunk moved by delta[d] cells in every dimension d.
+        """
+        return Chunk([o + d for o, d in zip(self.offset, delta)],
+                     list(self.extent))
+
+    def split(self, thickness, dimension=0):
+        """
+        Splits this chunk along one dimension into consecutive slabs of the
+        given thickness. The last slab is thinner if the extent is not a
+        multiple of thickness.
+        """
+        assert (thickness > 0)
+        slabs = []
+        for start in range(0, self.extent[dimension], thickness):
+            offset = list(self.offset)
+            extent = list(self.extent)
+            offset[dimension] += start
+            extent[dimension] = min(thickness, self.extent[dimension] - start)
+            slabs.append(Chunk(offset, extent))
+        return slabs
+
+    def slice_blocks(self, mpi_rank, mpi_size, divisible=None, grid=None,
+                     partial=False):
+        """
+        Slice this chunk into mpi_size hypercubes arranged in a grid of
+        ranks (see rank_grid, or given through 'grid'), row-major with the
+        first dimension being the slowest. Block boundaries are multiples of
+        divisible[d] in every dimension d, so that no bin is split between
+        ranks. Cells behind the last whole bin of a dimension are not part
+        of any block, unless 'partial' is set, then they are a bin of their
+        own. Blocks may be empty if there are more ranks than bins.
+        Returns the mpi_rank'th of the blocks.
+        """
+        if divisible is None:
+            divisible = [1 for _ in range(len(self))]
+        assert (len(divisible) == len(self))
+        if partial:
+            bins = [-(-e // d) for e, d in zip(self.extent, divisible)]
+        else:
+            bins = [e // d for e, d in zip(self.extent, divisible)]
+        if grid is None:
+            grid = rank_grid(mpi_size, bins)
+        assert (math.prod(grid) == mpi_size)
+        # position of this rank in the grid
+        coordinates = []
+        rest = mpi_rank
+        for g in reversed(grid):
+            coordinates.insert(0, rest % g)
+            rest //= g
+        offset = []
+        extent = []
+        for dd in range(len(self)):
+            # whole bins are distributed as evenly as possible
+            start = (bins[dd] * coordinates[dd]) // grid[dd] * divisible[dd]
+            end = (bins[dd] * (coordinates[dd] + 1)) // grid[dd] * divisible[dd]
+            end = min(end, self.extent[dd])
+            offset.append(self.offset[dd] + start)
+            extent.append(end - start)
+        return Chunk(offset, extent)
+
+
+def assign_blocks(nbytes, source_ids, reader_hosts, writer_hosts=None,
+                  max_imbalance=1.25):
+    """
+    Distributes blocks written by a simulation (see available_chunks) over
+    the reader ranks. Blocks are handed out largest first to the least
+    loaded (in bytes) reader rank on the host their writer ran on. Once
+    that would push a rank beyond max_imbalance times the average load,
+    or if no reader runs on that host, the block goes to the least loaded
+    rank overall. Ties are broken in favour of the rank at the same
+    relative position as the writer, so that neighbouring blocks stay on
+    neighbouring ranks.
+    writer_hosts maps source ids to host names and may be empty if the
+    writer did not record them. Returns the list of block indices
+    assigned to each reader rank.
+    """
+    writer_hosts = writer_hosts or {}
+    n_readers = len(reader_hosts)
+    n_writers = max(source_ids, default=0) + 1
+    ranks_on_host = {}
+    for rank, host in enumerate(reader_hosts):
+        ranks_on_host.setdefault(host, []).append(rank)
+    share = max_imbalance * sum(nbytes) / n_readers
+    loads = [0 for _ in range(n_readers)]
+    assignment = [[] for _ in range(n_readers)]
+    all_ranks = list(range(n_readers))
+    for block in sorted(range(len(nbytes)), key=lambda bb: (-nbytes[bb], bb)):
+        near = source_ids[block] * n_readers // n_writers
+
+        def least_loaded(ranks):
+            return min(ranks, key=lambda rr: (loads[rr], abs(rr - near), rr))
+
+        rank = None
+        local_ranks = ranks_on_host.get(writer_hosts.get(source_ids[block]))
+        if local_ranks:
+            rank = least_loaded(local_ranks)
+            if loads[rank] > 0 and loads[rank] + nbytes[block] > share:
+                rank = None
+        if rank is None:
+            rank = least_loaded(all_ranks)
+        loads[rank] += nbytes[block]
+        assignment[rank].append(block)
+    return assignment
+
+
+def schedule_largest_first(sizes, n_groups):
+    """
+    Distributes independent work items (e.g. iterations) over n_groups
+    workers. sizes maps each item to its cost (e.g. bytes), the items are
+    handed out largest first, each to the worker with the smallest total
+    so far (ties go to the lower worker). Returns the list of items of
+    each worker, largest first, which is also the order to process them
+    in, so that the small items fill the gaps at the end.
+    """
+    loads = [0 for _ in range(n_groups)]
+    schedule = [[] for _ in range(n_groups)]
+    for item in sorted(sizes, key=lambda ii: (-sizes[ii], ii)):
+        group = min(range(n_groups), key=lambda gg: (loads[gg], gg))
+        loads[group] += sizes[item]
+        schedule[group].append(item)
+    return schedule
@@ -1,64 +1,534 @@
+import queue
+import threading
+
 import numpy as np
-from numba import njit, prange, generated_jit
+from typing import Iterable, Optional
+from numba import config, from_dtype, njit, prange, typeof, types, set_num_threads, threading_layer
+from numba.extending import overload
+from numba.np.ufunc.parallel import _launch_threads
+
+from .encoding import OutputEncoding, get_encoding  # noqa: F401
+
+try:
+    # serial kernels compiled ahead of time for the common data types, built with python -m
+    # field_reduce.aot
+    from . import _aot_kernels
+except ImportError:
+    _aot_kernels = None
+
+# Every binning kernel makes a single pass over the input and writes the reduced bins straight into
+# the output. Bins are accumulated in a scratch buffer with one row of accumulators per output row
+# (shape given by scratch_shape), so the precision of the accumulation is set by the scratch dtype
+# and no temporary of the input's size is needed. The kernels get the bin size along each axis
+# explicitly. If the input is not a multiple of the bins, the last bin along an axis is only as
+# large as the remaining cells and e.g. averaged over those, whether it is computed at all is
+# decided by the output's shape. The kernels also convert the results to the output's data type on
+# the fly (see OutputEncoding), so a downcast or a quantisation to integers costs no extra pass over
+# the data.
+
+
+def launch_threads() -> None:
+    """ Starts numba's worker threads from the calling thread
+
+    Some threading layers (e.g. TBB) hang on interpreter exit when their pool was first started from
+    a non-main thread, so call this from the main thread before running kernels in other threads.
+    """
+    _launch_threads()
+
+
+def kernel_threads() -> int:
+    """ Number of threads the kernels may use in total, numba's NUMBA_NUM_THREADS """
+    return config.NUMBA_NUM_THREADS
+
+
+def set_kernel_threads(threads: int) -> None:
+    """ Sets the number of kernel threads started from this thread (numba keeps it per thread) """
+    set_num_threads(threads)
+
+
+def concurrent_kernels() -> bool:
+    """ Whether kernels may run in several threads at the same time
+
+    numba's workqueue threading layer (the fallback if neither TBB nor OpenMP is available) aborts
+    the process when two threads launch parallel kernels at once. Starts numba's worker threads,
+    call it from the main thread.
+    """
+    launch_threads()
+    return threading_layer() != 'workqueue'
+
+
+def accumulation_dtype(dtype, precision: str = 'native') -> np.dtype:
+    """ Data type used to sum up the bins of an array
+
+    :param dtype: data type of the input array
+    :param precision: 'native' to accumulate in the input's own floating point type or 'float64'.
+        Non floating point inputs are always accumulated in float64.
+    """
+    if precision not in ('native', 'float64'):
+        raise ValueError(f"precision has to be 'native' or 'float64', not {precision!r}")
+    dtype = np.dtype(dtype)
+    if precision == 'float64' or not np.issubdtype(dtype, np.floating):
+        return np.dtype(np.float64)
+    return dtype
+
+
+def scratch_shape(output_shape) -> tuple:
+    """ Shape of the scratch buffer the kernels need for an output of the given shape """
+    if len(output_shape) == 1:
+        return tuple(output_shape)
+    return output_shape[0], output_shape[-1]
+
+
+def make_scratch(output_shape, dtype, precision: str = 'native') -> np.ndarray:
+    """ Allocates a scratch buffer that can be passed to downscale
+
+    :param output_shape: shape of the output array
+    :param dtype: data type of the input array
+    :param precision: see accumulation_dtype
+    """
+    return np.empty(scratch_shape(output_shape), dtype=accumulation_dtype(dtype, precision))
+
+
+# op codes of the binning kernels
+MEAN, SUM, MIN, MAX, RMS = range(5)
+
+
+@njit(inline='always', cache=True, nogil=True)
+def _init(op, acc):
+    if op == MIN:
+        acc[:] = np.inf
+    elif op == MAX:
+        acc[:] = -np.inf
+    else:
+        acc[:] = 0
+
+
+@njit(inline='always', cache=True, nogil=True)
+def _combine(op, acc, value):
+    if op == MIN:
+        return min(acc, value)
+    elif op == MAX:
+        return max(acc, value)
+    elif op == RMS:
+        return acc + value * value
+    return acc + value
+
+
+@njit(inline='always', cache=True, nogil=True)
+def _finalize(op, acc, norm):
+    if op == MEAN:
+        return acc * norm
+    elif op == RMS:
+        return np.sqrt(acc * norm)
+    return acc
+
+
+def _rounds(output_arr):
+    pass
+
+
+@overload(_rounds)
+def _rounds_overload(output_arr):
+    # resolved at compile time: integer outputs hold quantised values, which are rounded instead of
+    # truncated
+    rounds = isinstance(output_arr.dtype, types.Integer)
+    return lambda output_arr: rounds
+
+
+@njit(inline='always', cache=True, nogil=True)
+def _store(output_arr, index, value, encoding, errors, row):
+    # writes a result, encoded as (value - offset) / step if an encoding (see
+    # OutputEncoding.parameters) is given. errors[row] then keeps the largest absolute and relative
+    # error of the stored values. errors has to be a separate argument, numba's parallel loops lose
+    # writes to arrays passed inside a tuple.
+    if encoding is None:
+        output_arr[index] = value
+    else:
+        inv_step, offset, step, lowest, highest = encoding
+        encoded = (value - offset) * inv_step
+        if _rounds(output_arr):
+            encoded = min(max(np.rint(encoded), lowest), highest)
+        output_arr[index] = encoded
+        error = abs(output_arr[index] * step + offset - value)
+        errors[row, 0] = max(errors[row, 0], error)
+        if value != 0:
+            errors[row, 1] = max(errors[row, 1], error / abs(value))
+
+
+@njit(inline='always', cache=True, nogil=True)
+def _bin_end(index, bin_length, length):
+    # end of the index-th bin along an axis of the given length, the last bin may be cut short
+    return min((index + 1) * bin_length, length)
+
+
+@njit(inline='always', cache=True, nogil=True)
+def _accumulate_row(op, input_row, acc, bin_length):
+    # combines a contiguous input row, binned along its only axis, into a row of accumulators
+    full = min(acc.shape[0], input_row.shape[0] // bin_length)
+    for kk in range(full):
+        value = acc[kk]
+        for ll in range(kk * bin_length, (kk + 1) * bin_length):
+            value = _combine(op, value, input_row[ll])
+        acc[kk] = value
+    # a last, partial bin
+    for kk in range(full, acc.shape[0]):
+        value = acc[kk]
+        for ll in range(kk * bin_length, input_row.shape[0]):
+            value = _combine(op, value, input_row[ll])
+        acc[kk] = value
+
+
+@njit(inline='always', cache=True, nogil=True)
+def _finalize_row(op, acc, output_row, norm, bin_length, length, encoding, errors, row):
+    # writes a row of accumulators binned along an axis of the given length, norm is that of a full
+    # bin
+    full = min(acc.shape[0], length // bin_length)
+    for kk in range(full):
+        _store(output_row, kk, _finalize(op, acc[kk], norm), encoding, errors, row)
+    for kk in range(full, acc.shape[0]):
+        _store(output_row, kk,
+               _finalize(op, acc[kk], norm * bin_length / (length - kk * bin_length)), encoding,
+               errors, row)
+
+
+def _make_binning_kernels(op: int, parallel: bool = True) -> dict:
+    """ Compiles the 1D, 2D and 3D binning kernels for one op code
+
+    op is a closure constant, so the branches in _init, _combine and _finalize are resolved at
+    compile time. parallel=False gives serial kernels, which can be compiled ahead of time (see
+    aot.py).
+    """
+
+    @njit(parallel=parallel, cache=True, nogil=True)
+    def _bin_1d(input_arr, output_arr, scratch, bins, encoding, errors):
+        bin_length = bins[0]
+        for ii in prange(output_arr.shape[0]):
+            _init(op, scratch[ii:ii + 1])
+            end = _bin_end(ii, bin_length, input_arr.shape[0])
+            _accumulate_row(op, input_arr[ii * bin_length:end], scratch[ii:ii + 1], bin_length)
+            _store(output_arr, ii, _finalize(op, scratch[ii], 1.0 / (end - ii * bin_length)),
+                   encoding, errors, ii)
+
+    @njit(parallel=parallel, cache=True, nogil=True)
+    def _bin_2d(input_arr, output_arr, scratch, bins, encoding, errors):
+        bin_0, bin_1 = bins
+        for ii in prange(output_arr.shape[0]):
+            acc = scratch[ii]
+            _init(op, acc)
+            end_0 = _bin_end(ii, bin_0, input_arr.shape[0])
+            for i_in in range(ii * bin_0, end_0):
+                _accumulate_row(op, input_arr[i_in], acc, bin_1)
+            _finalize_row(op, acc, output_arr[ii], 1.0 / ((end_0 - ii * bin_0) * bin_1), bin_1,
+                          input_arr.shape[1], encoding, errors, ii)
+
+    @njit(parallel=parallel, cache=True, nogil=True)
+    def _bin_3d(input_arr, output_arr, scratch, bins, encoding, errors):
+        bin_0, bin_1, bin_2 = bins
+        for ii in prange(output_arr.shape[0]):
+            acc = scratch[ii]
+            end_0 = _bin_end(ii, bin_0, input_arr.shape[0])
+            for jj in range(output_arr.shape[1]):
+                _init(op, acc)
+                end_1 = _bin_end(jj, bin_1, input_arr.shape[1])
+                for i_in in range(ii * bin_0, end_0):
+                    for j_in in range(jj * bin_1, end_1):
+                        _accumulate_row(op, input_arr[i_in, j_in], acc, bin_2)
+                norm = 1.0 / ((end_0 - ii * bin_0) * (end_1 - jj * bin_1) * bin_2)
+                _finalize_row(op, acc, output_arr[ii, jj], norm, bin_2, input_arr.shape[2],
+                              encoding, errors, ii)
+
+    return {1: _bin_1d, 2: _bin_2d, 3: _bin_3d}
+
+
+_MEAN_KERNELS = _make_binning_kernels(MEAN)
+_mean_1d = _MEAN_KERNELS[1]
+_mean_2d = _MEAN_KERNELS[2]
+_mean_3d = _MEAN_KERNELS[3]
+
+
+# bin means with the bin sizes given by input_arr.shape // output_arr.shape. These call parallel
+# kernels, which only works when loaded from numba's cache if the callers are compiled with
+# parallel=True as well.
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _downscale_1d(input_arr, output_arr, scratch):
+    _mean_1d(input_arr, output_arr, scratch, (input_arr.shape[0] // output_arr.shape[0],), None,
+             None)
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _downscale_2d(input_arr, output_arr, scratch):
+    _mean_2d(input_arr, output_arr, scratch,
+             (input_arr.shape[0] // output_arr.shape[0], input_arr.shape[1] // output_arr.shape[1]),
+             None, None)
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _downscale_3d(input_arr, output_arr, scratch):
+    _mean_3d(input_arr, output_arr, scratch,
+             (input_arr.shape[0] // output_arr.shape[0], input_arr.shape[1] // output_arr.shape[1],
+              input_arr.shape[2] // output_arr.shape[2]), None, None)
+
+
+def _make_decimate_kernels(parallel: bool = True) -> dict:
+    """ Compiles the kernels keeping the first cell of each bin, serial ones for parallel=False """
+
+    @njit(parallel=parallel, cache=True, nogil=True)
+    def _decimate_1d(input_arr, output_arr, scratch, bins, encoding, errors):
+        step = bins[0]
+        for ii in prange(output_arr.shape[0]):
+            _store(output_arr, ii, input_arr[ii * step], encoding, errors, ii)
+
+    @njit(parallel=parallel, cache=True, nogil=True)
+    def _decimate_2d(input_arr, output_arr, scratch, bins, encoding, errors):
+        step_0, step_1 = bins
+        for ii in prange(output_arr.shape[0]):
+            output_row = output_arr[ii]
+            for jj in range(output_arr.shape[1]):
+                _store(output_row, jj, input_arr[ii * step_0, jj * step_1], encoding, errors, ii)
+
+    @njit(parallel=parallel, cache=True, nogil=True)
+    def _decimate_3d(input_arr, output_arr, scratch, bins, encoding, errors):
+        step_0, step_1, step_2 = bins
+        for ii in prange(output_arr.shape[0]):
+            for jj in range(output_arr.shape[1]):
+                output_row = output_arr[ii, jj]
+                for kk in range(output_arr.shape[2]):
+                    _store(output_row, kk, input_arr[ii * step_0, jj * step_1, kk * step_2],
+                           encoding, errors, ii)
+
+    return {1: _decimate_1d, 2: _decimate_2d, 3: _decimate_3d}
+
+
+def aot_kernel_name(operator: str, ndim: int, dtype, scratch_dtype=None) -> str:
+    """ Name of the ahead-of-time compiled kernel, e.g. mean_3d_float32_float64 (scratch last) """
+    name = f"{operator}_{ndim}d_{np.dtype(dtype).name}"
+    return name if scratch_dtype is None else f"{name}_{np.dtype(scratch_dtype).name}"
+
+
+class KernelCompiler:
+    """ Compiles kernels for given argument types in a background thread
+
+    Compiling a parallel kernel takes seconds, loading it from numba's cache much less. Until a
+    kernel is compiled for the types of its arguments ReductionOperator runs the serial
+    ahead-of-time compiled one, if there is one, instead of waiting for the compiler. numba's
+    compiler holds the GIL most of the time, the thread mainly overlaps with I/O, e.g. opening a
+    stream and waiting for its first step. Compiling parallel kernels starts numba's worker threads,
+    so the first submit has to come from the main thread (see launch_threads).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, kernel, argtypes: tuple) -> None:
+        """ Compiles kernel for the numba types argtypes, unless it is compiled or queued """
+        key = (kernel, argtypes)
+        with self._lock:
+            if key in self._pending or argtypes in kernel.overloads:
+                return
+            self._pending.add(key)
+            if self._thread is None:
+                launch_threads()
+                # a daemon, compiling kernels that are not needed any more must not delay the end of
+                # the program
+                self._thread = threading.Thread(target=self._loop, name="field-reduce-compiler",
+                                                daemon=True)
+                self._thread.start()
+        self._queue.put(key)
+
+    def join(self) -> None:
+        """ Waits until all submitted kernels are compiled """
+        self._queue.join()
+
+    def _loop(self) -> None:
+        while True:
+            kernel, argtypes = self._queue.get()
+            try:
+                kernel.compile(argtypes)
+            except Exception as e:
+                # the kernel is compiled again when it is called, which raises the error where it
+                # belongs
+                print(f"Warning: Compiling {kernel.__name__} for {argtypes} failed: {e}",
+                      flush=True)
+            finally:
+                with self._lock:
+                    self._pending.discard((kernel, argtypes))
+                self._queue.task_done()
+
+
+COMPILER = KernelCompiler()
+
+
+class ReductionOperator:
+    """ A way of reducing all cells of a bin to a single value
+
+    :param name: name used to select the operator, e.g. on the command line
+    :param kernels: compiled kernels for 1D, 2D and 3D data, called as kernel(input_arr, output_arr,
+        scratch, bins, encoding, errors) with bins the tuple of bin sizes per axis and encoding and
+        errors as described in OutputEncoding.parameters (both None to just store the results)
+    :param needs_scratch: if false the kernels are called with scratch=None
+    :param strided_read: if true only the first cell of each bin is needed, so a reader may load
+        just every bin-th cell along an axis. The kernels then get an input with the same extent as
+        the output along it.
+    :param aot: if true the kernels have ahead-of-time compiled counterparts named
+        aot_kernel_name(name, ...) in the _aot_kernels module (see aot.py), which are used while the
+        kernels are not compiled yet
+    """
+
+    def __init__(self, name: str, kernels: dict, needs_scratch: bool = True,
+                 strided_read: bool = False, aot: bool = False):
+        self.name = name
+        self.kernels = kernels
+        self.needs_scratch = needs_scratch
+        self.strided_read = strided_read
+        self.aot = aot and _aot_kernels is not None
+
+    def argument_types(self, ndim: int, dtype, scratch_dtype=None,
+                       encoding: Optional[OutputEncoding] = None) -> tuple:
+        """ numba types of the kernel arguments for C contiguous arrays, e.g. to compile in advance
+
+        :param dtype: data type of the input
+        :param scratch_dtype: data type of the scratch buffer (see accumulation_dtype), ignored
+            without scratch
+        :param encoding: encoding of the output, None if it has the input's data type
+        """
+        scratch = types.none
+        if self.needs_scratch:
+            scratch = types.Array(from_dtype(np.dtype(scratch_dtype)),
+                                  len(scratch_shape([1] * ndim)), 'C')
+        output_dtype = np.dtype(dtype) if encoding is None else encoding.dtype
+        encoding_types = (types.none, types.none) if encoding is None else \
+            (typeof(encoding.parameters()), types.Array(types.float64, 2, 'C'))
+        return (types.Array(from_dtype(np.dtype(dtype)), ndim, 'C'),
+                types.Array(from_dtype(output_dtype), ndim, 'C'), scratch,
+                types.UniTuple(types.int64, ndim)) + encoding_types
+
+    def _aot_kernel(self, input_arr: np.ndarray, output_arr: np.ndarray,
+                    scratch: Optional[np.ndarray]):
+        if not self.aot or output_arr.dtype != input_arr.dtype:
+            return None
+        return getattr(_aot_kernels, aot_kernel_name(self.name, input_arr.ndim, input_arr.dtype,
+                                                     None if scratch is None else scratch.dtype),
+                       None)
+
+    def __call__(self, input_arr: np.ndarray, output_arr: np.ndarray,
+                 scratch: Optional[np.ndarray] = None, bins: Optional[tuple] = None,
+                 encoding: Optional[OutputEncoding] = None) -> Optional[tuple]:
+        """ Reduces input_arr into output_arr
+
+        :param bins: bin size along each axis, input_arr.shape // output_arr.shape if not given. The
+            last bin along an axis may be cut short by the end of the input, output cells beyond the
+            input are an error.
+        :param encoding: how the results are converted to output_arr's data type, which has to be
+            encoding.dtype. None stores them as they are.
+        :return: the largest absolute and relative error of the encoded output, None without an
+            encoding
+        """
+        if input_arr.ndim not in self.kernels:
+            raise ValueError(f"reduction operator {self.name} does not support {input_arr.ndim}D "
+                             "data")
+        if bins is None:
+            bins = tuple(nn // mm for nn, mm in zip(input_arr.shape, output_arr.shape))
+        bins = tuple(int(bb) for bb in bins)
+        if any(bb < 1 or mm * bb - bb >= nn
+               for nn, mm, bb in zip(input_arr.shape, output_arr.shape, bins)):
+            raise ValueError(f"an output of shape {output_arr.shape} does not fit an input of "
+                             f"shape {input_arr.shape} binned by {bins}")
+        if not self.needs_scratch:
+            scratch = None
+        elif scratch is None:
+            scratch = make_scratch(output_arr.shape, input_arr.dtype)
+        kernel = self.kernels[input_arr.ndim]
+        if encoding is None:
+            aot_kernel = self._aot_kernel(input_arr, output_arr, scratch)
+            if aot_kernel is not None:
+                argtypes = tuple(typeof(arg)
+                                 for arg in (input_arr, output_arr, scratch, bins, None, None))
+                if argtypes not in kernel.overloads:
+                    # a single thread gains nothing from the parallel kernel
+                    if kernel_threads() > 1:
+                        COMPILER.submit(kernel, argtypes)
+                    try:
+                        aot_kernel(input_arr, output_arr, *(() if scratch is None else (scratch,)),
+                                   np.array(bins, dtype=np.int64))
+                        return None
+                    except TypeError:
+                        # arrays the exported signature does not take, e.g. read-only or non-native
+                        # byte order
+                        pass
+            kernel(input_arr, output_arr, scratch, bins, None, None)
+            return None
+        if output_arr.dtype != encoding.dtype:
+            raise ValueError(f"the output of encoding {encoding.name} has to be {encoding.dtype}, "
+                             f"not {output_arr.dtype}")
+        errors = np.zeros((output_arr.shape[0], 2))
+        kernel(input_arr, output_arr, scratch, bins, encoding.parameters(), errors)
+        return tuple(float(error) for error in errors.max(axis=0, initial=0.0))
 
 
-@njit(parallel=True, inline='always', cache=True)
-def _reduce_1d(input_arr, output_arr):
-    bin_length = input_arr.shape[0] // output_arr.shape[0]
-    for ii in prange(output_arr.shape[0]):
-        output_arr[ii] = np.sum(input_arr[bin_length * ii: bin_length * (ii + 1)])
+REDUCTION_OPERATORS: dict = {}
 
 
-@njit(parallel=True, inline='always', cache=True)
-def _downscale_1d(input_arr, output_arr):
-    bin_length = input_arr.shape[0] // output_arr.shape[0]
-    _reduce_1d(input_arr, output_arr)
-    output_arr /= bin_length
+def register_operator(operator: ReductionOperator) -> None:
+    """ Makes a reduction operator selectable by its name """
+    REDUCTION_OPERATORS[operator.name] = operator
 
 
-@njit(parallel=True, inline='always', cache=True)
-def _reduce_2d_1(input_arr, output_arr):
-    for ii in prange(output_arr.shape[0]):
-        _reduce_1d(input_arr[ii, :], output_arr[ii, :])
+def get_operator(name: str) -> ReductionOperator:
+    if name not in REDUCTION_OPERATORS:
+        raise ValueError(f"Unknown reduction operator {name!r}, available: "
+                         f"{', '.join(REDUCTION_OPERATORS)}")
+    return REDUCTION_OPERATORS[name]
 
 
-@njit(parallel=True, inline='always', cache=True)
-def _reduce_2d_0(input_arr, output_arr):
-    for ii in prange(output_arr.shape[1]):
-        _reduce_1d(input_arr[:, ii], output_arr[:, ii])
+# op codes of the built-in binning operators, by name
+BINNING_OPS = {'mean': MEAN, 'sum': SUM, 'min': MIN, 'max': MAX, 'rms': RMS}
+register_operator(ReductionOperator('mean', _MEAN_KERNELS, aot=True))
+for _name, _op in BINNING_OPS.items():
+    if _name != 'mean':
+        register_operator(ReductionOperator(_name, _make_binning_kernels(_op), aot=True))
+register_operator(ReductionOperator('decimate', _make_decimate_kernels(), needs_scratch=False,
+                                    strided_read=True, aot=True))
 
 
-@njit(parallel=True, inline='always', cache=True)
-def _reduce_2d(input_arr, output_arr):
-    tmp_array = np.empty((input_arr.shape[0], output_arr.shape[1]))
-    _reduce_2d_1(input_arr, tmp_array)
-    _reduce_2d_0(tmp_array, output_arr)
+def encode(input_arr: np.ndarray, output_arr: np.ndarray, encoding: OutputEncoding) -> tuple:
+    """ Converts input_arr to output_arr of the encoding's type, see ReductionOperator.__call__ """
+    return get_operator('decimate')(input_arr, output_arr, None, [1 for _ in input_arr.shape],
+                                    encoding)
 
 
-@njit(parallel=True, inline='always', cache=True)
-def _downscale_2d(input_arr, output_arr):
-    _reduce_2d(input_arr, output_arr)
-    cells_in_bin = input_arr.shape[0] / output_arr.shape[0] * input_arr.shape[1] / output_arr.shape[1]
-    output_arr[:, :] = output_arr / cells_in_bin
+def downscale(input_arr: np.ndarray, output_arr: np.ndarray,
+              scratch: Optional[np.ndarray] = None) -> None:
+    """ Writes the bin means of input_arr into output_arr
 
+    The bin size along each axis is input_arr.shape // output_arr.shape. scratch is an optional
+    buffer created with make_scratch, its dtype sets the accumulation precision. If omitted, a
+    buffer accumulating in the input's precision is allocated.
+    """
+    get_operator('mean')(input_arr, output_arr, scratch)
 
-@njit(parallel=True, inline='always', cache=True)
-def _downscale_3d(input_arr, output_arr):
-    tmp_array = np.empty((input_arr.shape[0], output_arr.shape[1], output_arr.shape[2]))
-    for ii in prange(input_arr.shape[0]):
-        _reduce_2d(input_arr[ii, :, :], tmp_array[ii, :, :])
-    for ii in prange(output_arr.shape[2]):
-        _reduce_2d_0(tmp_array[:, :, ii], output_arr[:, :, ii])
-    cells_in_bin = (input_arr.shape[0] / output_arr.shape[0] * input_arr.shape[1] / output_arr.shape[1]
-                    * input_arr.shape[2] / output_arr.shape[2])
-    output_arr[:, :] = output_arr / cells_in_bin
 
+def warm_up(operators: Iterable[str], precision: str = 'native',
+            encodings: Iterable[OutputEncoding] = (), dtypes: Iterable = (np.float32, np.float64),
+            ndims: Iterable[int] = (1, 2, 3)) -> None:
+    """ Compiles (or loads from numba's cache) the kernels of the given operators in the background
 
-@generated_jit(nopython=True, parallel=True, cache=True)
-def downscale(input_arr, output_arr):
-    if input_arr.ndim == 1:
-        return lambda input_arr, output_arr: _downscale_1d(input_arr, output_arr)
-    elif input_arr.ndim == 2:
-        return lambda input_arr, output_arr: _downscale_2d(input_arr, output_arr)
-    elif input_arr.ndim == 3:
-        return lambda input_arr, output_arr: _downscale_3d(input_arr, output_arr)
+    Covers C contiguous inputs of the given data types and dimensions, written as they are and with
+    each encoding. Returns right away, see KernelCompiler. Kernels that are needed before they are
+    ready are compiled or waited for by the caller as usual, or replaced by the ahead-of-time
+    compiled ones.
+    """
+    for name in operators:
+        operator = get_operator(name)
+        for ndim in ndims:
+            if ndim not in operator.kernels:
+                continue
+            for dtype in dtypes:
+                scratch_dtype = accumulation_dtype(dtype, precision)
+                for encoding in [None] + list(encodings):
+                    COMPILER.submit(operator.kernels[ndim],
+                                    operator.argument_types(ndim, dtype, scratch_dtype, encoding))
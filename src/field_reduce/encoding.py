@@ -0,0 +1,87 @@
+""" Data types the reduced data is written in
+
+Kept free of numba, so that the --output-dtype entries are checked when parsing the command line
+(see arguments.parse_output_dtype). The kernels apply an encoding while reducing, see
+downscale_kernel.
+"""
+from typing import Optional
+
+import numpy as np
+
+
+class OutputEncoding:
+    """ Data type the reduced data is written in
+
+    Either a floating point type (e.g. to write float64 data as float32) or, with an error bound, an
+    integer type holding the data quantised as round((value - offset) / step) with
+    step = 2 * error_bound, so that values within value_range() are off by at most error_bound.
+    Values beyond it are clipped, which shows in the errors, see clipped.
+
+    :param dtype: data type of the output
+    :param error_bound: largest absolute error of the quantisation, only for integer types
+    :param offset: value that is stored as 0 by the quantisation
+    """
+
+    def __init__(self, dtype, error_bound: Optional[float] = None, offset: float = 0.0):
+        self.dtype = np.dtype(dtype)
+        self.quantised = np.issubdtype(self.dtype, np.integer)
+        if self.quantised and (error_bound is None or not error_bound > 0):
+            raise ValueError(f"quantising to {self.dtype} needs a positive error bound, "
+                             f"e.g. {self.dtype}:1e-3")
+        if not self.quantised and not np.issubdtype(self.dtype, np.floating):
+            raise ValueError(f"output data type has to be a floating point or integer type, "
+                             f"not {self.dtype}")
+        if self.dtype == np.float16:
+            raise ValueError("openPMD can not store float16, quantise to int16 with an error bound "
+                             "instead")
+        if not self.quantised and (error_bound is not None or offset != 0.0):
+            raise ValueError("an error bound and an offset can only be given for quantising to an "
+                             "integer type")
+        self.error_bound = error_bound
+        self.offset = float(offset)
+        self.step = 2.0 * error_bound if self.quantised else 1.0
+        self.name = str(self.dtype) + (f":{error_bound:g}" if self.quantised else "") + \
+            (f":{offset:g}" if self.offset else "")
+
+    def parameters(self) -> tuple:
+        """ The encoding argument of the kernels: (1 / step, offset, step, lowest, highest)
+
+        The kernels store (value - offset) / step, rounded and clipped to [lowest, highest] for
+        integer outputs. Their errors argument is a float64 array of shape (output_arr.shape[0], 2)
+        initialized with zeros, in which they keep the largest absolute and relative error of each
+        output row.
+        """
+        if self.quantised:
+            info = np.iinfo(self.dtype)
+            return 1.0 / self.step, self.offset, self.step, float(info.min), float(info.max)
+        return 1.0, 0.0, 1.0, -np.inf, np.inf
+
+    def value_range(self) -> tuple:
+        """ Lowest and highest value that is stored within the error bound """
+        if not self.quantised:
+            return -np.inf, np.inf
+        info = np.iinfo(self.dtype)
+        return (self.offset + (info.min - 0.5) * self.step,
+                self.offset + (info.max + 0.5) * self.step)
+
+    def clipped(self, absolute_error: float) -> bool:
+        """ Whether values were clipped, given the largest absolute error of the encoded data """
+        # rounding is off by at most half a step, up to the precision of the values
+        return self.quantised and absolute_error > self.error_bound * (1.0 + 1e-6)
+
+
+def get_encoding(spec: str) -> Optional[OutputEncoding]:
+    """ Parses an output data type like 'float32' or 'int16:1e-3[:offset]', None for 'native' """
+    if spec == 'native':
+        return None
+    dtype, *numbers = spec.split(':')
+    try:
+        dtype = np.dtype(dtype)
+        numbers = [float(number) for number in numbers]
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid output data type {spec!r}, expected e.g. native, float32 or "
+                         f"int16:1e-3")
+    if len(numbers) > 2:
+        raise ValueError(f"invalid output data type {spec!r}, expected at most an error bound and "
+                         f"an offset")
+    return OutputEncoding(dtype, *numbers)
@@ -1,77 +1,237 @@
 import argparse
 import json
 
-from .OutputReducer import OutputReducer
+from .arguments import (BACKPRESSURE_POLICIES, LARGE_BUFFER_KINDS, OPERATOR_NAMES,
+                        PARTICLE_QUANTITIES, parse_size, parse_roi, parse_output_dtype)
 
 
 def main():
     # Define command line arguments:
     parser = argparse.ArgumentParser(
-        description="Reads an openPMD series and reduces fields(meshes) resolution by pixel binning. The output is "
-                    "written into another openPMD series. Attributes are preserved as well. "
-                    "There is no support for patches/particles, they will be ignored and will not be saved. "
-                    "The main use case is to read from an SST stream series and save to a file based series to reduce "
-                    "the amount of data written to disk. Though it should work with other combinations like "
-                    "file -> file or stream -> stream as well."
+        description="Reads an openPMD series and reduces fields(meshes) resolution by pixel "
+                    "binning. The output is written into another openPMD series. Attributes are "
+                    "preserved as well. Particle species are dropped unless selected with "
+                    "--particles, in which case they are deposited onto the reduced grid and "
+                    "optionally subsampled; particle patches are never copied. The main use case "
+                    "is to read from an SST stream series and save to a file based series to "
+                    "reduce the amount of data written to disk. Though it should work with other "
+                    "combinations like file -> file or stream -> stream as well."
     )
     parser.add_argument("source_path",
-                        help="Path to the .sst file of the input stream, or alternatively to a file based openPMD"
-                             " series.",
+                        help="Path to the .sst file of the input stream, or alternatively to a "
+                             "file based openPMD series.",
                         type=str)
     parser.add_argument("output_path",
-                        help="Path to where the new series should be created. Should include sth like /Data_%%T.bp "
-                             "at the end, to specify the backend.",
+                        help="Path to where the new series should be created. Should include sth "
+                             "like /Data_%%T.bp at the end, to specify the backend.",
                         type=str)
     parser.add_argument("-x", "--div-x",
-                        help="The number of cells in x directions will be reduced by this value. Has to be an integer."
-                             "Has to divide the number of cells in x direction in the source.",
+                        help="The number of cells in x directions will be reduced by this value. "
+                             "Has to be an integer. Cells left over at the upper end are handled "
+                             "according to --trailing-bins.",
                         type=int,
                         default=1)
     parser.add_argument("-y", "--div-y",
-                        help="The number of cells in y directions will be reduced by this value. Has to be an integer."
-                             "Has to divide the number of cells in y direction in the source.",
+                        help="The number of cells in y directions will be reduced by this value. "
+                             "Has to be an integer. Cells left over at the upper end are handled "
+                             "according to --trailing-bins.",
                         type=int,
                         default=1)
     parser.add_argument("-z", "--div-z",
-                        help="The number of cells in z directions will be reduced by this value. Has to be an integer."
-                             "Has to divide the number of cells in z direction in the source.",
+                        help="The number of cells in z directions will be reduced by this value. "
+                             "Has to be an integer. Cells left over at the upper end are handled "
+                             "according to --trailing-bins.",
                         type=int,
                         default=1)
     parser.add_argument('-m', '--meshes', nargs='+', type=str, default=[],
-                        help="Meshes should have the reduction applied. Can't be used together with --exclude. "
-                             "If not set all, but for ones listed with --exclude, meshes will be processed. "
-                             "Note, other meshes will be still copied in their original resolution.")
+                        help="Meshes should have the reduction applied. Can't be used together "
+                             "with --exclude. If not set all, but for ones listed with --exclude, "
+                             "meshes will be processed. Note, other meshes will be still copied in "
+                             "their original resolution.")
     parser.add_argument('-e', '--exclude', nargs='+', type=str, default=[],
-                        help="A list of meshes to exclude from reduction. Can't be used together with --meshes. "
-                             "Note, these meshes will be still copied in their original resolution.")
+                        help="A list of meshes to exclude from reduction. Can't be used together "
+                             "with --meshes. Note, these meshes will be still copied in their "
+                             "original resolution.")
     parser.add_argument("-w", "--wait", action='store_true',
-                        help="When set the script will wait until the source path points to an existing file. "
-                             "Use this when the source path points to an .sst file and the writer may not have yet"
-                             " created it when the script is trying to open the series.")
+                        help="When set the script will wait until the source path points to an "
+                             "existing file. Use this when the source path points to an .sst file "
+                             "and the writer may not have yet created it when the script is trying "
+                             "to open the series.")
     parser.add_argument("-s", "--source-config-path",
-                        help="Path to an .json file that specifies the backend specific configuration for the "
-                             "source openPMD series.", default='',
+                        help="Path to an .json file that specifies the backend specific "
+                             "configuration for the source openPMD series.", default='',
                         type=str)
     parser.add_argument("-o", "--output-config-path",
-                        help="Path to an .json file that specifies the backend specific configuration for the "
-                             "output openPMD series.", default='',
+                        help="Path to an .json file that specifies the backend specific "
+                             "configuration for the output openPMD series.", default='',
                         type=str)
     parser.add_argument("--last_iteration",
-                        help="Last iteration to process, so that the reader won't wair for new files after this iteration (usefull for ADIOS2 with steps)",
+                        help="Last iteration to process, so that the reader won't wair for new "
+                             "files after this iteration (usefull for ADIOS2 with steps)",
                         default=-1, type=int)
     parser.add_argument("--first_iteration", help="First iteration to process.",
                         default=-1, type=int)
     parser.add_argument("--checkpoint",
-                        help="Path to checkpoint file for tracking last successfully processed iteration. "
-                             "If not set, defaults to field_reduce_checkpoint_<input_filename>",
+                        help="Path to checkpoint file for tracking the successfully processed "
+                             "iterations. If not set, defaults to "
+                             "field_reduce_checkpoint_<input_filename>",
                         default=None, type=str)
+    parser.add_argument("--verify-checkpoint", choices=["none", "size", "checksum"], default="size",
+                        help="How the output of the iterations listed in the checkpoint is checked "
+                             "on restart: not at all, whether its files exist with the recorded "
+                             "sizes, or also whether their CRC-32 checksums match. Iterations "
+                             "whose output fails are processed again.")
+    parser.add_argument("--pipeline", action='store_true',
+                        help="Read, reduce and write in separate threads, so that reading the next "
+                             "record component overlaps with reducing the current one and writing "
+                             "the previous one.")
+    parser.add_argument("--pipeline-depth",
+                        help="Maximal number of record components queued between two pipeline "
+                             "stages.",
+                        default=4, type=int)
+    parser.add_argument("--pipeline-memory",
+                        help="Maximal memory held by in-flight record components in pipelined "
+                             "mode, e.g. 8G. Unlimited if not set.",
+                        default=None, type=parse_size)
+    parser.add_argument("--slab-size",
+                        help="Stream each rank's chunk of a record component in slabs along the "
+                             "first axis, holding at most this much data (e.g. 512M) at a time. A "
+                             "slab is at least one row of bins thick. By default the whole chunk "
+                             "is loaded at once.",
+                        default=None, type=parse_size)
+    parser.add_argument("--component-threads",
+                        help="Number of record components reduced at the same time, each with "
+                             "NUMBA_NUM_THREADS / N kernel threads. By default this is chosen per "
+                             "record component from its size, so that small, 1D or thin 2D record "
+                             "components are reduced side by side and large ones get all threads. "
+                             "1 reduces one record component after another.",
+                        default=None, type=int)
+    parser.add_argument("--precision", choices=["native", "float64"], default="native",
+                        help="Precision in which the bins are summed up. 'native' keeps the data's "
+                             "own floating point type (e.g. float32), 'float64' trades speed for "
+                             "accuracy.")
+    parser.add_argument("--op", nargs='+', type=str, default=[],
+                        help="Reduction operator per mesh, e.g. --op E=rms B=max density=sum. An "
+                             "entry without a mesh name sets the operator for all other meshes "
+                             f"(default: mean). Available: {', '.join(OPERATOR_NAMES)}. 'decimate' "
+                             "keeps the first cell of each bin and only reads those cells along "
+                             "the first axis.")
+    parser.add_argument("--pyramid", nargs=4, action='append', default=[],
+                        metavar=("OUTPUT_PATH", "DIV_X", "DIV_Y", "DIV_Z"),
+                        help="Write an additional, coarser output series from the same read. The "
+                             "bin factors are relative to the source and have to be multiples of "
+                             "the previous output's factors, since each level is reduced from the "
+                             "previous one. Can be given several times.")
+    parser.add_argument("--decomposition", choices=["block", "slab", "chunks"], default="block",
+                        help="How record components are distributed over MPI ranks. 'block' cuts "
+                             "them into a grid of bin aligned blocks along all axes, balancing the "
+                             "work for any number of ranks. 'slab' only cuts along the first axis, "
+                             "which needs at least as many rows of bins as ranks. 'chunks' reads "
+                             "the blocks the source was written in, preferably on a rank on the "
+                             "same host as their writer, and balances them by bytes (e.g. for SST "
+                             "streams).")
+    parser.add_argument("--trailing-bins", choices=["drop", "partial"], default="drop",
+                        help="What to do with cells at the upper end of an axis that do not fill a "
+                             "whole bin, when the bin factor does not divide the number of cells. "
+                             "'drop' leaves them out, 'partial' reduces them to an extra output "
+                             "cell (e.g. averaged over just these cells).")
+    parser.add_argument("--telemetry",
+                        help="Write the time and bytes of every stage (waiting for a step, "
+                             "loading, reducing, storing, flushing and closing) per iteration, "
+                             "mesh and record component, and their totals aggregated over all "
+                             "ranks, to this file. CSV if it ends with .csv, JSON lines otherwise. "
+                             "Under MPI every rank writes its own file, %%r in the path is "
+                             "replaced by the rank.",
+                        default=None, type=str)
+    parser.add_argument("--telemetry-summary", action='store_true',
+                        help="Print the stage times aggregated over all ranks (min/mean/max, "
+                             "slowest rank) at the end.")
+    parser.add_argument("--output-dtype", nargs='+', type=parse_output_dtype, default=[],
+                        help="Data type the reduced data is written in, per mesh, e.g. "
+                             "--output-dtype E=float32 density=int16:1e-3. An entry without a mesh "
+                             "name sets it for all other meshes (default: native, the input's "
+                             "type). A floating point type downcasts (e.g. float64 to float32), an "
+                             "integer type with an error bound (and optionally an offset, "
+                             "int16:1e-3:5.0) quantises the data to integers that are off by at "
+                             "most the bound, with the step and offset stored as attributes and "
+                             "folded into unitSI. The largest absolute and relative errors per "
+                             "record component are printed at the end.")
+    parser.add_argument("--roi", nargs='+', type=parse_roi, default=[], metavar="AXIS=START:STOP",
+                        help="Region of interest, e.g. --roi x=100:400 z=:200. Only this part of "
+                             "every mesh is read, distributed over the ranks, reduced and written, "
+                             "gridGlobalOffset is moved to its start. Axes that are not listed and "
+                             "left out bounds cover the whole axis.")
+    parser.add_argument("--roi-units", choices=["cells", "si"], default="cells",
+                        help="Units of --roi: cell indices (stop exclusive) or SI units, using "
+                             "gridGlobalOffset, gridSpacing and gridUnitSI of each mesh. In SI "
+                             "units all cells overlapping the region are included.")
+    parser.add_argument("--particles", nargs='+', default=[], metavar="SPECIES",
+                        help="Particle species to deposit onto the reduced grid (and subsample "
+                             "with --particle-stride), in the same pass as the meshes. Other "
+                             "species are dropped.")
+    parser.add_argument("--particle-quantities", nargs='*', choices=list(PARTICLE_QUANTITIES),
+                        default=list(PARTICLE_QUANTITIES),
+                        help="Quantities deposited for every species, written as meshes "
+                             "<species>_<quantity>: the number density, the current density and "
+                             "the mean kinetic energy per particle. Current and energy need the "
+                             "momentum, mass and charge records. Give none to only subsample.")
+    parser.add_argument("--particle-grid", default=None, type=str,
+                        help="Reduced mesh whose grid the particles are deposited on, the first "
+                             "reduced mesh by default.")
+    parser.add_argument("--particle-stride", default=None, type=int,
+                        help="Also write the species keeping every N-th macroparticle, with their "
+                             "weighting multiplied by N.")
+    parser.add_argument("--particle-chunk", default=1 << 22, type=int,
+                        help="Number of particles of a species read at a time.")
+    parser.add_argument("--warm-up", action='store_true',
+                        help="Compile the kernels of the selected operators for float32 and "
+                             "float64 meshes in a background thread while the series are opened "
+                             "(and waited for with --wait), instead of when the first mesh is "
+                             "reduced.")
+    parser.add_argument("--backpressure", choices=list(BACKPRESSURE_POLICIES), default=None,
+                        help="For streams: what to do with steps while the reduction falls behind "
+                             "the writer, i.e. while the next step is mostly ready before the "
+                             "reader asks for it. 'skip' drops every N-th of these steps "
+                             "(--backpressure-every), 'coarsen' multiplies the bin factors by "
+                             "--backpressure-factor, 'decimate' reduces with the decimate operator "
+                             "and 'meshes' leaves out the --low-priority-meshes. Degraded steps "
+                             "are marked in the output's iteration attributes. By default every "
+                             "step is processed fully.")
+    parser.add_argument("--backpressure-margin", default=0.1, type=float,
+                        help="The reduction falls behind when waiting for the next step takes less "
+                             "than this fraction of the time.")
+    parser.add_argument("--backpressure-every", default=2, type=int,
+                        help="The 'skip' policy drops every N-th step taken while behind, 1 drops "
+                             "all of them.")
+    parser.add_argument("--backpressure-factor", default=2, type=int,
+                        help="Factor the 'coarsen' policy multiplies all bin factors by.")
+    parser.add_argument("--low-priority-meshes", nargs='+', type=str, default=[],
+                        help="Meshes the 'meshes' policy leaves out of degraded steps.")
+    parser.add_argument("--no-buffer-pool", dest='buffer_pool', action='store_false',
+                        help="Allocate the buffers record components are loaded into and reduced "
+                             "into anew each time, instead of reusing them across record "
+                             "components and iterations.")
+    parser.add_argument("--large-buffers", choices=list(LARGE_BUFFER_KINDS), default='malloc',
+                        help="How buffers of at least --large-buffer-size are allocated: 'malloc' "
+                             "on the heap, 'mmap' as anonymous memory maps or 'hugepages' as "
+                             "memory maps backed by transparent huge pages.")
+    parser.add_argument("--large-buffer-size", default=1 << 26, type=parse_size,
+                        help="Size from which on buffers are allocated as --large-buffers, e.g. "
+                             "64M (the default).")
+    parser.add_argument("--iteration-groups",
+                        help="Reduce the iterations of a file based source series in this many "
+                             "groups in parallel, largest iterations first. Under MPI the ranks "
+                             "are split into groups, otherwise each group is a worker process. All "
+                             "groups write into the same file based output series (%%T in the "
+                             "output path) and checkpoint.",
+                        default=1, type=int)
     args = parser.parse_args()
 
     if args.source_config_path:
         with open(args.source_config_path, 'r') as json_data:
             options_input_string = json.dumps(json.load(json_data))
     else:
-        options_input_string ='{}'
+        options_input_string = '{}'
     if args.output_config_path:
         with open(args.output_config_path, 'r') as json_data:
             options_output_string = json.dumps(json.load(json_data))
@@ -85,10 +245,53 @@ def main():
         exclude = args.exclude
     else:
         exclude = None
-    reducer = OutputReducer(args.source_path, args.output_path, args.div_x, args.div_y, args.div_z, meshes, exclude,
-                            args.wait,
-                            options_input_string, options_output_string, args.last_iteration, args.first_iteration,
-                            args.checkpoint)
+    operators = {}
+    default_operator = 'mean'
+    for entry in args.op:
+        if '=' in entry:
+            mesh_name, operator = entry.split('=', 1)
+            operators[mesh_name] = operator
+        else:
+            default_operator = entry
+    output_dtypes = {}
+    default_output_dtype = 'native'
+    for mesh_name, output_dtype in args.output_dtype:
+        if mesh_name is not None:
+            output_dtypes[mesh_name] = output_dtype
+        else:
+            default_output_dtype = output_dtype
+    pyramid = [(level_path, int(level_x), int(level_y), int(level_z))
+               for level_path, level_x, level_y, level_z in args.pyramid]
+    reducer_args = (args.source_path, args.output_path, args.div_x, args.div_y, args.div_z, meshes,
+                    exclude, args.wait,
+                    options_input_string, options_output_string, args.last_iteration,
+                    args.first_iteration, args.checkpoint)
+    reducer_kwargs = dict(pipeline=args.pipeline, pipeline_depth=args.pipeline_depth,
+                          pipeline_memory=args.pipeline_memory, slab_size=args.slab_size,
+                          component_threads=args.component_threads, particles=args.particles,
+                          particle_quantities=args.particle_quantities,
+                          particle_grid=args.particle_grid, particle_stride=args.particle_stride,
+                          particle_chunk=args.particle_chunk, precision=args.precision,
+                          operators=operators, default_operator=default_operator, pyramid=pyramid,
+                          decomposition=args.decomposition, trailing_bins=args.trailing_bins,
+                          telemetry_path=args.telemetry, telemetry_summary=args.telemetry_summary,
+                          output_dtypes=output_dtypes, default_output_dtype=default_output_dtype,
+                          roi=dict(args.roi) or None, roi_units=args.roi_units,
+                          verify_checkpoint=args.verify_checkpoint, warm_up=args.warm_up,
+                          backpressure=args.backpressure,
+                          backpressure_margin=args.backpressure_margin,
+                          backpressure_every=args.backpressure_every,
+                          backpressure_factor=args.backpressure_factor,
+                          low_priority_meshes=args.low_priority_meshes,
+                          buffer_pool=args.buffer_pool, large_buffers=args.large_buffers,
+                          large_buffer_size=args.large_buffer_size)
+    # imported only now, loading numba and openPMD-api takes a while
+    from .output_reducer import OutputReducer
+    from .iteration_groups import run_iteration_groups
+    if args.iteration_groups > 1:
+        run_iteration_groups(args.iteration_groups, *reducer_args, **reducer_kwargs)
+        return
+    reducer = OutputReducer(*reducer_args, **reducer_kwargs)
     print("Successfully initialized. Input and output series are open. Running now!")
     reducer.run()
     reducer.finalize()
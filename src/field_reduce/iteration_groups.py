@@ -0,0 +1,139 @@
+""" Reduces the iterations of a file based series in parallel
+
+The iterations of a series on disk are independent of each other, so instead of reading them one by
+one they are distributed over groups of MPI ranks (sub-communicators of MPI.COMM_WORLD) or, without
+MPI, over worker processes. Each group runs its own OutputReducer on its share of the iterations and
+writes them into the shared file based output.
+"""
+import inspect
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import openpmd_api as api
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .output_reducer import OutputReducer, HAVE_MPI
+from .checkpoint import default_checkpoint_path, load_checkpoint
+from .decomposition import schedule_largest_first
+
+if HAVE_MPI:
+    from mpi4py import MPI
+
+
+def iteration_sizes(input_series: api.Series) -> dict:
+    """ Bytes of mesh data in each iteration of a series that allows random access """
+    sizes = {}
+    for idx, iteration in input_series.iterations.items():
+        iteration.open()
+        sizes[idx] = sum(int(np.prod(mrc.shape)) * np.dtype(mrc.dtype).itemsize
+                         for _, mesh in iteration.meshes.items() for _, mrc in mesh.items())
+        iteration.close()
+    return sizes
+
+
+def group_path(path: str, group: int) -> str:
+    """ Inserts the group before the extension, so that every group writes its own file """
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.g{group}{ext}"
+
+
+def _schedule(groups: int, arguments: dict) -> list:
+    """ Selects the iterations to process and spreads them over groups, see run_iteration_groups """
+    source_path = arguments["source_path"]
+    if arguments["wait"]:
+        while not os.path.exists(source_path):
+            time.sleep(1)
+    input_series = api.Series(source_path, api.Access.read_only, arguments["options_in"])
+    if input_series.iteration_encoding != api.Iteration_Encoding.file_based:
+        raise ValueError(f"iteration groups need a file based input series, {source_path} is "
+                         f"{input_series.iteration_encoding}")
+    completed, first_iteration = load_checkpoint(arguments["checkpoint_path"], input_series,
+                                                 arguments["first_iteration"],
+                                                 arguments["verify_checkpoint"])
+    last_iteration = arguments["last_iteration"]
+    sizes = {idx: nbytes for idx, nbytes in iteration_sizes(input_series).items()
+             if not (idx < first_iteration > 0 or idx > last_iteration > 0 or idx in completed)}
+    del input_series
+    print(f"Reducing {len(sizes)} iteration(s) in {groups} groups, {len(completed)} completed "
+          "already", flush=True)
+    return schedule_largest_first(sizes, groups)
+
+
+def reduce_iteration_group(group: int, iterations: list, arguments: dict, comm=None) -> None:
+    """ Reduces the given iterations with an OutputReducer on the ranks of comm (or serially) """
+    if arguments["telemetry_path"] is not None:
+        arguments = dict(arguments, telemetry_path=group_path(arguments["telemetry_path"], group))
+    print(f"[group: {group}]: Reducing iterations {iterations}", flush=True)
+    reducer = OutputReducer(**arguments, comm=comm, iterations=iterations)
+    reducer.run()
+    reducer.finalize()
+
+
+def run_iteration_groups(groups: int, *args, **kwargs) -> None:
+    """ Reduces the iterations of a file based series in groups working in parallel
+
+    Under MPI the ranks of MPI.COMM_WORLD are split into groups of consecutive ranks, each of which
+    reduces its iterations like a normal run on its own sub-communicator. Without MPI every group is
+    a worker process. The iterations are those a normal run would process (respecting
+    first_iteration, last_iteration and the checkpoint), handed out largest first to the group with
+    the least bytes so far. All groups write into the same file based output series (%T in the
+    output path) and record the iterations they finish in the same checkpoint file. Telemetry files
+    get the group inserted before their extension.
+
+    :param groups: number of groups, at most the number of mpi ranks
+    :param args: positional arguments of OutputReducer
+    :param kwargs: keyword arguments of OutputReducer, except comm and iterations
+    """
+    arguments = inspect.signature(OutputReducer).bind(*args, **kwargs)
+    arguments.apply_defaults()
+    arguments = arguments.arguments
+    for name in ('comm', 'iterations'):
+        if name in kwargs:
+            raise ValueError(f"{name} is set for every group by run_iteration_groups")
+        del arguments[name]
+    if groups < 1:
+        raise ValueError("groups has to be at least 1")
+    output_paths = [arguments["output_path"]] + [level[0] for level in (arguments["pyramid"] or [])]
+    for path in output_paths:
+        if "%T" not in path:
+            raise ValueError("iteration groups need file based output series (%T in the path), "
+                             f"not {path}")
+    if arguments["checkpoint_path"] is None:
+        arguments["checkpoint_path"] = default_checkpoint_path(arguments["source_path"])
+
+    world = MPI.COMM_WORLD if HAVE_MPI else None
+    if world is not None and world.size > 1:
+        if groups > world.size:
+            raise ValueError(f"can not split {world.size} ranks into {groups} groups")
+        schedule = None
+        if world.rank == 0:
+            try:
+                schedule = _schedule(groups, arguments)
+            except Exception as e:
+                # passed on, so that the other ranks fail as well instead of waiting for the
+                # schedule
+                schedule = e
+        schedule = world.bcast(schedule, root=0)
+        if isinstance(schedule, Exception):
+            raise schedule
+        group = world.rank * groups // world.size
+        comm = world.Split(group, world.rank)
+        # a group without iterations would create an output series without iterations, which fails
+        # when file based
+        if schedule[group]:
+            reduce_iteration_group(group, schedule[group], arguments, comm)
+        comm.Free()
+        return
+
+    schedule = _schedule(groups, arguments)
+    # spawned instead of forked, since the parent's openPMD and threading state must not be copied
+    with ProcessPoolExecutor(max_workers=groups,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(reduce_iteration_group, group, iterations, arguments)
+                   for group, iterations in enumerate(schedule) if iterations]
+        for future in futures:
+            # re-raises the errors of the workers
+            future.result()
@@ -0,0 +1,1252 @@
+import openpmd_api as api
+import os.path
+import socket
+import threading
+import time
+import numpy as np
+
+from functools import partial
+from typing import Optional, Iterable
+
+try:
+    from mpi4py import MPI
+
+    HAVE_MPI = True
+except ImportError:
+    HAVE_MPI = False
+
+from .downscale_kernel import (launch_threads, kernel_threads, set_kernel_threads,
+                               concurrent_kernels, make_scratch, get_operator, ReductionOperator)
+from .backpressure import Backpressure
+from .buffers import BufferPool
+from .checkpoint import (CheckpointWriter, VERIFY_MODES, default_checkpoint_path, load_checkpoint,
+                         output_files)
+from .decomposition import Chunk, assign_blocks
+from .encoding import OutputEncoding
+from .particles import (QUANTITIES, UNIT_DIMENSIONS, SUM_ROWS, ParticleGrid, particle_range,
+                        particle_chunks, subsample_range, stride_factor, to_si, make_sums, deposit,
+                        finalize)
+from .pipeline import Pipeline, StageTimes, ComponentScheduler
+from .reduction import (Reduction, RecordComponentTask, load_task, mesh_grid, region_origin,
+                        binned_spacing, encoded_unit_si)
+from .telemetry import Telemetry, make_sink, summary
+
+
+# copied from openpmd-pipe
+
+class FallbackMPICommunicator:
+    def __init__(self):
+        self.size = 1
+        self.rank = 0
+
+
+# ignoring attributes  like in the openpmd-pipe implementation:
+IGNORED_ATTRIBUTES = {
+    api.Series: {"basePath", "iterationEncoding", "iterationFormat", "openPMD"},
+    api.Iteration: {"snapshot"},
+}
+# set by make_constant and reset_dataset for constant record components
+CONSTANT_ATTRIBUTES = {"shape", "value"}
+# attributes of the mesh whose grid particles are deposited on that are copied to the deposited
+# meshes
+GRID_ATTRIBUTES = {"axisLabels", "geometry", "geometryParameters", "dataOrder", "gridUnitSI",
+                   "timeOffset"}
+
+
+def read_attributes(source: api.Attributable) -> list:
+    """ Reads all attributes of an attributable that are supposed to be copied
+
+    :param source: An openPMD-api attributable from that the attributes should be read
+    :return: list of (name, value, dtype) tuples
+    """
+    ignored = set()
+    for openpmd_group, to_ignore in IGNORED_ATTRIBUTES.items():
+        if isinstance(source, openpmd_group):
+            ignored |= to_ignore
+    # attribute_dtypes builds a new dict on every access, so it is only fetched once
+    dtypes = source.attribute_dtypes
+    return [(attribute, source.get_attribute(attribute), dtypes[attribute])
+            for attribute in source.attributes if attribute not in ignored]
+
+
+def write_attributes(target: api.Attributable, attributes: list) -> None:
+    """ Sets attributes previously read with read_attributes
+
+    :param target: An openPMD-api attributable that should receive the attributes
+    :param attributes: list of (name, value, dtype) tuples
+    """
+    for attribute, value, dtype in attributes:
+        target.set_attribute(attribute, value, dtype)
+
+
+def copy_attributes(source: api.Attributable,
+                    target: api.Attributable) -> None:
+    """ Copies all attributes from one attributable to another one
+
+        :param source: An openPMD-api attributable from that all attributes should be copied
+        :param target: An openPMD-api attributable that should receive the attributes
+        """
+    write_attributes(target, read_attributes(source))
+
+
+class OutputLevel:
+    """ One output series, binned by its own factors relative to the source """
+
+    def __init__(self, path: str, series: api.Series, axis_scaling: dict):
+        self.path = path
+        self.series = series
+        self.axis_scaling = axis_scaling
+        self.write_iterations = None
+        self.output_iterations = {}
+
+
+class ComponentPlan:
+    """ How a record component is reduced and which chunks of it this rank processes """
+
+    def __init__(self, name: str, dtype: np.dtype, roi: Chunk, output_shapes: list,
+                 chunks: Optional[list]):
+        """
+        :param roi: the part of the record component that is read, the whole of it without a region
+            of interest
+        :param output_shapes: global shape of the record component in each output level
+        :param chunks: chunks of the tasks of this rank, None if they have to be determined anew for
+            every iteration
+        """
+        self.name = name
+        self.dtype = dtype
+        self.roi = roi
+        self.output_shapes = output_shapes
+        self.chunks = chunks
+
+
+class MeshPlan:
+    """ How a mesh is reduced, scalings, operator and encoding are None if it is only copied """
+
+    def __init__(self, name: str, scalings: Optional[list], operator: Optional[ReductionOperator],
+                 components: list, encoding: Optional[OutputEncoding] = None,
+                 grid_global_offset: Optional[list] = None):
+        """
+        :param grid_global_offset: gridGlobalOffset of the output mesh, None to keep that of the
+            input
+        """
+        self.name = name
+        self.grid_global_offset = grid_global_offset
+        self.scalings = scalings
+        self.operator = operator
+        self.components = components
+        self.encoding = encoding
+
+
+class ReductionPlan:
+    """ Everything about reducing an iteration that only depends on its layout
+
+    Built from the first iteration and reused for the following ones until the layout (the meshes,
+    their axes, and the names, shapes and data types of their record components) changes.
+    """
+
+    def __init__(self, layout: tuple, meshes: list):
+        self.layout = layout
+        self.meshes = meshes
+
+
+class OutputReducer:
+
+    def __init__(self, source_path: str, output_path: str, div_x: int,
+                 div_y: int, div_z: int,
+                 meshes: Optional[Iterable[str]] = None,
+                 exclude: Optional[Iterable[str]] = None,
+                 wait: bool = False, options_in='{}', options_out='{}', last_iteration=-1,
+                 first_iteration=-1, checkpoint_path: Optional[str] = None, pipeline: bool = False,
+                 pipeline_depth: int = 4, pipeline_memory: Optional[int] = None,
+                 slab_size: Optional[int] = None, precision: str = 'native',
+                 operators: Optional[dict] = None, default_operator: str = 'mean',
+                 pyramid: Optional[Iterable[tuple]] = None, decomposition: str = 'block',
+                 trailing_bins: str = 'drop', telemetry_path: Optional[str] = None,
+                 telemetry_summary: bool = False, comm=None,
+                 iterations: Optional[Iterable[int]] = None, output_dtypes: Optional[dict] = None,
+                 default_output_dtype: str = 'native', roi: Optional[dict] = None,
+                 roi_units: str = 'cells', verify_checkpoint: str = 'size',
+                 component_threads: Optional[int] = None, particles: Optional[Iterable[str]] = None,
+                 particle_quantities: Iterable[str] = QUANTITIES,
+                 particle_grid: Optional[str] = None, particle_stride: Optional[int] = None,
+                 particle_chunk: int = 1 << 22, warm_up: bool = False,
+                 backpressure: Optional[str] = None, backpressure_margin: float = 0.1,
+                 backpressure_every: int = 2, backpressure_factor: int = 2,
+                 low_priority_meshes: Optional[Iterable[str]] = None, buffer_pool: bool = True,
+                 large_buffers: str = 'malloc', large_buffer_size: int = 1 << 26):
+        """ Output Reducer initializer
+
+        :param source_path: path to the source openPMD series
+        :param output_path: path to the destination openPMD series
+        :param div_x: pixels in a bin along x direction
+        :param div_y: pixels in a bin along y direction
+        :param div_z: pixels in a bin along z direction
+        :param meshes: meshes to reduce, other meshes will be simply copied
+        :param exclude: meshes to exclude from reduction (alternative to the meshes option)
+        :param wait: if true the program will wait until the source path exist (useful for sst
+            set-ups)
+        :param options_in: json string with backend specific configuration for the input series
+        :param options_out: json string with backend specific configuration for the output series
+        :param last_iteration: Last iteration to process, useful for avoiding waiting indefinitely
+            fro a next iteration when using adios steps. Set to sth < 0 to disable this check
+        :param first_iteration: First iteration to process.
+        :param checkpoint_path: Path to checkpoint file listing the successfully processed
+            iterations with the size and checksum of their output files, which are skipped when
+            restarting (see checkpoint.load_checkpoint). If None, uses default:
+            field_reduce_checkpoint_<input_filename>
+        :param pipeline: if true, reading, reducing and writing run in separate threads, so that
+            reading the next record component overlaps with reducing the current one and writing the
+            previous one
+        :param pipeline_depth: maximal number of record components queued between two pipeline
+            stages
+        :param pipeline_memory: maximal number of bytes held by in-flight record components in
+            pipelined mode, None for no limit
+        :param slab_size: if set, each rank's chunk of a record component is streamed in slabs along
+            the first axis holding at most this many bytes (at least one row of bins). Every slab is
+            loaded, reduced and written before the next one is read. None loads the whole chunk at
+            once.
+        :param precision: precision in which bins are summed up, 'native' (the data's own floating
+            point type) or 'float64'
+        :param operators: reduction operator (see downscale_kernel.REDUCTION_OPERATORS) for each
+            mesh name, meshes not listed use default_operator
+        :param default_operator: reduction operator for all other reduced meshes, the bin mean by
+            default
+        :param pyramid: additional, coarser outputs written from the same read, as (output_path,
+            div_x, div_y, div_z) tuples. The factors are relative to the source and each has to be a
+            multiple of the previous level's (the first level being output_path), since every level
+            is reduced from the one before.
+        :param decomposition: how record components are distributed over mpi ranks. 'block' cuts
+            them into a grid of blocks along all axes (see decomposition.rank_grid), 'slab' only
+            along the first axis. 'chunks' follows the blocks the source was written in
+            (available_chunks), assigning them to ranks on the same host as their writer where
+            possible (see decomposition.assign_blocks). It falls back to 'block' if there are fewer
+            written blocks than ranks.
+        :param trailing_bins: what to do with cells at the upper end of an axis that do not fill a
+            whole bin, 'drop' them or reduce them to a 'partial' bin of their own (e.g. averaged
+            over the cells it has)
+        :param telemetry_path: file to write the telemetry records to (see telemetry.Telemetry), as
+            CSV if it ends with .csv, JSON lines otherwise. %r is replaced by the mpi rank, each
+            rank writes its own file. More consumers can be attached with self.telemetry.add_hook.
+        :param telemetry_summary: if true, rank 0 prints the per stage times aggregated over all
+            ranks at the end of the run
+        :param comm: mpi communicator of the ranks reducing together, MPI.COMM_WORLD by default
+        :param iterations: if set, exactly these iterations are processed, in this order, instead of
+            reading the series step by step. Needs random access to the iterations, i.e. a file
+            based input series (see iteration_groups.run_iteration_groups)
+        :param output_dtypes: data type the reduced data is written in for each mesh name (see
+            encoding.get_encoding), e.g. 'float32' or 'int16:1e-3' for integers quantised with an
+            absolute error of at most 1e-3. Meshes not listed use default_output_dtype.
+        :param default_output_dtype: data type for all other reduced meshes, 'native' keeps the
+            input's data type
+        :param roi: region of interest, (start, stop) for each axis label, a bound may be None for
+            the start or end of the axis. Only this region of every mesh is read, reduced and
+            written, the first cell of the region becomes the first cell of the output and
+            gridGlobalOffset is moved accordingly.
+        :param roi_units: 'cells' if the region is given in cell indices (stop exclusive), 'si' if
+            it is given in SI units (using gridGlobalOffset, gridSpacing and gridUnitSI of each
+            mesh), in which case all cells overlapping it are included
+        :param verify_checkpoint: how the output of the iterations in the checkpoint is checked
+            before they are skipped, 'none', 'size' (the files exist with the recorded sizes) or
+            'checksum' (their content is unchanged as well). Iterations that fail are processed
+            again.
+        :param component_threads: number of record components reduced at the same time, each kernel
+            then gets NUMBA_NUM_THREADS // component_threads threads. None chooses per record
+            component, from the rows of its output and its number of cells, how many threads its
+            kernel can use and runs as many record components side by side as fit (see
+            pipeline.ComponentScheduler). In pipelined mode this spans meshes, otherwise the record
+            components of one mesh. 1 reduces one record component after another.
+        :param particles: particle species to process, the others are dropped. Each is read in
+            chunks of particle_chunk particles (split over the ranks) and deposited onto the reduced
+            grid (see particles.py).
+        :param particle_quantities: quantities deposited for every species, as meshes
+            <species>_<quantity>: 'density' (number density), 'current' (current density) and
+            'energy' (mean kinetic energy per particle). Current and energy need the momentum, mass
+            and charge records. Empty to deposit nothing.
+        :param particle_grid: reduced mesh whose grid the particles are deposited on, for every
+            output level, the first reduced mesh if None
+        :param particle_stride: if set, the species are also written as particle species keeping
+            every particle_stride-th macroparticle, with their weighting (and other macro weighted
+            records) multiplied accordingly
+        :param particle_chunk: number of particles of a species read at a time
+        :param warm_up: if true the kernels of the selected operators and output data types are
+            compiled for float32 and float64 meshes in a background thread (see
+            downscale_kernel.warm_up), while the series are opened
+        :param backpressure: policy applied to the steps of a stream while the reduction falls
+            behind its writer (see backpressure.py): 'skip' every backpressure_every-th step,
+            'coarsen' the bin factors by backpressure_factor, reduce with 'decimate' or leave out
+            the low_priority_meshes ('meshes'). Degraded steps are marked in the attributes of their
+            output iteration, skipped ones in those of the next written one. None processes every
+            step fully.
+        :param backpressure_margin: the reduction falls behind when waiting for the next step takes
+            less than this fraction of the time
+        :param backpressure_every: see backpressure
+        :param backpressure_factor: see backpressure
+        :param low_priority_meshes: meshes left out of degraded steps by the 'meshes' policy
+        :param buffer_pool: if true the record components are loaded into and reduced into buffers
+            reused across record components and iterations (see buffers.BufferPool), an output
+            buffer is reused once the flush that writes it is done. Otherwise every buffer is
+            allocated anew.
+        :param large_buffers: how buffers of at least large_buffer_size bytes are allocated,
+            'malloc' on the heap, 'mmap' as anonymous memory maps or 'hugepages' as memory maps
+            backed by transparent huge pages
+        :param large_buffer_size: size in bytes from which on buffers are allocated as large_buffers
+        """
+        pyramid = list(pyramid or [])
+        # what is done to the meshes, validates the arguments about it
+        self.reduction = Reduction(div_x, div_y, div_z, meshes, exclude, precision, operators,
+                                   default_operator,
+                                   [(level_x, level_y, level_z)
+                                    for _, level_x, level_y, level_z in pyramid],
+                                   trailing_bins, output_dtypes, default_output_dtype, roi,
+                                   roi_units)
+        if pipeline_depth < 1:
+            raise ValueError("pipeline_depth has to be at least 1")
+        if component_threads is not None and component_threads < 1:
+            raise ValueError("component_threads has to be at least 1")
+        unknown = set(particle_quantities) - set(QUANTITIES)
+        if unknown:
+            raise ValueError(f"unknown particle quantities {sorted(unknown)}, available: "
+                             f"{QUANTITIES}")
+        if particle_stride is not None and particle_stride < 1:
+            raise ValueError("particle_stride has to be at least 1")
+        if particle_chunk < 1:
+            raise ValueError("particle_chunk has to be at least 1")
+        if backpressure is not None and iterations is not None:
+            raise ValueError("backpressure needs a stream, it can not be used with selected "
+                             "iterations")
+        self._backpressure = None
+        if backpressure is not None:
+            self._backpressure = Backpressure(backpressure, backpressure_margin, backpressure_every,
+                                              backpressure_factor, low_priority_meshes or ())
+        # iterations skipped by the backpressure policy since the last written one
+        self._skipped_iterations: list = []
+        self._buffers = BufferPool(buffer_pool, large_buffers, large_buffer_size)
+        # stored output buffers per iteration, given back to the pool once they are flushed
+        self._stored_buffers: dict[int, list] = {}
+        if slab_size is not None and slab_size < 1:
+            raise ValueError("slab_size has to be positive")
+        if decomposition not in ('block', 'slab', 'chunks'):
+            raise ValueError("decomposition has to be 'block', 'slab' or 'chunks', not "
+                             f"{decomposition!r}")
+        if verify_checkpoint not in VERIFY_MODES:
+            raise ValueError(f"verify_checkpoint has to be one of {VERIFY_MODES}, not "
+                             f"{verify_checkpoint!r}")
+        if warm_up:
+            self.reduction.warm_up()
+        level_specs = list(zip([output_path] + [level[0] for level in pyramid],
+                               self.reduction.levels))
+
+        # Setup checkpoint path
+        if checkpoint_path is None:
+            checkpoint_path = default_checkpoint_path(source_path)
+        self.checkpoint_path = checkpoint_path
+
+        if comm is not None:
+            self.comm = comm
+        elif HAVE_MPI:
+            self.comm = MPI.COMM_WORLD
+            print(f"You are using MPI. Welcome from rank {self.comm.rank} of {self.comm.size}",
+                  flush=True)
+        else:
+            self.comm = FallbackMPICommunicator()
+            print("In serial mode", flush=True)
+        self.telemetry = Telemetry(self.comm.rank)
+        if telemetry_path is not None:
+            self.telemetry.add_hook(make_sink(telemetry_path, self.comm.rank, self.comm.size))
+        self.telemetry_summary = telemetry_summary
+        if pipeline and self.comm.size > 1 and MPI.Query_thread() < MPI.THREAD_MULTIPLE:
+            print(f"[rank: {self.comm.rank}]: Warning: MPI does not provide MPI_THREAD_MULTIPLE, "
+                  f"pipelined execution is disabled.", flush=True)
+            pipeline = False
+        self.pipeline = pipeline
+        self.pipeline_depth = pipeline_depth
+        self.pipeline_memory = pipeline_memory
+        self.slab_size = slab_size
+        self.component_threads = component_threads
+        self.particles = list(particles or [])
+        self.particle_quantities = [quantity
+                                    for quantity in QUANTITIES if quantity in particle_quantities]
+        self.particle_grid = particle_grid
+        self.particle_stride = particle_stride
+        self.particle_chunk = particle_chunk
+        self.decomposition = decomposition
+        self.host = socket.gethostname()
+        if decomposition == 'chunks':
+            self.reader_hosts = self.comm.allgather(self.host) if self.comm.size > 1 else \
+                [self.host]
+        # hosts of the writer ranks of the current iteration and what this rank read from them
+        self._writer_hosts: dict[int, str] = {}
+        self._read_stats = {'blocks': 0, 'bytes': 0, 'host_bytes': 0}
+        if wait:
+            while not os.path.exists(source_path):
+                time.sleep(1)
+        self.levels = []
+        for level_path, level_scaling in level_specs:
+            if self.comm.size == 1:
+                level_series = api.Series(level_path, api.Access.create, options_out)
+            else:
+                level_series = api.Series(level_path, api.Access.create, self.comm, options_out)
+            self.levels.append(OutputLevel(level_path, level_series, level_scaling))
+        self.output_series = self.levels[0].series
+        print("opened output series", flush=True)
+        if self.comm.size == 1:
+            self.input_series = api.Series(source_path, api.Access.read_only, options_in)
+        else:
+            self.input_series = api.Series(source_path, api.Access.read_only, self.comm, options_in)
+        print("opened input series", flush=True)
+        checkpoint = None
+        if self.comm.rank == 0:
+            # selected iterations are checked already, and other groups may be appending to the
+            # checkpoint
+            checkpoint = load_checkpoint(self.checkpoint_path, self.input_series, first_iteration,
+                                         verify_checkpoint if iterations is None else 'none',
+                                         repair=iterations is None,
+                                         output_paths=[level.path for level in self.levels])
+        if self.comm.size > 1:
+            checkpoint = self.comm.bcast(checkpoint, root=0)
+        self.completed_iterations, first_iteration = checkpoint
+        self._checkpoint: Optional[CheckpointWriter] = None
+        self.last_iteration = last_iteration
+        self.first_iteration = first_iteration
+        self.iterations = None if iterations is None else list(iterations)
+        self.stage_times = StageTimes()
+        self._pipeline: Optional[Pipeline] = None
+        self._scheduler: Optional[ComponentScheduler] = None
+        self._errors_lock = threading.Lock()
+        # reduction plans for full steps (None) and for steps degraded by a backpressure policy
+        self._plans: dict[Optional[str], ReductionPlan] = {}
+        # largest absolute and relative error of the encoded output per (level, mesh, record
+        # component)
+        self.encoding_errors: dict[tuple, list] = {}
+
+    def finalize(self):
+        self._buffers.clear()
+        del self.output_series
+        del self.levels
+        del self.input_series
+        self.telemetry.close()
+
+    def _rank_table(self) -> dict:
+        """ Hosts of the writer ranks by source id, empty if the source does not record them """
+        # the rank table was added in openPMD-api 0.16
+        get_rank_table = getattr(self.input_series, 'get_rank_table', None)
+        if get_rank_table is None:
+            return {}
+        try:
+            return dict(get_rank_table(False))
+        except (RuntimeError, api.Error):
+            return {}
+
+    def _local_chunks(self, input_mrc: api.Mesh_Record_Component, roi: Chunk,
+                      scalings: Optional[list]) -> list:
+        """ The chunks of a record component's region of interest processed on this mpi rank """
+        # the chunk boundaries have to be aligned with the bins of the coarsest level
+        divisible = [1 for _ in roi.extent] if scalings is None else list(scalings[-1])
+        # the finer levels cover cells behind the last bin of the coarsest level, which go to the
+        # last block on each axis as a partial bin of the coarsest level
+        region = roi
+        if scalings is not None:
+            shape = list(roi.extent)
+            covered = Chunk([0 for _ in shape], shape).bin_aligned(scalings[0], shape,
+                                                                   self.reduction.partial_bins)
+            region = Chunk(list(roi.offset), covered.extent)
+        if self.decomposition == 'chunks':
+            blocks = self._assigned_blocks(input_mrc, region, divisible)
+            if blocks is not None:
+                return blocks
+        if self.decomposition == 'slab':
+            chunk = Chunk([0 for _ in region.extent], list(region.extent))
+            return [chunk.slice1D(self.comm.rank, self.comm.size, dimension=0,
+                                  divisible=divisible[0])
+                    .shifted(region.offset)]
+        return [region.slice_blocks(self.comm.rank, self.comm.size, divisible=divisible,
+                                    partial=True)]
+
+    def _assigned_blocks(self, input_mrc: api.Mesh_Record_Component, region: Chunk,
+                         divisible: list) -> Optional[list]:
+        """ The written blocks of a record component on this rank, grown or shrunk to whole bins
+
+        Every bin is read by the rank holding the block its first cell was written in. Blocks are
+        cut to the region covered by the first level, whose first cell starts the first bin and
+        whose last bin on each axis may be partial. Returns None if the blocks can not keep all
+        ranks busy or do not tile the region.
+        """
+        shape = list(region.extent)
+        origin = [-oo for oo in region.offset]
+        blocks = []
+        source_ids = []
+        for written in input_mrc.available_chunks():
+            block = Chunk(list(written.offset), list(written.extent)).intersection(region)
+            if 0 in block.extent:
+                continue
+            block = block.shifted(origin).bin_aligned(divisible, shape, True).shifted(region.offset)
+            if 0 not in block.extent:
+                blocks.append(block)
+                source_ids.append(written.source_id)
+        cells = [int(np.prod(block.extent)) for block in blocks]
+        if len(blocks) < self.comm.size or sum(cells) != int(np.prod(shape)):
+            return None
+        nbytes = [cc * np.dtype(input_mrc.dtype).itemsize for cc in cells]
+        local = assign_blocks(nbytes, source_ids, self.reader_hosts,
+                              self._writer_hosts)[self.comm.rank]
+        self._read_stats['blocks'] += len(local)
+        self._read_stats['bytes'] += sum(nbytes[bb] for bb in local)
+        self._read_stats['host_bytes'] += sum(
+            nbytes[bb] for bb in local if self._writer_hosts.get(source_ids[bb]) == self.host)
+        return [blocks[bb] for bb in local]
+
+    def _slab_thickness(self, chunk: Chunk, dtype: np.dtype, scalings: Optional[list]) -> int:
+        """ Cells along the first axis fitting into slab_size, rounded down to whole bins """
+        divisible = 1 if scalings is None else scalings[-1][0]
+        if self.slab_size is None:
+            return max(chunk.extent[0], divisible)
+        bytes_per_row = int(np.prod(chunk.extent[1:])) * np.dtype(dtype).itemsize
+        if scalings is not None:
+            # the reduced rows are held until written as well
+            bytes_per_row += sum(bytes_per_row // int(np.prod(scaling)) for scaling in scalings)
+        rows = self.slab_size // max(bytes_per_row, 1)
+        return max(rows // divisible, 1) * divisible
+
+    def _load(self, input_mesh: api.Mesh, tasks: list) -> None:
+        """ Loads the data of tasks with a single flush, reserving pipeline memory first """
+        if self._pipeline is not None:
+            self._pipeline.acquire(sum(task.nbytes for task in tasks))
+        if not tasks:
+            self.input_series.flush()
+            return
+        # with several record components loaded by one flush, their time can only be measured
+        # together
+        mrc_name = tasks[0].mrc_name if len(tasks) == 1 else None
+        nbytes = sum(int(np.prod(task.input_extent)) * task.dtype.itemsize for task in tasks)
+        with self.telemetry.time("load", tasks[0].iteration_index, tasks[0].mesh_name, mrc_name,
+                                 nbytes):
+            self._load_chunks(input_mesh, tasks)
+
+    def _load_chunks(self, input_mesh: api.Mesh, tasks: list) -> None:
+        for task in tasks:
+            task.input_data = self._buffers.acquire(task.input_extent, task.dtype)
+            load_task(input_mesh[task.mrc_name], task)
+        self.input_series.flush()
+
+    def _layout(self, input_iteration: api.Iteration) -> tuple:
+        """ Everything a reduction plan depends on, as a comparable tuple """
+        layout = []
+        for mesh_name, input_mesh in input_iteration.meshes.items():
+            # the region of interest depends on the grid, e.g. with a moving window
+            grid = (tuple(input_mesh.grid_global_offset), tuple(input_mesh.grid_spacing),
+                    input_mesh.grid_unit_SI) if self.reduction.roi else None
+            layout.append((mesh_name, tuple(input_mesh.axis_labels), grid,
+                           tuple((mrc_name, tuple(input_mrc.shape), np.dtype(input_mrc.dtype).str)
+                                 for mrc_name, input_mrc in input_mesh.items())))
+        return tuple(layout)
+
+    def _get_plan(self, input_iteration: api.Iteration, idx: int,
+                  degradation: Optional[str] = None) -> ReductionPlan:
+        """ The reduction plan for an iteration, the previous one if the layout did not change
+
+        :param degradation: backpressure policy the iteration is degraded by, None for the full plan
+        """
+        layout = self._layout(input_iteration)
+        plan = self._plans.get(degradation)
+        if plan is not None and plan.layout == layout:
+            return plan
+        if plan is not None and degradation is None:
+            print(f"[rank: {self.comm.rank}]: The layout of iteration {idx} differs from the "
+                  "previous one, rebuilding the reduction plan.", flush=True)
+        if degradation is None:
+            plan = ReductionPlan(layout,
+                                 [self._plan_mesh(mesh_name, input_mesh)
+                                  for mesh_name, input_mesh in input_iteration.meshes.items()])
+        else:
+            plan = self._degraded_plan(input_iteration, self._get_plan(input_iteration, idx),
+                                       degradation)
+        self._plans[degradation] = plan
+        return plan
+
+    def _degraded_plan(self, input_iteration: api.Iteration, plan: ReductionPlan,
+                       degradation: str) -> ReductionPlan:
+        """ The plan for iterations degraded by a backpressure policy, derived from the full one """
+        if degradation == 'coarsen':
+            return ReductionPlan(plan.layout,
+                                 [self._plan_mesh(mesh_name, input_mesh, self._backpressure.factor)
+                                  for mesh_name, input_mesh in input_iteration.meshes.items()])
+        if degradation == 'decimate':
+            decimate = get_operator('decimate')
+            return ReductionPlan(plan.layout, [
+                MeshPlan(mesh_plan.name, mesh_plan.scalings,
+                         decimate if mesh_plan.operator else None,
+                         mesh_plan.components, mesh_plan.encoding, mesh_plan.grid_global_offset)
+                for mesh_plan in plan.meshes])
+        return ReductionPlan(plan.layout, [mesh_plan for mesh_plan in plan.meshes
+                                           if mesh_plan.name not in self._backpressure.meshes])
+
+    def _plan_mesh(self, mesh_name: str, input_mesh: api.Mesh, coarsen: int = 1) -> MeshPlan:
+        """ How a mesh is reduced, with all bin factors multiplied by coarsen """
+        scalings = None
+        operator = None
+        encoding = None
+        if self.reduction.selects(mesh_name):
+            scalings = self.reduction.scalings(input_mesh.axis_labels, coarsen)
+            operator = self.reduction.operator_for(mesh_name)
+            encoding = self.reduction.encoding_for(mesh_name)
+        components = []
+        grid = mesh_grid(input_mesh)
+        roi_offset = None
+        for mrc_name, input_mrc in input_mesh.items():
+            roi = self.reduction.region(list(input_mrc.shape), input_mesh.axis_labels, grid,
+                                        f"the mesh {mesh_name}")
+            roi_offset = roi.offset
+            output_shapes = self.reduction.output_shapes(roi, scalings)
+            chunks = None
+            # the written blocks may move between iterations
+            if self.decomposition != 'chunks':
+                chunks = self._task_chunks(self._local_chunks(input_mrc, roi, scalings),
+                                           input_mrc.dtype, scalings)
+            components.append(ComponentPlan(mrc_name, input_mrc.dtype, roi, output_shapes, chunks))
+        grid_global_offset = None if roi_offset is None else region_origin(grid, roi_offset)
+        return MeshPlan(mesh_name, scalings, operator, components, encoding, grid_global_offset)
+
+    def _task_chunks(self, local_chunks: list, dtype: np.dtype, scalings: Optional[list]) -> list:
+        """ Task chunks of a record component, the local chunks or, streaming, their slabs """
+        chunks = []
+        for local_chunk in local_chunks:
+            if 0 in local_chunk.extent:
+                # more ranks than bins, nothing to do on this rank
+                continue
+            if self.slab_size is None:
+                chunks.append(local_chunk)
+            else:
+                chunks.extend(local_chunk.split(self._slab_thickness(local_chunk, dtype, scalings)))
+        return chunks
+
+    def _read_mesh(self, idx: int, input_mesh: api.Mesh, mesh_plan: MeshPlan):
+        """ Reads all record components of a mesh, see _read_iteration """
+        mesh_name, scalings, operator, encoding = (mesh_plan.name, mesh_plan.scalings,
+                                                   mesh_plan.operator, mesh_plan.encoding)
+        tasks = []
+        for component in mesh_plan.components:
+            input_mrc = input_mesh[component.name]
+            yield partial(self._begin_output_record_component, idx, mesh_name, component.name,
+                          read_attributes(input_mrc), component.dtype, component.output_shapes,
+                          encoding)
+            chunks = component.chunks
+            if chunks is None:
+                chunks = self._task_chunks(self._local_chunks(input_mrc, component.roi, scalings),
+                                           component.dtype, scalings)
+            for chunk in chunks:
+                task = self.reduction.make_task(idx, mesh_name, component.name, component.dtype,
+                                                chunk, component.roi, scalings, operator, encoding)
+                if self.slab_size is None:
+                    tasks.append(task)
+                    continue
+                # stream the local chunk slab by slab, each slab is written before the next one is
+                # read
+                self._load(input_mesh, [task])
+                yield task
+                yield partial(self._flush_output, idx, mesh_name, task.nbytes)
+        if self.slab_size is None:
+            # copy mesh data to memory, all record components of a mesh are loaded with a single
+            # flush
+            self._load(input_mesh, tasks)
+            yield from tasks
+            yield partial(self._flush_output, idx, mesh_name, sum(task.nbytes for task in tasks))
+
+    def _read_iteration(self, input_iteration: api.Iteration, idx: int, start_time: float,
+                        degradation: Optional[str] = None):
+        """ Reads one iteration mesh by mesh
+
+        Yields RecordComponentTasks with the loaded data and, in between, callables that perform the
+        corresponding operations on the output series. Only the input series is touched here.
+
+        :param degradation: backpressure policy the iteration is degraded by, None to process it
+            fully
+        """
+        input_meshes = input_iteration.meshes
+        if self.decomposition == 'chunks':
+            self._writer_hosts = self._rank_table()
+            self._read_stats = {'blocks': 0, 'bytes': 0, 'host_bytes': 0}
+        plan = self._get_plan(input_iteration, idx)
+        # particles are deposited as usual, on the grid of the full plan
+        mesh_plans = plan.meshes if degradation is None else \
+            self._get_plan(input_iteration, idx, degradation).meshes
+        yield partial(self._begin_output_iteration, idx, read_attributes(input_iteration),
+                      read_attributes(input_meshes),
+                      self._backpressure_attributes(plan, degradation))
+        for mesh_plan in mesh_plans:
+            input_mesh = input_meshes[mesh_plan.name]
+            # attributes are read for every iteration, since every output iteration needs all of
+            # them
+            yield partial(self._begin_output_mesh, idx, mesh_plan.name, read_attributes(input_mesh),
+                          list(input_mesh.grid_spacing), mesh_plan.scalings, mesh_plan.operator,
+                          mesh_plan.grid_global_offset)
+            yield from self._read_mesh(idx, input_mesh, mesh_plan)
+        yield from self._read_particles(idx, input_iteration, plan)
+        with self.telemetry.time("close_input", idx):
+            input_iteration.close()
+        if self.decomposition == 'chunks':
+            stats = self._read_stats
+            print(f"[rank: {self.comm.rank}]: Iteration {idx}: read {stats['blocks']} written "
+                  f"blocks with {stats['bytes']} bytes on host {self.host}, {stats['host_bytes']} "
+                  "bytes of them were written on this host.", flush=True)
+        yield partial(self._end_output_iteration, idx, start_time)
+
+    def _particle_grids(self, input_iteration: api.Iteration, plan: ReductionPlan) -> tuple:
+        """ The grid of each output level the particles are deposited on, that of the reference mesh
+
+        :return: (name of the reference mesh, list of ParticleGrid)
+        """
+        reduced = [mesh_plan for mesh_plan in plan.meshes if mesh_plan.scalings is not None]
+        if self.particle_grid is not None:
+            reduced = [mesh_plan for mesh_plan in reduced if mesh_plan.name == self.particle_grid]
+        if not reduced:
+            raise ValueError(f"depositing particles needs a reduced mesh for the grid, "
+                             f"{self.particle_grid or 'there is none'}")
+        mesh_plan = reduced[0]
+        input_mesh = input_iteration.meshes[mesh_plan.name]
+        component = mesh_plan.components[0]
+        unit_si = input_mesh.grid_unit_SI
+        # the lower edge of the region of interest, gridGlobalOffset of the output mesh
+        origin = [(offset + cells * spacing) * unit_si for offset, cells, spacing in
+                  zip(input_mesh.grid_global_offset, component.roi.offset, input_mesh.grid_spacing)]
+        grids = [ParticleGrid(input_mesh.axis_labels, origin,
+                              [spacing * factor * unit_si
+                               for spacing, factor in zip(input_mesh.grid_spacing, scaling)],
+                              shape)
+                 for scaling, shape in zip(mesh_plan.scalings, component.output_shapes)]
+        return mesh_plan.name, grids
+
+    def _read_particles(self, idx: int, input_iteration: api.Iteration, plan: ReductionPlan):
+        """ Deposits and subsamples the selected particle species, see _read_iteration """
+        if not self.particles:
+            return
+        reference, grids = None, None
+        if self.particle_quantities:
+            reference, grids = self._particle_grids(input_iteration, plan)
+        input_species = dict(input_iteration.particles.items())
+        for species_name in self.particles:
+            if species_name not in input_species:
+                print(f"[rank: {self.comm.rank}]: Warning: iteration {idx} has no particle species "
+                      f"{species_name}.",
+                      flush=True)
+                continue
+            yield from self._read_species(idx, species_name, input_species[species_name],
+                                          input_iteration.meshes[reference] if grids else None,
+                                          grids)
+
+    def _read_species(self, idx: int, species_name: str, species: api.ParticleSpecies,
+                      reference_mesh: Optional[api.Mesh], grids: Optional[list]):
+        """ Reads a species in chunks, deposits them and passes every particle_stride-th one on """
+        records = [(record_name, record, list(record.items()))
+                   for record_name, record in species.items()]
+        count = records[0][2][0][1].shape[0] if records else 0
+        quantities = self.particle_quantities if grids else []
+        # what is needed for depositing the current and the energy
+        if any(quantity != 'density' for quantity in quantities) and not all(
+                name in species for name in ('momentum', 'mass', 'charge')):
+            print(f"[rank: {self.comm.rank}]: Warning: species {species_name} lacks momentum, mass "
+                  "or charge, only its density is deposited.", flush=True)
+            quantities = [quantity for quantity in quantities if quantity == 'density']
+        needed = {'position', 'positionOffset', 'weighting'}
+        if quantities != ['density']:
+            needed |= {'momentum', 'mass', 'charge'}
+        if self.particle_stride is not None:
+            subsampled_count = subsample_range(0, count, self.particle_stride)[2]
+            yield partial(self._begin_output_species, idx, species_name, read_attributes(species),
+                          [(record_name, read_attributes(record),
+                            [(name, read_attributes(component), np.dtype(component.dtype),
+                              self._constant_value(record_name, record, component))
+                             for name, component in components])
+                           for record_name, record, components in records],
+                          subsampled_count)
+        sums = make_sums(grids[0]) if quantities else None
+        start, stop = particle_range(count, self.comm.rank, self.comm.size)
+        for chunk_start, chunk_stop in particle_chunks(start, stop, self.particle_chunk):
+            length = chunk_stop - chunk_start
+            data = {}
+            with self.telemetry.time("load", idx, species_name):
+                for record_name, record, components in records:
+                    if self.particle_stride is None and record_name not in needed:
+                        continue
+                    for name, component in components:
+                        data[record_name, name] = component.load_chunk([chunk_start], [length])
+                self.input_series.flush()
+            if sums is not None:
+                with self.telemetry.time("reduce", idx, species_name,
+                                         nbytes=sum(arr.nbytes for arr in data.values())):
+                    self._deposit_chunk(species, data, grids[0], sums, quantities != ['density'])
+            if self.particle_stride is None:
+                continue
+            first, offset, kept = subsample_range(chunk_start, chunk_stop, self.particle_stride)
+            if kept:
+                subsampled = {}
+                for record_name, record, components in records:
+                    factor = stride_factor(record_name, record, self.particle_stride)
+                    for name, component in components:
+                        if component.constant:
+                            continue
+                        values = np.ascontiguousarray(data[record_name,
+                                                           name][first::self.particle_stride])
+                        if factor != 1 and (isinstance(factor, int)
+                                            or np.issubdtype(values.dtype, np.floating)):
+                            values *= factor
+                        subsampled[record_name, name] = values
+                yield partial(self._store_particles, idx, species_name, subsampled, offset)
+            yield partial(self._flush_output, idx, species_name, 0)
+        if sums is not None:
+            yield from self._deposited_meshes(idx, species_name, sums, quantities, reference_mesh,
+                                              grids)
+
+    def _constant_value(self, record_name: str, record: api.Record,
+                        component: api.Record_Component):
+        """ Value of a constant record component in the subsampled species, None for the others """
+        if not component.constant:
+            return None
+        value = component.get_attribute("value")
+        factor = stride_factor(record_name, record, self.particle_stride)
+        if isinstance(value, float) or isinstance(factor, int) and isinstance(value, int):
+            value *= factor
+        return value
+
+    def _deposit_chunk(self, species: api.ParticleSpecies, data: dict, grid: ParticleGrid,
+                       sums: np.ndarray, moving: bool) -> None:
+        """ Converts a chunk of particles to SI units and adds it to the per cell sums """
+        weighting = np.ones(len(next(iter(data.values()))))
+        if 'weighting' in species:
+            component = species['weighting'][api.Record_Component.SCALAR]
+            weighting = data['weighting', api.Record_Component.SCALAR] * component.unit_SI
+        position = []
+        for label in grid.axis_labels:
+            if ('position', label) not in data:
+                raise ValueError(f"the particles have no position along the grid's axis {label}")
+            values = to_si(species['position'], species['position'][label], data['position', label],
+                           weighting)
+            if ('positionOffset', label) in data:
+                values += to_si(species['positionOffset'], species['positionOffset'][label],
+                                data['positionOffset', label], weighting)
+            position.append(values)
+        if not moving:
+            deposit(grid, sums, np.array(position), weighting)
+            return
+        momentum = np.zeros((3, len(weighting)))
+        for cc, name in enumerate(('x', 'y', 'z')):
+            if ('momentum', name) in data:
+                momentum[cc] = to_si(species['momentum'], species['momentum'][name],
+                                     data['momentum', name], weighting)
+        mass, charge = [to_si(species[record_name],
+                              species[record_name][api.Record_Component.SCALAR],
+                              data[record_name, api.Record_Component.SCALAR], weighting)
+                        for record_name in ('mass', 'charge')]
+        deposit(grid, sums, np.array(position), weighting, momentum, mass, charge)
+
+    def _deposited_meshes(self, idx: int, species_name: str, sums: np.ndarray, quantities: list,
+                          reference_mesh: api.Mesh, grids: list):
+        """ Sums the deposited particles of all ranks up on rank 0 and yields writing the meshes """
+        if self.comm.size > 1:
+            total = np.empty_like(sums) if self.comm.rank == 0 else None
+            self.comm.Reduce(sums, total, op=MPI.SUM, root=0)
+            sums = total
+        results = [None for _ in grids]
+        if self.comm.rank == 0:
+            level_sums = sums
+            summing = get_operator('sum')
+            for ll, grid in enumerate(grids):
+                if ll > 0:
+                    # coarser levels are summed up from the first one, like the meshes
+                    bins = [int(round(coarse / fine))
+                            for coarse, fine in zip(grid.cell_size, grids[0].cell_size)]
+                    level_sums = np.empty((SUM_ROWS, int(np.prod(grid.shape))))
+                    for row in range(SUM_ROWS):
+                        summing(sums[row].reshape(grids[0].shape),
+                                level_sums[row].reshape(grid.shape),
+                                make_scratch(grid.shape, np.float64), bins)
+                results[ll] = finalize(level_sums, grid.shape, grid.cell_volume, quantities)
+        dtype = reference_mesh[next(iter(reference_mesh.items()))[0]].dtype
+        dtype = np.dtype(dtype) if np.issubdtype(dtype, np.floating) else np.dtype(np.float64)
+        attributes = [attribute
+                      for attribute in read_attributes(reference_mesh)
+                      if attribute[0] in GRID_ATTRIBUTES]
+        grid_spacing = list(reference_mesh.grid_spacing)
+        for quantity in quantities:
+            yield partial(self._write_deposited, idx, f"{species_name}_{quantity}", species_name,
+                          quantity, attributes, grid_spacing, grids, dtype,
+                          [None if result is None else result[quantity] for result in results])
+
+    def _input_iterations(self):
+        """ Yields (index, iteration) of the input, step by step or the selected iterations """
+        if self.iterations is None:
+            for input_iteration in self.input_series.read_iterations():
+                yield input_iteration.iteration_index, input_iteration
+            return
+        for idx in self.iterations:
+            input_iteration = self.input_series.iterations[idx]
+            input_iteration.open()
+            yield idx, input_iteration
+
+    def _backpressure_attributes(self, plan: ReductionPlan, degradation: Optional[str]) -> dict:
+        """ Attributes marking an output iteration degraded by backpressure and the skipped ones """
+        attributes = {}
+        if self._skipped_iterations:
+            attributes["backpressureSkippedIterations"] = self._skipped_iterations
+            self._skipped_iterations = []
+        if degradation is not None:
+            attributes["backpressure"] = degradation
+            if degradation == 'coarsen':
+                attributes["backpressureBinFactor"] = self._backpressure.factor
+            elif degradation == 'meshes':
+                attributes["backpressureDroppedMeshes"] = [
+                    mesh_plan.name for mesh_plan in plan.meshes
+                    if mesh_plan.name in self._backpressure.meshes]
+        return attributes
+
+    def _degradation(self, wait: float) -> Optional[str]:
+        """ Policy degrading the next step, decided on rank 0 for all ranks, a collective call """
+        if self._backpressure is None:
+            return None
+        degradation = self._backpressure.begin_step(wait) if self.comm.rank == 0 else None
+        if self.comm.size > 1:
+            degradation = self.comm.bcast(degradation, root=0)
+        return degradation
+
+    def _read_items(self):
+        """ Goes over the input iterations, yielding everything to be reduced or written """
+        input_iterations = self._input_iterations()
+        while True:
+            wait_start = time.perf_counter()
+            # for streams this waits until the writer has finished the next step
+            idx, input_iteration = next(input_iterations, (None, None))
+            if input_iteration is None:
+                break
+            start_time = time.time()
+            step_start = time.perf_counter()
+            self.telemetry.record("wait_step", step_start - wait_start, idx)
+            if idx < self.first_iteration > 0 or idx in self.completed_iterations:
+                input_iteration.close()
+                print(f"[rank: {self.comm.rank}]:  Skipping iteration number {idx}.",
+                      flush=True)
+                continue
+            degradation = self._degradation(step_start - wait_start)
+            if degradation == 'skip':
+                input_iteration.close()
+                self._skipped_iterations.append(idx)
+                print(f"[rank: {self.comm.rank}]:  Falling behind the writer, skipping iteration "
+                      f"number {idx}.",
+                      flush=True)
+            else:
+                if degradation is not None:
+                    print(f"[rank: {self.comm.rank}]:  Falling behind the writer, degrading "
+                          f"iteration number {idx} by the {degradation!r} policy.", flush=True)
+                print(f"[rank: {self.comm.rank}]:  Starting to process iteration number {idx}."
+                      f" Starting to read data from source.", flush=True)
+                yield from self._read_iteration(input_iteration, idx, start_time, degradation)
+            if self._backpressure is not None:
+                self._backpressure.end_step(time.perf_counter() - step_start)
+            # selected iterations come in any order, they are within the range anyway
+            if self.iterations is None and idx >= self.last_iteration > 0:
+                break
+
+    def _reduce_task(self, task: RecordComponentTask) -> None:
+        if not task.reduced:
+            self.reduction.reduce_task(task)
+            return
+        with self.telemetry.time("reduce", task.iteration_index, task.mesh_name, task.mrc_name,
+                                 task.input_data.nbytes):
+            intermediates = self.reduction.reduce_task(task, self._buffers.acquire)
+        for ll, errors in enumerate(task.errors):
+            if errors is not None:
+                self._record_encoding_errors((ll, task.mesh_name, task.mrc_name), errors)
+        self._buffers.release(*intermediates)
+
+    def _record_encoding_errors(self, key: tuple, errors: tuple) -> None:
+        encoding = self.reduction.encoding_for(key[1])
+        # the chunks of a record component may be reduced at the same time
+        with self._errors_lock:
+            recorded = self.encoding_errors.setdefault(key, [0.0, 0.0])
+            clipped = encoding.clipped(errors[0]) and not encoding.clipped(recorded[0])
+            recorded[:] = [max(old, new) for old, new in zip(recorded, errors)]
+        if clipped:
+            ll, mesh_name, mrc_name = key
+            name = mesh_name if mrc_name == api.Mesh_Record_Component.SCALAR else \
+                f"{mesh_name}/{mrc_name}"
+            lowest, highest = encoding.value_range()
+            print(f"[rank: {self.comm.rank}]: Warning: {name} has values outside of [{lowest:g}, "
+                  f"{highest:g}] at level {ll}, which are clipped when stored as {encoding.name}. "
+                  f"Choose a wider integer type, a larger error bound or an offset.", flush=True)
+
+    def _report_encoding_errors(self) -> None:
+        """ Prints the largest errors of encoded record components on rank 0, a collective call """
+        gathered = self.comm.gather(self.encoding_errors,
+                                    root=0) if self.comm.size > 1 else [self.encoding_errors]
+        if self.comm.rank != 0:
+            return
+        errors = {}
+        for rank_errors in gathered:
+            for key, (absolute, relative) in rank_errors.items():
+                old = errors.get(key, (0.0, 0.0))
+                errors[key] = (max(old[0], absolute), max(old[1], relative))
+        lines = [f"{'level':>5} {'record component':>24} {'encoding':>16} {'max abs error':>13} "
+                 f"{'max rel error':>13}"]
+        for (ll, mesh_name, mrc_name), (absolute, relative) in sorted(errors.items()):
+            encoding = self.reduction.encoding_for(mesh_name)
+            name = mesh_name if mrc_name == api.Mesh_Record_Component.SCALAR else \
+                f"{mesh_name}/{mrc_name}"
+            clipped = " (clipped)" if encoding.clipped(absolute) else ""
+            lines.append(f"{ll:>5} {name:>24} {encoding.name:>16} {absolute:>13.4g} "
+                         f"{relative:>13.4g}{clipped}")
+        print(f"[rank: {self.comm.rank}]: Errors of the encoded output over {self.comm.size} "
+              "rank(s):\n" + "\n".join(lines), flush=True)
+
+    def _begin_output_iteration(self, idx: int, iteration_attributes: list, meshes_attributes: list,
+                                backpressure_attributes: Optional[dict] = None) -> None:
+        for level in self.levels:
+            # create iteration and copy attributes
+            output_iteration = level.output_iterations[idx] = level.write_iterations[idx]
+            write_attributes(output_iteration, iteration_attributes)
+            write_attributes(output_iteration.meshes, meshes_attributes)
+            for attribute, value in (backpressure_attributes or {}).items():
+                output_iteration.set_attribute(attribute, value)
+
+    def _begin_output_mesh(self, idx: int, mesh_name: str, mesh_attributes: list,
+                           grid_spacing: list, scalings: Optional[list],
+                           operator: Optional[ReductionOperator],
+                           grid_global_offset: Optional[list] = None) -> None:
+        for ll, level in enumerate(self.levels):
+            mesh = level.output_iterations[idx].meshes[mesh_name]
+            write_attributes(mesh, mesh_attributes)
+            # the output starts at the region of interest, the lower edge of its first cell stays
+            # where it was
+            if grid_global_offset is not None:
+                mesh.set_grid_global_offset(grid_global_offset)
+            # the new grid will have larger cells, so we need to adjust grid spacing if the mesh is
+            # beeing reduced
+            if scalings is not None:
+                mesh.set_grid_spacing(binned_spacing(grid_spacing, scalings[ll]))
+                mesh.set_attribute("reductionOperator", operator.name)
+
+    def _begin_output_record_component(self, idx: int, mesh_name: str, mrc_name: str,
+                                       mrc_attributes: list, dtype: np.dtype, global_extents: list,
+                                       encoding: Optional[OutputEncoding] = None) -> None:
+        if encoding is not None:
+            dtype = encoding.dtype
+        for level, global_extent in zip(self.levels, global_extents):
+            mrc = level.output_iterations[idx].meshes[mesh_name][mrc_name]
+            # the record component of a scalar mesh shares the mesh's attributes, which are written
+            # already and would otherwise reset the adjusted grid
+            if mrc_name != api.Mesh_Record_Component.SCALAR:
+                write_attributes(mrc, mrc_attributes)
+            if encoding is not None and encoding.quantised:
+                # stored * unitSI is the value in SI units (plus quantizationOffset * unitSI /
+                # quantizationStep)
+                unit_si = next((value for name, value, _ in mrc_attributes if name == "unitSI"),
+                               1.0)
+                mrc.set_unit_SI(encoded_unit_si(unit_si, encoding))
+                mrc.set_attribute("quantizationStep", encoding.step)
+                mrc.set_attribute("quantizationOffset", encoding.offset)
+            mrc.reset_dataset(api.Dataset(np.dtype(dtype), global_extent))
+
+    def _store_task(self, task: RecordComponentTask) -> None:
+        with self.telemetry.time("store", task.iteration_index, task.mesh_name, task.mrc_name,
+                                 sum(data.nbytes for data in task.output_data)):
+            for level, data, chunk in zip(self.levels, task.output_data, task.output_local_chunks):
+                mesh = level.output_iterations[task.iteration_index].meshes[task.mesh_name]
+                mrc = mesh[task.mrc_name]
+                mrc.store_chunk(data, chunk.offset, chunk.extent)
+        # the data is only written by the next flush, until then the buffers must not be reused
+        self._stored_buffers.setdefault(task.iteration_index, []).extend(task.output_data)
+        task.output_data = []
+
+    def _begin_output_species(self, idx: int, species_name: str, species_attributes: list,
+                              records: list, count: int) -> None:
+        """ Declares a subsampled particle species
+
+        :param records: (record name, attributes, [(component name, attributes, dtype, constant
+            value or None)])
+        """
+        for level in self.levels:
+            species = level.output_iterations[idx].particles[species_name]
+            write_attributes(species, species_attributes)
+            for record_name, record_attributes, components in records:
+                record = species[record_name]
+                # shape and value of constant components are set by make_constant and reset_dataset
+                write_attributes(record, [attribute for attribute in record_attributes
+                                          if attribute[0] not in CONSTANT_ATTRIBUTES])
+                for name, attributes, dtype, value in components:
+                    component = record[name]
+                    # the component of a scalar record shares the record's attributes
+                    if name != api.Record_Component.SCALAR:
+                        write_attributes(component, [attribute for attribute in attributes
+                                                     if attribute[0] not in CONSTANT_ATTRIBUTES])
+                    if value is not None:
+                        component.make_constant(value)
+                    component.reset_dataset(api.Dataset(dtype, [count]))
+
+    def _store_particles(self, idx: int, species_name: str, data: dict, offset: int) -> None:
+        with self.telemetry.time("store", idx, species_name,
+                                 nbytes=sum(arr.nbytes for arr in data.values())):
+            for level in self.levels:
+                species = level.output_iterations[idx].particles[species_name]
+                for (record_name, name), values in data.items():
+                    species[record_name][name].store_chunk(values, [offset], [len(values)])
+
+    def _write_deposited(self, idx: int, mesh_name: str, species_name: str, quantity: str,
+                         attributes: list, grid_spacing: list, grids: list, dtype: np.dtype,
+                         results: list) -> None:
+        """ Writes a deposited quantity as a mesh of each level, the data only passed on rank 0 """
+        for level, grid, result in zip(self.levels, grids, results):
+            mesh = level.output_iterations[idx].meshes[mesh_name]
+            write_attributes(mesh, attributes)
+            unit_si = mesh.grid_unit_SI
+            mesh.set_grid_spacing([size / unit_si for size in grid.cell_size])
+            mesh.set_grid_global_offset([origin / unit_si for origin in grid.origin])
+            mesh.set_unit_dimension(UNIT_DIMENSIONS[quantity])
+            mesh.set_attribute("depositedSpecies", species_name)
+            names = ['x', 'y', 'z'] if quantity == 'current' else [api.Mesh_Record_Component.SCALAR]
+            for cc, name in enumerate(names):
+                mrc = mesh[name]
+                mrc.set_unit_SI(1.0)
+                mrc.set_attribute("position", [0.5 for _ in grid.shape])
+                mrc.reset_dataset(api.Dataset(dtype, grid.shape))
+                if result is not None:
+                    with self.telemetry.time("store", idx, mesh_name, name,
+                                             int(np.prod(grid.shape)) * dtype.itemsize):
+                        mrc.store_chunk(result[cc][1].astype(dtype), [0 for _ in grid.shape],
+                                        grid.shape)
+
+    def _flush_output(self, idx: int, mesh_name: str, nbytes: int) -> None:
+        # in pipelined and streaming mode the data is written right away, so that its memory can be
+        # released
+        if self._pipeline is not None or self.slab_size is not None:
+            with self.telemetry.time("flush_output", idx, mesh_name):
+                for level in self.levels:
+                    level.series.flush()
+            self._buffers.release(*self._stored_buffers.pop(idx, []))
+        if self._pipeline is not None:
+            self._pipeline.budget.release(nbytes)
+
+    def _end_output_iteration(self, idx: int, start_time: float) -> None:
+        with self.telemetry.time("close_output", idx):
+            for level in self.levels:
+                level.output_iterations.pop(idx).close()
+        self._buffers.release(*self._stored_buffers.pop(idx, []))
+        # buffers of record components that did not come up in this iteration are freed
+        self._buffers.trim()
+        self.telemetry.end_iteration(idx)
+        elapsed = time.time() - start_time
+        print(
+            f"[rank: {self.comm.rank}]: Finished processing iteration number {idx}. Took "
+            f"{elapsed // 60} m {elapsed % 60} s",
+            flush=True)
+        # Write checkpoint after successful iteration, with the output files it has closed
+        if self._checkpoint is not None:
+            self._checkpoint.submit(idx,
+                                    [path for level in self.levels
+                                     for path in output_files(level.path, idx)])
+
+    def _make_scheduler(self) -> Optional[ComponentScheduler]:
+        """ Scheduler reducing several record components at once, None for one thread or if off """
+        if self.component_threads == 1 or kernel_threads() == 1:
+            return None
+        if not concurrent_kernels():
+            print(f"[rank: {self.comm.rank}]: Warning: numba's workqueue threading layer can not "
+                  "run kernels in several threads, record components are reduced one after "
+                  "another. Install TBB or use OpenMP (NUMBA_THREADING_LAYER).", flush=True)
+            return None
+        return ComponentScheduler(self._reduce_task, self.reduction.kernel_width,
+                                  set_kernel_threads, kernel_threads(), self.component_threads,
+                                  self.stage_times)
+
+    def _write_scheduled(self, scheduled: list) -> None:
+        """ Writes the tasks handed to the scheduler, in order, as soon as each one is reduced """
+        for task, future in scheduled:
+            future.result()
+            start = time.perf_counter()
+            self._write_item(task)
+            self.stage_times.add("write", time.perf_counter() - start)
+        scheduled.clear()
+
+    def _write_item(self, item) -> None:
+        if isinstance(item, RecordComponentTask):
+            self._store_task(item)
+        else:
+            item()
+
+    def run(self):
+        series_attributes = read_attributes(self.input_series)
+        for level in self.levels:
+            write_attributes(level.series, series_attributes)
+            if self.iterations is None:
+                level.write_iterations = level.series.write_iterations()
+            else:
+                # selected iterations are written in any order, which needs random access to the
+                # output's iterations
+                level.write_iterations = level.series.iterations
+        self.stage_times = StageTimes()
+        run_start = time.perf_counter()
+        if self.comm.rank == 0:
+            self._checkpoint = CheckpointWriter(self.checkpoint_path)
+        self._scheduler = self._make_scheduler()
+        if self.pipeline:
+            launch_threads()
+            self._pipeline = Pipeline(lambda item: isinstance(item, RecordComponentTask),
+                                      self._reduce_task, self._write_item, self.stage_times,
+                                      self.pipeline_depth, self.pipeline_memory, self._scheduler)
+            self._pipeline.start()
+        try:
+            items = self._read_items()
+            # tasks reduced by the scheduler, written when the next other item (e.g. the mesh's
+            # flush) comes
+            scheduled = []
+            while True:
+                start = time.perf_counter()
+                budget_wait = self.stage_times.budget_wait
+                item = next(items, None)
+                # waiting for the pipeline's memory budget is not reading
+                self.stage_times.add("read", time.perf_counter() - start
+                                     - (self.stage_times.budget_wait - budget_wait))
+                if item is None:
+                    break
+                if self._pipeline is not None:
+                    self._pipeline.submit(item)
+                    continue
+                if isinstance(item, RecordComponentTask) and self._scheduler is not None:
+                    scheduled.append((item, self._scheduler.submit(item)))
+                    continue
+                self._write_scheduled(scheduled)
+                if isinstance(item, RecordComponentTask):
+                    start = time.perf_counter()
+                    self._reduce_task(item)
+                    self.stage_times.add("reduce", time.perf_counter() - start)
+                start = time.perf_counter()
+                self._write_item(item)
+                self.stage_times.add("write", time.perf_counter() - start)
+            self._write_scheduled(scheduled)
+            if self._pipeline is not None:
+                self._pipeline.close()
+            if self._scheduler is not None:
+                self._scheduler.close()
+        finally:
+            if self._pipeline is not None:
+                self._pipeline.abort.set()
+            self._pipeline = None
+            if self._scheduler is not None:
+                self._scheduler.close(cancel=True)
+            self._scheduler = None
+            # the iterations finished before an error are still recorded
+            if self._checkpoint is not None:
+                self._checkpoint.close()
+            self._checkpoint = None
+        self.stage_times.wall = time.perf_counter() - run_start
+        print(f"[rank: {self.comm.rank}]: Stage times: {self.stage_times.summary()}", flush=True)
+        if self._buffers.reuse:
+            print(f"[rank: {self.comm.rank}]: Buffer pool: {self._buffers.allocated} buffer(s) "
+                  f"allocated, {self._buffers.reused} reused", flush=True)
+        records = self.telemetry.aggregate(self.comm, self.stage_times.wall)
+        if self.reduction.default_encoding is not None or any(self.reduction.encodings.values()):
+            self._report_encoding_errors()
+        if self._backpressure is not None and self.comm.rank == 0:
+            print(f"[rank: {self.comm.rank}]: Backpressure: {self._backpressure.degraded} step(s) "
+                  f"{'skipped' if self._backpressure.policy == 'skip' else 'degraded'} by the "
+                  f"{self._backpressure.policy!r} policy", flush=True)
+        if self.telemetry_summary and self.comm.rank == 0:
+            print(f"[rank: {self.comm.rank}]: Telemetry summary over {self.comm.size} "
+                  f"rank(s):\n{summary(records)}",
+                  flush=True)
@@ -0,0 +1,187 @@
+""" Deposition of particle species onto the reduced grid and subsampling of species
+
+Particles are deposited nearest grid point style: every macroparticle counts fully in the cell of
+the reduced grid its position falls into, the same as binning a density on the fine grid by summing
+it up. Per cell the kernel sums up the weights, the charge times velocity and the kinetic energy of
+the particles, from which the number density, the current density and the mean kinetic energy per
+particle follow (see finalize).
+"""
+import math
+from typing import Union
+
+import numpy as np
+import openpmd_api as api
+from numba import njit
+
+from .arguments import PARTICLE_QUANTITIES as QUANTITIES  # noqa: F401
+
+SPEED_OF_LIGHT = 299792458.0
+# openPMD unitDimension of the deposited meshes, powers of length, mass, time and current
+UNIT_DIMENSIONS = {
+    'density': {api.Unit_Dimension.L: -3},
+    'current': {api.Unit_Dimension.L: -2, api.Unit_Dimension.I: 1},
+    'energy': {api.Unit_Dimension.L: 2, api.Unit_Dimension.M: 1, api.Unit_Dimension.T: -2},
+}
+MOMENTUM_COMPONENTS = ('x', 'y', 'z')
+# rows of the per cell sums: weights, weighted charge times velocity along x, y and z, weighted
+# kinetic energy
+WEIGHTS, CURRENT, ENERGY = 0, 1, 4
+SUM_ROWS = 5
+
+
+class ParticleGrid:
+    """ Grid the particles of an iteration are deposited on, the reduced grid of a mesh
+
+    :param axis_labels: particle position component for each axis of the grid, in the order of the
+        mesh's axes
+    :param origin: lower edge of the grid along each axis in SI units
+    :param cell_size: size of a cell along each axis in SI units
+    :param shape: number of cells along each axis
+    """
+
+    def __init__(self, axis_labels: list, origin: list, cell_size: list, shape: list):
+        self.axis_labels = list(axis_labels)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.cell_size = np.asarray(cell_size, dtype=np.float64)
+        self.shape = [int(length) for length in shape]
+
+    @property
+    def cell_volume(self) -> float:
+        """ Product of the cell sizes, an area for 2D grids """
+        return float(np.prod(self.cell_size))
+
+
+def particle_range(count: int, rank: int, size: int) -> tuple:
+    """ Contiguous share (start, stop) of a species' particles processed by a rank """
+    return count * rank // size, count * (rank + 1) // size
+
+
+def particle_chunks(start: int, stop: int, chunk: int) -> list:
+    """ Splits a range of particles into (start, stop) chunks of at most chunk particles """
+    return [(offset, min(offset + chunk, stop)) for offset in range(start, stop, chunk)]
+
+
+def subsample_range(start: int, stop: int, stride: int) -> tuple:
+    """ Which particles of a range are kept when keeping every stride-th particle of the species
+
+    :return: (index of the first kept particle relative to start, offset of the kept ones in the
+        subsampled species, number of kept ones)
+    """
+    offset = -(-start // stride)
+    return offset * stride - start, offset, -(-stop // stride) - offset
+
+
+def macro_weighting(record: api.Record) -> float:
+    """ Power of the weighting contained in a record's values, 0 if they are per real particle """
+    if record.contains_attribute("macroWeighted") and record.get_attribute("macroWeighted"):
+        if record.contains_attribute("weightingPower"):
+            return float(record.get_attribute("weightingPower"))
+        return 1.0
+    return 0.0
+
+
+def stride_factor(record_name: str, record: api.Record, stride: int) -> Union[int, float]:
+    """ Factor the values of a record are multiplied with when keeping every stride-th macroparticle
+
+    Every kept macroparticle stands for stride of them, so the weighting, which is always per
+    macroparticle whatever its attributes say, grows by stride, and records containing the
+    weighting to some power by stride to that power. An integer factor keeps integer values whole.
+    """
+    power = 1.0 if record_name == 'weighting' else macro_weighting(record)
+    return stride if power == 1.0 else stride ** power
+
+
+def to_si(record: api.Record, component: api.Record_Component, data: np.ndarray,
+          weighting: np.ndarray) -> np.ndarray:
+    """ Values of a record component per real particle in SI units, as float64 """
+    values = data.astype(np.float64) * component.unit_SI
+    power = macro_weighting(record)
+    if power != 0.0:
+        values /= weighting ** power
+    return values
+
+
+@njit(cache=True, nogil=True)
+def _deposit(position, origin, cell_size, shape, weighting, momentum, mass, charge, sums):
+    """ Adds the particles to the per cell sums
+
+    :param position: position in SI units, one row per grid axis
+    :param momentum: momentum in SI units, three rows (x, y, z) or none if only the weights are
+        deposited
+    :param sums: (SUM_ROWS, cells) array, the cells in C order of the grid's shape
+    """
+    ndim = position.shape[0]
+    for ii in range(position.shape[1]):
+        cell = 0
+        inside = True
+        for dd in range(ndim):
+            index = math.floor((position[dd, ii] - origin[dd]) / cell_size[dd])
+            if index < 0 or index >= shape[dd]:
+                inside = False
+                break
+            cell = cell * shape[dd] + int(index)
+        if not inside:
+            continue
+        weight = weighting[ii]
+        sums[0, cell] += weight
+        if momentum.shape[0] == 0:
+            continue
+        p2 = momentum[0, ii] ** 2 + momentum[1, ii] ** 2 + momentum[2, ii] ** 2
+        m = mass[ii]
+        if m > 0.0:
+            gamma = math.sqrt(1.0 + p2 / (m * SPEED_OF_LIGHT) ** 2)
+            # (gamma - 1) m c^2 without the cancellation for slow particles
+            energy = p2 / (m * (gamma + 1.0))
+            scale = weight * charge[ii] / (gamma * m)
+        else:
+            # massless, v = c p / |p|
+            energy = math.sqrt(p2) * SPEED_OF_LIGHT
+            scale = weight * charge[ii] * SPEED_OF_LIGHT / math.sqrt(p2) if p2 > 0.0 else 0.0
+        for cc in range(3):
+            sums[1 + cc, cell] += scale * momentum[cc, ii]
+        sums[4, cell] += weight * energy
+
+
+def make_sums(grid: ParticleGrid) -> np.ndarray:
+    return np.zeros((SUM_ROWS, int(np.prod(grid.shape))), dtype=np.float64)
+
+
+def deposit(grid: ParticleGrid, sums: np.ndarray, position: np.ndarray, weighting: np.ndarray,
+            momentum: np.ndarray = None, mass: np.ndarray = None,
+            charge: np.ndarray = None) -> None:
+    """ Adds a chunk of particles to the per cell sums (see make_sums), per real particle in SI
+
+    :param position: (grid axes, particles) positions
+    :param momentum: (3, particles) momenta, None to deposit only the weights (the density)
+    """
+    if momentum is None:
+        momentum = np.empty((0, len(weighting)))
+        mass = charge = weighting
+    _deposit(np.ascontiguousarray(position, dtype=np.float64), grid.origin, grid.cell_size,
+             np.asarray(grid.shape, dtype=np.int64),
+             np.ascontiguousarray(weighting, dtype=np.float64),
+             np.ascontiguousarray(momentum, dtype=np.float64),
+             np.ascontiguousarray(mass, dtype=np.float64),
+             np.ascontiguousarray(charge, dtype=np.float64), sums)
+
+
+def finalize(sums: np.ndarray, shape: list, cell_volume: float, quantities) -> dict:
+    """ Deposited quantities from the per cell sums of all particles
+
+    :return: quantity name -> list of (record component name, array of the grid's shape): the number
+        density in 1/m^3, the current density in A/m^2 (x, y, z) and the mean kinetic energy per
+        particle in J (0 in empty cells)
+    """
+    shape = list(shape)
+    results = {}
+    if 'density' in quantities:
+        results['density'] = [(api.Mesh_Record_Component.SCALAR,
+                               (sums[WEIGHTS] / cell_volume).reshape(shape))]
+    if 'current' in quantities:
+        results['current'] = [(name, (sums[CURRENT + cc] / cell_volume).reshape(shape))
+                              for cc, name in enumerate(MOMENTUM_COMPONENTS)]
+    if 'energy' in quantities:
+        energy = np.divide(sums[ENERGY], sums[WEIGHTS], out=np.zeros_like(sums[ENERGY]),
+                           where=sums[WEIGHTS] > 0)
+        results['energy'] = [(api.Mesh_Record_Component.SCALAR, energy.reshape(shape))]
+    return results
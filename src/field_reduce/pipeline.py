@@ -0,0 +1,265 @@
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+# input cells a kernel thread should get at least, fewer do not pay for starting it
+MIN_CELLS_PER_THREAD = 1 << 16
+
+
+class StageTimes:
+    """ Accumulates the busy time of the read, reduce and write stages and the total wall time.
+
+    In serial mode the busy times add up to the wall time. In pipelined mode the stages overlap and
+    the ratio of the summed busy time to the wall time tells how much overlap was actually achieved
+    (1.0 means none, 3.0 means all three stages were busy all the time). The time the reader is
+    blocked on the memory budget is kept apart in budget_wait, it is neither busy time nor part of
+    the read stage.
+    """
+
+    stages = ("read", "reduce", "write")
+
+    def __init__(self):
+        self.busy = {stage: 0.0 for stage in self.stages}
+        self.budget_wait = 0.0
+        self.wall = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.busy[stage] += seconds
+
+    def add_budget_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.budget_wait += seconds
+
+    def overlap(self) -> float:
+        if self.wall <= 0.0:
+            return 1.0
+        return sum(self.busy.values()) / self.wall
+
+    def summary(self) -> str:
+        busy = ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in self.busy.items())
+        waited = f", waited for memory {self.budget_wait:.3f} s" if self.budget_wait > 0.0 else ""
+        return f"{busy}, wall {self.wall:.3f} s, overlap {self.overlap():.2f}x{waited}"
+
+
+class MemoryBudget:
+    """ Counts the bytes of in-flight record components, blocking the reader at a limit.
+
+    A request is always granted when nothing else is in flight, so a single record component larger
+    than the budget can not dead-lock the pipeline.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.in_use = 0
+        self.high_water_mark = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int, abort: threading.Event) -> None:
+        with self._condition:
+            while (self.limit is not None and self.in_use > 0 and self.in_use + nbytes > self.limit
+                   and not abort.is_set()):
+                self._condition.wait(0.1)
+            self.in_use += nbytes
+            self.high_water_mark = max(self.high_water_mark, self.in_use)
+
+    def release(self, nbytes: int) -> None:
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+
+def kernel_width(rows: int, cells: int, total_threads: int) -> int:
+    """ Number of threads worth giving to a kernel
+
+    :param rows: length of the kernel's parallel loop, the rows of its output
+    :param cells: number of input cells it reduces, every thread should get at least
+        MIN_CELLS_PER_THREAD of them
+    :param total_threads: threads available in total
+    """
+    return max(1, min(total_threads, rows, cells // MIN_CELLS_PER_THREAD))
+
+
+class ComponentScheduler:
+    """ Reduces several record components at the same time on a pool of threads.
+
+    Every item gets a share of the kernel threads, ``width_fn(item)`` of them (see kernel_width) or,
+    if ``component_threads`` is set, a fixed ``total_threads // component_threads``. It starts as
+    soon as that many threads are free, so a large 3D record component gets all of them for its
+    kernel, while small, 1D or thin 2D ones are reduced side by side with a few threads each. The
+    kernels release the GIL, so the pool threads run in parallel. ``set_threads`` is called with the
+    item's share on the pool thread before ``reduce_fn(item)``.
+    """
+
+    def __init__(self, reduce_fn: Callable, width_fn: Callable, set_threads: Callable,
+                 total_threads: int, component_threads: Optional[int] = None,
+                 times: Optional[StageTimes] = None):
+        if component_threads is not None and component_threads < 1:
+            raise ValueError("component_threads has to be at least 1")
+        self.reduce_fn = reduce_fn
+        self.width_fn = width_fn
+        self.set_threads = set_threads
+        self.total_threads = total_threads
+        self.component_threads = component_threads
+        self.times = times
+        # counts threads instead of bytes
+        self.budget = MemoryBudget(total_threads)
+        self._abort = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=component_threads or total_threads,
+                                            thread_name_prefix="field-reduce-component")
+
+    def threads_for(self, item) -> int:
+        if self.component_threads is not None:
+            return max(1, self.total_threads // self.component_threads)
+        return min(self.total_threads, max(1, self.width_fn(item)))
+
+    def submit(self, item) -> Future:
+        """ Schedules the reduction of an item, the future's result is None once it is done """
+        return self._executor.submit(self._reduce, item, self.threads_for(item))
+
+    def close(self, cancel: bool = False) -> None:
+        """ Waits for the submitted items, or only for those already running if cancel is true """
+        if cancel:
+            self._abort.set()
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+
+    def _reduce(self, item, threads: int) -> None:
+        self.budget.acquire(threads, self._abort)
+        try:
+            self.set_threads(threads)
+            start = time.perf_counter()
+            self.reduce_fn(item)
+            if self.times is not None:
+                self.times.add("reduce", time.perf_counter() - start)
+        finally:
+            self.budget.release(threads)
+
+
+class _Scheduled:
+    """ A task handed to the ComponentScheduler, written once its future is done """
+
+    def __init__(self, item, future: Future):
+        self.item = item
+        self.future = future
+
+
+class Pipeline:
+    """ Three stage read -> reduce -> write pipeline.
+
+    The caller (the reader) submits items from the main thread. Items for which ``is_task`` returns
+    true are passed to ``reduce_fn`` on a reduce thread, all items are then handed, in submission
+    order, to ``write_fn`` on a writer thread. Both hand-over queues are bounded by ``depth`` items,
+    the bytes held by in-flight items are bounded by ``memory_budget`` (see MemoryBudget,
+    ``write_fn`` is responsible for releasing them).
+
+    With a ``scheduler`` (see ComponentScheduler) tasks are handed to it instead of ``reduce_fn``,
+    so that several of them, also of different meshes, are reduced at the same time. The writer
+    waits for each of them in turn.
+
+    Since openPMD-api objects are not thread safe, everything touching the input series has to
+    happen in the reader and everything touching the output series in ``write_fn``.
+    """
+
+    def __init__(self, is_task: Callable, reduce_fn: Callable, write_fn: Callable,
+                 times: StageTimes, depth: int = 4, memory_budget: Optional[int] = None,
+                 scheduler: Optional[ComponentScheduler] = None):
+        if depth < 1:
+            raise ValueError("pipeline depth has to be at least 1")
+        self.is_task = is_task
+        self.reduce_fn = reduce_fn
+        self.write_fn = write_fn
+        self.times = times
+        self.scheduler = scheduler
+        self.budget = MemoryBudget(memory_budget)
+        self.abort = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._sentinel = object()
+        self._to_reduce = queue.Queue(maxsize=depth)
+        self._to_write = queue.Queue(maxsize=depth)
+        self._threads = [threading.Thread(target=self._reduce_loop, name="field-reduce-reduce",
+                                          daemon=True),
+                         threading.Thread(target=self._write_loop, name="field-reduce-write",
+                                          daemon=True)]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def acquire(self, nbytes: int) -> None:
+        """ Reserve memory for data about to be loaded, blocks while the budget is exhausted """
+        start = time.perf_counter()
+        self.budget.acquire(nbytes, self.abort)
+        self.times.add_budget_wait(time.perf_counter() - start)
+        self._raise_if_failed()
+
+    def submit(self, item) -> None:
+        self._put(self._to_reduce, item)
+        self._raise_if_failed()
+
+    def close(self) -> None:
+        """ Wait until all submitted items are written, re-raising errors of the worker threads """
+        self._put(self._to_reduce, self._sentinel)
+        for thread in self._threads:
+            thread.join()
+        self._raise_if_failed()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("pipelined execution failed") from self._error
+
+    def _fail(self, error: BaseException) -> None:
+        if self._error is None:
+            self._error = error
+        self.abort.set()
+
+    def _put(self, target: queue.Queue, item) -> None:
+        while not self.abort.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, source: queue.Queue):
+        while not self.abort.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return self._sentinel
+
+    def _reduce_loop(self) -> None:
+        try:
+            while True:
+                item = self._get(self._to_reduce)
+                if item is not self._sentinel and self.is_task(item):
+                    if self.scheduler is not None:
+                        item = _Scheduled(item, self.scheduler.submit(item))
+                    else:
+                        start = time.perf_counter()
+                        self.reduce_fn(item)
+                        self.times.add("reduce", time.perf_counter() - start)
+                self._put(self._to_write, item)
+                if item is self._sentinel:
+                    return
+        except BaseException as error:
+            self._fail(error)
+
+    def _write_loop(self) -> None:
+        try:
+            while True:
+                item = self._get(self._to_write)
+                if item is self._sentinel:
+                    return
+                if isinstance(item, _Scheduled):
+                    item.future.result()
+                    item = item.item
+                start = time.perf_counter()
+                self.write_fn(item)
+                self.times.add("write", time.perf_counter() - start)
+        except BaseException as error:
+            self._fail(error)
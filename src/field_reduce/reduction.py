@@ -0,0 +1,530 @@
+""" Reducing meshes in memory
+
+What OutputReducer does to the iterations it reads, without the series around it: a Reduction
+selects the meshes, works out their bin factors, region of interest, operator and output data type,
+reduces the data into every output level and updates the grid metadata. It takes numpy arrays or the
+meshes and iterations of a series that is open already, so the reduction can be embedded into other
+code, e.g. an in-situ analysis, without writing the data into a second series and reading it back:
+
+    reduction = Reduction(2, 2, 2, pyramid=[(4, 4, 4)])
+    binned, binned_more = reduction.reduce_array(data, ['x', 'y', 'z'])
+    reduced = reduction.reduce_iteration(series.iterations[100])    # {mesh name: ReducedMesh}
+
+All arrays of a call are reduced as one batch: the kernel threads are started once, scratch buffers
+are reused, and with several kernel threads small arrays are reduced side by side (see
+pipeline.ComponentScheduler). OutputReducer distributes the record components over the ranks, loads,
+writes and streams them around a Reduction.
+"""
+import math
+import openpmd_api as api
+import threading
+import numpy as np
+
+from typing import Callable, Iterable, Optional
+
+from .decomposition import Chunk
+from .downscale_kernel import (kernel_threads, set_kernel_threads, concurrent_kernels, make_scratch,
+                               scratch_shape, accumulation_dtype, get_operator, encode,
+                               ReductionOperator, warm_up as warm_up_kernels)
+from .encoding import OutputEncoding, get_encoding
+from .pipeline import ComponentScheduler, kernel_width
+
+# axis labels of arrays that come without, for their first, second and third axis
+AXIS_LABELS = ('x', 'y', 'z')
+
+
+class RecordComponentTask:
+    """ A chunk of a record component on its way through the read -> reduce -> write stages """
+
+    def __init__(self, iteration_index: Optional[int], mesh_name: Optional[str],
+                 mrc_name: Optional[str], dtype: np.dtype, local_chunk: Chunk,
+                 output_local_chunks: list, operator: Optional[ReductionOperator],
+                 read_step: int = 1, scalings: Optional[list] = None,
+                 encoding: Optional[OutputEncoding] = None):
+        """
+        :param output_local_chunks: chunk of the output written by this task, one for each output
+            level
+        :param operator: reduction operator to apply, None if the data is only copied
+        :param read_step: only every read_step-th cell along the first axis of local_chunk is loaded
+        :param scalings: bin factor for each axis relative to the source, one list for each output
+            level
+        :param encoding: data type the reduced data is written in, None for the input's data type
+        """
+        self.iteration_index = iteration_index
+        self.mesh_name = mesh_name
+        self.mrc_name = mrc_name
+        self.dtype = np.dtype(dtype)
+        self.local_chunk = local_chunk
+        self.output_local_chunks = output_local_chunks
+        self.operator = operator
+        self.read_step = read_step
+        self.scalings = scalings
+        self.encoding = encoding
+        self.input_data: Optional[np.ndarray] = None
+        # reduced data, one array for each output level
+        self.output_data: list = []
+        # largest absolute and relative error of each output level's encoded data, None without an
+        # encoding
+        self.errors: list = []
+
+    @property
+    def reduced(self) -> bool:
+        return self.operator is not None
+
+    @property
+    def input_extent(self) -> list:
+        """ Extent of the data that is actually loaded """
+        extent = self.local_chunk.extent
+        return [-(-extent[0] // self.read_step)] + list(extent[1:])
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory held by this task, input data plus the reduced output """
+        itemsize = self.dtype.itemsize
+        input_bytes = int(np.prod(self.input_extent)) * itemsize
+        if not self.reduced:
+            return input_bytes
+        return input_bytes + sum(int(np.prod(chunk.extent))
+                                 for chunk in self.output_local_chunks) * itemsize
+
+
+class ReducedMesh:
+    """ A mesh reduced in memory, with the metadata of the reduced mesh
+
+    :param name: name of the mesh
+    :param components: the reduced record components by name, one dict for each output level
+    :param grid_spacing: gridSpacing of the reduced mesh, one list for each output level
+    :param grid_global_offset: gridGlobalOffset of the reduced mesh, the lower edge of the region of
+        interest
+    :param operator: name of the reduction operator, None if the mesh is not reduced
+    :param encoding: data type the reduced data is converted to, None if it has the source's data
+        type
+    :param unit_si: unitSI of each reduced record component, including the quantisation step of the
+        encoding
+    :param errors: largest absolute and relative error of the encoded data per (level, record
+        component name)
+    """
+
+    def __init__(self, name: str, components: list, grid_spacing: list, grid_global_offset: list,
+                 operator: Optional[str], encoding: Optional[OutputEncoding], unit_si: dict,
+                 errors: dict):
+        self.name = name
+        self.components = components
+        self.grid_spacing = grid_spacing
+        self.grid_global_offset = grid_global_offset
+        self.operator = operator
+        self.encoding = encoding
+        self.unit_si = unit_si
+        self.errors = errors
+
+
+def mesh_grid(mesh: api.Mesh) -> tuple:
+    """ The grid of a mesh as (gridGlobalOffset, gridSpacing, gridUnitSI) """
+    return list(mesh.grid_global_offset), list(mesh.grid_spacing), mesh.grid_unit_SI
+
+
+def region_origin(grid: tuple, offset: list) -> Optional[list]:
+    """ gridGlobalOffset of a mesh cut to a region starting at a cell, None for its first cell
+
+    :param grid: the mesh's grid, see mesh_grid
+    """
+    if not any(offset):
+        return None
+    origin, spacing, _ = grid
+    return [start + cells * step for start, cells, step in zip(origin, offset, spacing)]
+
+
+def binned_spacing(grid_spacing: list, scaling: list) -> list:
+    """ gridSpacing of a mesh whose cells are binned by the given factors """
+    return [spacing * factor for spacing, factor in zip(grid_spacing, scaling)]
+
+
+def encoded_unit_si(unit_si: float, encoding: Optional[OutputEncoding]) -> float:
+    """ unitSI of data written with an encoding
+
+    Stored values times unitSI are the values in SI units, plus quantizationOffset * unitSI /
+    quantizationStep for quantised data.
+    """
+    if encoding is None or not encoding.quantised:
+        return unit_si
+    return unit_si * encoding.step
+
+
+def load_task(input_mrc: api.Mesh_Record_Component, task: RecordComponentTask) -> None:
+    """ Loads the data of a task into task.input_data, which has to hold task.input_extent cells
+
+    The data is there after the next flush of the series.
+    """
+    offset, extent = task.local_chunk.offset, task.local_chunk.extent
+    if task.read_step == 1:
+        input_mrc.load_chunk(task.input_data, offset, extent)
+        return
+    # only every read_step-th plane along the first axis is needed, load just those
+    for row in range(task.input_extent[0]):
+        input_mrc.load_chunk(task.input_data[row:row + 1],
+                             [offset[0] + row * task.read_step] + offset[1:], [1] + extent[1:])
+
+
+class Reduction:
+    """ How meshes are reduced, see the module description
+
+    :param div_x: bin factor along the axis labeled x
+    :param div_y: bin factor along the axis labeled y
+    :param div_z: bin factor along the axis labeled z
+    :param meshes: names of the meshes that are reduced, all by default. The others are kept as they
+        are.
+    :param exclude: names of the meshes that are not reduced, exclusive with meshes
+    :param precision: 'native' to accumulate bins in the data's own floating point type or 'float64'
+    :param operators: reduction operator per mesh name (see downscale_kernel.REDUCTION_OPERATORS),
+        for the meshes not listed default_operator is used
+    :param default_operator: name of the reduction operator for meshes not listed in operators
+    :param pyramid: bin factors (div_x, div_y, div_z) of further output levels, each reduced from
+        the previous level. They have to be multiples of the previous level's factors.
+    :param trailing_bins: 'drop' leaves out cells at the upper end of an axis that do not fill a
+        whole bin, 'partial' reduces them into an extra output cell over just the cells it has
+    :param output_dtypes: data type the reduced data of a mesh is converted to, by mesh name, e.g.
+        'float32' or 'int16:1e-3' (quantised with an error bound, see encoding.get_encoding)
+    :param default_output_dtype: output data type of the meshes not listed in output_dtypes,
+        'native' keeps the data type of the source
+    :param roi: region of interest, (start, stop) per axis label, either may be None for no bound.
+        Only this part of the meshes is reduced, the output starts at its lower edge.
+    :param roi_units: 'cells' for the region of interest in cell indices, 'si' for positions in
+        meters
+    """
+
+    def __init__(self, div_x: int = 1, div_y: int = 1, div_z: int = 1,
+                 meshes: Optional[Iterable[str]] = None, exclude: Optional[Iterable[str]] = None,
+                 precision: str = 'native', operators: Optional[dict] = None,
+                 default_operator: str = 'mean', pyramid: Optional[Iterable[tuple]] = None,
+                 trailing_bins: str = 'drop', output_dtypes: Optional[dict] = None,
+                 default_output_dtype: str = 'native', roi: Optional[dict] = None,
+                 roi_units: str = 'cells'):
+        if meshes is not None and exclude is not None:
+            raise ValueError("meshes and exclude are exclusive optional arguments and can't be set "
+                             "at the same time")
+        if trailing_bins not in ('drop', 'partial'):
+            raise ValueError(f"trailing_bins has to be 'drop' or 'partial', not {trailing_bins!r}")
+        if roi_units not in ('cells', 'si'):
+            raise ValueError(f"roi_units has to be 'cells' or 'si', not {roi_units!r}")
+        for axis, (start, stop) in (roi or {}).items():
+            if start is not None and stop is not None and not start < stop:
+                raise ValueError(f"the region of interest along {axis} is empty: {start} to {stop}")
+            if roi_units == 'cells' and any(bound is not None and bound != int(bound)
+                                            for bound in (start, stop)):
+                raise ValueError(f"the region of interest along {axis} has to be given in whole "
+                                 "cells")
+        # fail early on an invalid precision or an unknown operator
+        accumulation_dtype(np.float32, precision)
+        self.precision = precision
+        self.default_operator = get_operator(default_operator)
+        self.operators = {mesh_name: get_operator(name)
+                          for mesh_name, name in (operators or {}).items()}
+        self.default_encoding = get_encoding(default_output_dtype)
+        self.encodings = {mesh_name: get_encoding(spec)
+                          for mesh_name, spec in (output_dtypes or {}).items()}
+        self.meshes_to_reduce = list(meshes or [])
+        self.meshes_to_exclude = list(exclude or [])
+        # bin factor per axis label, one dict for each output level
+        self.levels = [{'x': div_x, 'y': div_y, 'z': div_z}]
+        for level_x, level_y, level_z in (pyramid or []):
+            level_scaling = {'x': level_x, 'y': level_y, 'z': level_z}
+            previous_scaling = self.levels[-1]
+            if any(level_scaling[axis] % previous_scaling[axis] != 0 for axis in level_scaling):
+                raise ValueError(f"the bin factors {level_scaling} of pyramid level "
+                                 f"{len(self.levels)} have to be multiples of the previous level's "
+                                 f"factors {previous_scaling}")
+            self.levels.append(level_scaling)
+        self.partial_bins = trailing_bins == 'partial'
+        self.roi = roi or {}
+        self.roi_units = roi_units
+        # scratch buffers of the kernels per thread, reused across record components and calls
+        self._scratch: dict[tuple, np.ndarray] = {}
+
+    def selects(self, mesh_name: str) -> bool:
+        """ Checks if a certain mesh is supposed to be reduced
+
+        :param mesh_name: the name of the mesh to check
+        :return: true if the mesh should be binned
+        """
+        # no options set:
+        if not self.meshes_to_reduce and not self.meshes_to_exclude:
+            return True
+        # meshes used
+        elif self.meshes_to_reduce:
+            return mesh_name in self.meshes_to_reduce
+        # exclude used
+        else:
+            return mesh_name not in self.meshes_to_exclude
+
+    def operator_for(self, mesh_name: str) -> ReductionOperator:
+        return self.operators.get(mesh_name, self.default_operator)
+
+    def encoding_for(self, mesh_name: str) -> Optional[OutputEncoding]:
+        return self.encodings.get(mesh_name, self.default_encoding)
+
+    def scalings(self, axis_labels: Iterable[str], coarsen: int = 1) -> list:
+        """ Bin factor per axis, a list for each output level, all factors multiplied by coarsen """
+        axis_labels = list(axis_labels)
+        return [[level[label] * coarsen for label in axis_labels] for level in self.levels]
+
+    def warm_up(self) -> None:
+        """ Starts compiling the kernels in use, see downscale_kernel.warm_up """
+        names = {self.default_operator.name} | {operator.name
+                                                for operator in self.operators.values()}
+        encodings = [encoding for encoding in [self.default_encoding, *self.encodings.values()]
+                     if encoding is not None]
+        if encodings and len(self.levels) > 1:
+            # the coarser levels are reduced from the unencoded data and encoded separately
+            names.add('decimate')
+        warm_up_kernels(sorted(names), self.precision, encodings)
+
+    def region(self, shape: list, axis_labels: Iterable[str], grid: Optional[tuple] = None,
+               name: str = "the data") -> Chunk:
+        """ The part of a record component of the given shape within the region of interest
+
+        :param grid: the mesh's grid (see mesh_grid), needed for a region of interest in SI units
+        :param name: what the record component is called in errors
+        """
+        offset = []
+        extent = []
+        for axis, (label, cells) in enumerate(zip(axis_labels, shape)):
+            start, stop = self.roi.get(label, (None, None))
+            if self.roi_units == 'si' and (start is not None or stop is not None):
+                if grid is None:
+                    raise ValueError(f"a region of interest in SI units needs the grid of {name}")
+                # cell ii covers [offset + ii * spacing, offset + (ii + 1) * spacing) in units of
+                # gridUnitSI
+                origin, spacing, unit_si = grid[0][axis], grid[1][axis], grid[2]
+                start = None if start is None else math.floor((start / unit_si - origin) / spacing)
+                stop = None if stop is None else math.ceil((stop / unit_si - origin) / spacing)
+            start = 0 if start is None else min(max(int(start), 0), cells)
+            stop = cells if stop is None else min(max(int(stop), start), cells)
+            offset.append(start)
+            extent.append(stop - start)
+        if 0 in extent:
+            raise ValueError(f"the region of interest {self.roi} does not overlap {name}")
+        return Chunk(offset, extent)
+
+    def output_shapes(self, roi: Chunk, scalings: Optional[list]) -> list:
+        """ Shape of a record component's region of interest per level, scalings None if copied """
+        region = Chunk([0 for _ in roi.extent], list(roi.extent))
+        if scalings is None:
+            return [region.extent for _ in self.levels]
+        return [region.downscaled(scaling, self.partial_bins).extent for scaling in scalings]
+
+    def make_task(self, idx: Optional[int], mesh_name: Optional[str], mrc_name: Optional[str],
+                  dtype: np.dtype, local_chunk: Chunk, roi: Chunk, scalings: Optional[list],
+                  operator: Optional[ReductionOperator], encoding: Optional[OutputEncoding] = None,
+                  strided: bool = True) -> RecordComponentTask:
+        """ The task reducing a chunk of a record component, bins starting at the region of interest
+
+        :param scalings: see scalings, None if the chunk is only copied
+        :param strided: if true and the operator only needs the first cell of each bin, only every
+            bin-th cell along the first axis is loaded
+        """
+        # the output starts at the first cell of the region of interest
+        output_chunk = local_chunk.shifted([-oo for oo in roi.offset])
+        if scalings is None:
+            return RecordComponentTask(idx, mesh_name, mrc_name, dtype, local_chunk,
+                                       [output_chunk for _ in self.levels], None)
+        read_step = scalings[0][0] if strided and operator.strided_read else 1
+        return RecordComponentTask(idx, mesh_name, mrc_name, dtype, local_chunk,
+                                   [output_chunk.downscaled(scaling, self.partial_bins)
+                                    for scaling in scalings],
+                                   operator, read_step, scalings, encoding)
+
+    def scratch(self, output_shape: list, dtype: np.dtype) -> np.ndarray:
+        """ The scratch buffer of the calling thread for a kernel with the given output """
+        key = (threading.get_ident(), scratch_shape(output_shape),
+               accumulation_dtype(dtype, self.precision))
+        if key not in self._scratch:
+            self._scratch[key] = make_scratch(output_shape, dtype, self.precision)
+        return self._scratch[key]
+
+    @staticmethod
+    def kernel_width(task: RecordComponentTask) -> int:
+        """ Threads worth giving to the kernels of a task, copied record components need none """
+        if not task.reduced:
+            return 1
+        return kernel_width(task.output_local_chunks[0].extent[0],
+                            int(np.prod(task.local_chunk.extent)), kernel_threads())
+
+    def reduce_task(self, task: RecordComponentTask, allocate: Callable = np.empty) -> list:
+        """ Reduces the loaded data of a task into task.output_data and task.errors
+
+        Every level is reduced from the previous one, so the coarser levels cost only a fraction of
+        the first.
+
+        :param allocate: called as allocate(shape, dtype) for the output, e.g. BufferPool.acquire
+        :return: the buffers only needed while reducing, including the input data, which the task
+            lets go of
+        """
+        if not task.reduced:
+            task.output_data = [task.input_data for _ in task.output_local_chunks]
+            task.errors = [None for _ in task.output_local_chunks]
+            return []
+        input_scaling = [task.read_step] + [1 for _ in task.local_chunk.extent[1:]]
+        source, source_scaling = task.input_data, input_scaling
+        encoding = task.encoding
+        intermediates = [task.input_data]
+        for ll, (chunk, scaling) in enumerate(zip(task.output_local_chunks, task.scalings)):
+            if self.partial_bins and any(ee % ss for ee, ss in zip(task.local_chunk.extent,
+                                                                   source_scaling)):
+                # the previous level ends with a partial bin, which must not count as much as a full
+                # one
+                source, source_scaling = task.input_data, input_scaling
+            last_level = ll == len(task.scalings) - 1
+            # the encoding is applied by the kernel, unless the next level is reduced from this one
+            dtype = encoding.dtype if encoding is not None and last_level else task.dtype
+            output_data = allocate(chunk.extent, dtype)
+            scratch = None
+            if task.operator.needs_scratch:
+                scratch = self.scratch(chunk.extent, task.dtype)
+            errors = task.operator(source, output_data, scratch,
+                                   [ss // ps for ss, ps in zip(scaling, source_scaling)],
+                                   encoding if last_level else None)
+            if encoding is not None and not last_level:
+                encoded = allocate(chunk.extent, encoding.dtype)
+                errors = encode(output_data, encoded, encoding)
+                task.output_data.append(encoded)
+                intermediates.append(output_data)
+            else:
+                task.output_data.append(output_data)
+            task.errors.append(errors)
+            source, source_scaling = output_data, scaling
+        task.input_data = None
+        return intermediates
+
+    def reduce_tasks(self, tasks: list, allocate: Callable = np.empty,
+                     component_threads: Optional[int] = None) -> list:
+        """ Reduces a batch of loaded tasks, several at a time if there are several kernel threads
+
+        :param component_threads: see pipeline.ComponentScheduler, 1 reduces one task after another
+        :return: the buffers only needed while reducing, see reduce_task
+        """
+        intermediates = []
+        if len(tasks) < 2 or component_threads == 1 or kernel_threads() == 1 or \
+                not concurrent_kernels():
+            for task in tasks:
+                intermediates.extend(self.reduce_task(task, allocate))
+            return intermediates
+        scheduler = ComponentScheduler(
+            lambda task: intermediates.extend(self.reduce_task(task, allocate)),
+            self.kernel_width, set_kernel_threads, kernel_threads(), component_threads)
+        try:
+            for future in [scheduler.submit(task) for task in tasks]:
+                future.result()
+        finally:
+            scheduler.close()
+        return intermediates
+
+    def reduce_array(self, data: np.ndarray, axis_labels: Optional[Iterable[str]] = None,
+                     mesh_name: Optional[str] = None) -> list:
+        """ Reduces an array into every output level, see reduce_arrays
+
+        :return: the reduced array of each output level
+        """
+        return self.reduce_arrays([data], axis_labels, mesh_name)[0]
+
+    def reduce_arrays(self, arrays: Iterable[np.ndarray],
+                      axis_labels: Optional[Iterable[str]] = None, mesh_name: Optional[str] = None,
+                      component_threads: Optional[int] = None) -> list:
+        """ Reduces a batch of arrays into every output level
+
+        The region of interest has to be given in cells. Arrays of meshes that are not selected are
+        passed on as they are, cut to the region of interest.
+
+        :param axis_labels: label of each axis of the arrays, by default x, y and z
+        :param mesh_name: mesh the arrays belong to, selecting whether they are reduced and the
+            operator and output data type, the defaults are used without
+        :param component_threads: see reduce_tasks
+        :return: for every array the reduced array of each output level
+        """
+        arrays = [np.asarray(data) for data in arrays]
+        reduced = mesh_name is None or self.selects(mesh_name)
+        operator = self.operator_for(mesh_name) if reduced else None
+        encoding = self.encoding_for(mesh_name) if reduced else None
+        tasks = []
+        for data in arrays:
+            labels = AXIS_LABELS[:data.ndim] if axis_labels is None else list(axis_labels)
+            if len(labels) != data.ndim:
+                raise ValueError(f"{len(labels)} axis labels given for {data.ndim}D data")
+            roi = self.region(list(data.shape), labels)
+            scalings = self.scalings(labels) if reduced else None
+            task = self.make_task(None, mesh_name, None, data.dtype, roi, roi, scalings, operator,
+                                  encoding, strided=False)
+            region = tuple(slice(start, start + length)
+                           for start, length in zip(roi.offset, roi.extent))
+            task.input_data = np.ascontiguousarray(data[region])
+            tasks.append(task)
+        self.reduce_tasks(tasks, component_threads=component_threads)
+        return [task.output_data for task in tasks]
+
+    def reduce_mesh(self, mesh: api.Mesh, mesh_name: str) -> ReducedMesh:
+        """ Loads and reduces the region of interest of a mesh, see reduce_meshes """
+        return self.reduce_meshes({mesh_name: mesh})[mesh_name]
+
+    def reduce_iteration(self, iteration: api.Iteration, copy: bool = True,
+                         component_threads: Optional[int] = None) -> dict:
+        """ Loads the meshes of an open iteration and reduces them, see reduce_meshes
+
+        :param copy: if false the meshes that are not selected are left out instead of being passed
+            on as they are
+        :return: ReducedMesh by mesh name
+        """
+        return self.reduce_meshes({mesh_name: mesh for mesh_name, mesh in iteration.meshes.items()
+                                   if copy or self.selects(mesh_name)}, component_threads)
+
+    def reduce_meshes(self, meshes: dict, component_threads: Optional[int] = None) -> dict:
+        """ Loads the region of interest of meshes with a single flush and reduces them as a batch
+
+        Decimated meshes are only loaded every bin-th cell along the first axis. Meshes that are not
+        selected are passed on as they are, cut to the region of interest.
+
+        :param meshes: the meshes by name
+        :param component_threads: see reduce_tasks
+        :return: ReducedMesh by mesh name
+        """
+        tasks = {}
+        flush = None
+        for mesh_name, mesh in meshes.items():
+            grid = mesh_grid(mesh)
+            reduced = self.selects(mesh_name)
+            scalings = self.scalings(mesh.axis_labels) if reduced else None
+            operator = self.operator_for(mesh_name) if reduced else None
+            encoding = self.encoding_for(mesh_name) if reduced else None
+            tasks[mesh_name] = []
+            for mrc_name, mrc in mesh.items():
+                roi = self.region(list(mrc.shape), mesh.axis_labels, grid, f"the mesh {mesh_name}")
+                task = self.make_task(None, mesh_name, mrc_name, mrc.dtype, roi, roi, scalings,
+                                      operator, encoding)
+                task.input_data = np.empty(task.input_extent, dtype=task.dtype)
+                load_task(mrc, task)
+                tasks[mesh_name].append(task)
+            flush = mesh.series_flush
+        if flush is not None:
+            flush()
+        self.reduce_tasks([task for mesh_tasks in tasks.values() for task in mesh_tasks],
+                          component_threads=component_threads)
+        results = {}
+        for mesh_name, mesh in meshes.items():
+            mesh_tasks = tasks[mesh_name]
+            grid = mesh_grid(mesh)
+            scalings = mesh_tasks[0].scalings if mesh_tasks else None
+            encoding = mesh_tasks[0].encoding if mesh_tasks else None
+            operator = mesh_tasks[0].operator if mesh_tasks else None
+            roi_offset = mesh_tasks[0].local_chunk.offset if mesh_tasks else []
+            results[mesh_name] = ReducedMesh(
+                mesh_name,
+                [{task.mrc_name: task.output_data[ll] for task in mesh_tasks}
+                 for ll in range(len(self.levels))],
+                [grid[1] for _ in self.levels] if scalings is None else
+                [binned_spacing(grid[1], scaling) for scaling in scalings],
+                region_origin(grid, roi_offset) or grid[0],
+                None if operator is None else operator.name, encoding,
+                {task.mrc_name: encoded_unit_si(mesh[task.mrc_name].unit_SI, encoding)
+                 for task in mesh_tasks},
+                {(ll, task.mrc_name): errors for task in mesh_tasks
+                 for ll, errors in enumerate(task.errors)
+                 if errors is not None})
+        return results
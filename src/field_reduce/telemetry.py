@@ -0,0 +1,211 @@
+import csv
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# stages timed by OutputReducer: wait_step waiting for the next iteration (step) of the input series
+# load load_chunk and input_series.flush(), a mesh whose record components are loaded together is
+# one event close_input closing the input iteration reduce the reduction kernels store store_chunk
+# on the output series flush_output flushing the output series (pipelined and streaming mode only)
+# close_output closing the output iteration, which writes whatever is not flushed yet
+STAGES = ("wait_step", "load", "close_input", "reduce", "store", "flush_output", "close_output")
+# summaries add "write", the sum of the three output stages, whose bytes are the bytes written
+WRITE_STAGES = ("store", "flush_output", "close_output")
+
+# all records have these fields, those that do not apply to a record are None
+FIELDS = ("type", "rank", "iteration", "mesh", "record_component", "stage", "seconds", "bytes",
+          "bandwidth_MBps", "peak_rss_MB", "min_s", "mean_s", "max_s", "slowest_rank")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """ Peak resident memory of this process in MB, None without the resource module """
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bandwidth_mbps(nbytes: int, seconds: float) -> Optional[float]:
+    if not nbytes or seconds <= 0.0:
+        return None
+    return nbytes / seconds / 1e6
+
+
+def make_record(record_type: str, **fields) -> dict:
+    record = {field: None for field in FIELDS}
+    record["type"] = record_type
+    record.update(fields)
+    return record
+
+
+class JsonLinesSink:
+    """ Hook writing every record as a line of JSON, leaving out fields that do not apply """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'w')
+
+    def __call__(self, record: dict) -> None:
+        self._file.write(json.dumps({key: value
+                                     for key, value in record.items() if value is not None}) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class CsvSink:
+    """ Hook writing every record as a row of a CSV file with the columns FIELDS """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=FIELDS)
+        self._writer.writeheader()
+
+    def __call__(self, record: dict) -> None:
+        self._writer.writerow(record)
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def make_sink(path: str, rank: int = 0, size: int = 1):
+    """ CSV sink for paths ending in .csv, JSON lines otherwise
+
+    %r in the path is replaced by the rank. If there are several ranks and the path has no %r, the
+    rank is inserted before the extension, so that every rank writes its own file.
+    """
+    if size > 1 and "%r" not in path:
+        stem, ext = os.path.splitext(path)
+        path = f"{stem}.%r{ext}"
+    path = path.replace("%r", str(rank))
+    if path.endswith(".csv"):
+        return CsvSink(path)
+    return JsonLinesSink(path)
+
+
+class Telemetry:
+    """ Collects time and bytes of every stage per iteration, mesh and record component on a rank.
+
+    Every measurement is passed as a record (a dict with the keys FIELDS) to the hooks, see
+    add_hook. At the end of an iteration per stage totals follow (type 'iteration') and at the end
+    of the run, aggregated over all ranks, the per stage minimum, mean and maximum time and the
+    slowest rank (type 'run', on rank 0 only). Stages may be recorded from several threads.
+    """
+
+    def __init__(self, rank: int = 0):
+        self.rank = rank
+        self.hooks: list = []
+        self._lock = threading.Lock()
+        self._iterations: dict[int, dict] = {}
+        self.totals = self._empty_totals()
+
+    @staticmethod
+    def _empty_totals() -> dict:
+        return {stage: [0.0, 0] for stage in STAGES}
+
+    def add_hook(self, hook: Callable[[dict], None]) -> None:
+        """ Calls hook(record) for every record from now on, e.g. to feed a monitoring system """
+        self.hooks.append(hook)
+
+    def close(self) -> None:
+        """ Closes all hooks that have a close method (e.g. file sinks) """
+        for hook in self.hooks:
+            close = getattr(hook, "close", None)
+            if close is not None:
+                close()
+
+    def _emit(self, record: dict) -> None:
+        for hook in self.hooks:
+            hook(record)
+
+    @contextmanager
+    def time(self, stage: str, iteration: int, mesh: Optional[str] = None,
+             record_component: Optional[str] = None, nbytes: int = 0):
+        """ Times the enclosed block as one event of a stage """
+        start = time.perf_counter()
+        yield
+        self.record(stage, time.perf_counter() - start, iteration, mesh, record_component, nbytes)
+
+    def record(self, stage: str, seconds: float, iteration: int, mesh: Optional[str] = None,
+               record_component: Optional[str] = None, nbytes: int = 0) -> None:
+        with self._lock:
+            for totals in (self._iterations.setdefault(iteration, self._empty_totals()),
+                           self.totals):
+                totals[stage][0] += seconds
+                totals[stage][1] += nbytes
+            if self.hooks:
+                self._emit(make_record("stage", rank=self.rank, iteration=iteration, mesh=mesh,
+                                       record_component=record_component, stage=stage,
+                                       seconds=seconds, bytes=nbytes,
+                                       bandwidth_MBps=bandwidth_mbps(nbytes, seconds)))
+
+    @staticmethod
+    def _with_write(totals: dict) -> dict:
+        totals = dict(totals)
+        totals["write"] = [sum(totals[stage][0] for stage in WRITE_STAGES), totals["store"][1]]
+        return totals
+
+    def end_iteration(self, iteration: int) -> None:
+        """ Emits the per stage totals of an iteration """
+        with self._lock:
+            totals = self._with_write(self._iterations.pop(iteration, self._empty_totals()))
+            rss = peak_rss_mb()
+            for stage, (seconds, nbytes) in totals.items():
+                self._emit(make_record("iteration", rank=self.rank, iteration=iteration,
+                                       stage=stage, seconds=seconds, bytes=nbytes,
+                                       bandwidth_MBps=bandwidth_mbps(nbytes, seconds),
+                                       peak_rss_MB=rss))
+
+    def aggregate(self, comm, wall: float) -> list:
+        """ Aggregates the totals of the run over all ranks, a collective call
+
+        :param comm: mpi communicator (or a serial stand-in with size 1)
+        :param wall: wall time of the run on this rank
+        :return: the 'run' records on rank 0, an empty list on the others
+        """
+        with self._lock:
+            totals = self._with_write(self.totals)
+        totals["wall"] = [wall, 0]
+        local = (totals, peak_rss_mb())
+        gathered = comm.gather(local, root=0) if comm.size > 1 else [local]
+        if comm.rank != 0:
+            return []
+        records = []
+        rss = [rank_rss for _, rank_rss in gathered if rank_rss is not None]
+        for stage in totals:
+            seconds = [rank_totals[stage][0] for rank_totals, _ in gathered]
+            nbytes = sum(rank_totals[stage][1] for rank_totals, _ in gathered)
+            slowest = max(range(len(seconds)), key=lambda rr: seconds[rr])
+            record = make_record("run", stage=stage, seconds=seconds[slowest], bytes=nbytes,
+                                 bandwidth_MBps=bandwidth_mbps(nbytes, seconds[slowest]),
+                                 peak_rss_MB=max(rss) if rss else None, min_s=min(seconds),
+                                 mean_s=sum(seconds) / len(seconds), max_s=seconds[slowest],
+                                 slowest_rank=slowest)
+            records.append(record)
+            with self._lock:
+                self._emit(record)
+        return records
+
+
+def summary(records: list) -> str:
+    """ Human readable table of the 'run' records returned by Telemetry.aggregate """
+    lines = [f"{'stage':>12} {'min [s]':>9} {'mean [s]':>9} {'max [s]':>9} {'slowest':>7} "
+             f"{'bytes':>14} {'MB/s':>9}"]
+    for record in records:
+        bandwidth = record["bandwidth_MBps"]
+        lines.append(f"{record['stage']:>12} {record['min_s']:>9.3f} {record['mean_s']:>9.3f} "
+                     f"{record['max_s']:>9.3f} {record['slowest_rank']:>7} {record['bytes']:>14} "
+                     f"{'-' if bandwidth is None else f'{bandwidth:.1f}':>9}")
+    if records and records[0]["peak_rss_MB"] is not None:
+        lines.append(f"peak RSS of the largest rank: {records[0]['peak_rss_MB']:.1f} MB")
+    return "\n".join(lines)
@@ -1,6 +1,15 @@
+import argparse
+import subprocess
+import sys
+import threading
+
 import numpy as np
 import pytest
-import downscale_kernel
+from field_reduce import (arguments, backpressure, buffers, downscale_kernel, particles, pipeline,
+                          reduction, telemetry)
+from field_reduce.decomposition import Chunk, rank_grid, assign_blocks, schedule_largest_first
+from field_reduce.checkpoint import (write_checkpoint, append_checkpoint, load_checkpoint,
+                                     output_files)
 
 
 def test_1d_even():
@@ -8,7 +17,8 @@ def test_1d_even():
     bin_size = 2
     large = np.random.random(size)
     output = np.empty(126 // bin_size)
-    downscale_kernel._downscale_1d(large, output)
+    downscale_kernel._downscale_1d(large, output,
+                                   downscale_kernel.make_scratch(output.shape, large.dtype))
     reference = (large[::2] + large[1::2]) / 2
     assert np.all(np.isclose(reference, output))
 
@@ -18,7 +28,8 @@ def test_1d_odd():
     bin_size = 3
     large = np.random.random(size)
     output = np.empty(126 // bin_size)
-    downscale_kernel._downscale_1d(large, output)
+    downscale_kernel._downscale_1d(large, output,
+                                   downscale_kernel.make_scratch(output.shape, large.dtype))
     reference = (large[::3] + large[1::3] + large[2::3]) / 3
     assert np.all(np.isclose(reference, output))
 
@@ -28,20 +39,24 @@ def test_2d():
     bin_size = (3, 2)
     large = np.random.random(size=shape[0] * shape[1]).reshape(shape)
 
-    reference_0 = (large[0::bin_size[0], :] + large[1::bin_size[0], :] + large[2::bin_size[0], :])
+    reference_0 = (large[0::bin_size[0], :] + large[1::bin_size[0], :] +
+                   large[2::bin_size[0], :]) / 3
     output_0 = np.empty((shape[0] // bin_size[0], shape[1]))
-    downscale_kernel._reduce_2d_0(large, output_0)
+    downscale_kernel._downscale_2d(large, output_0,
+                                   downscale_kernel.make_scratch(output_0.shape, large.dtype))
     assert np.all(np.isclose(output_0, reference_0))
 
-    reference_1 = (large[:, 0::bin_size[1]] + large[:, 1::bin_size[1]])
+    reference_1 = (large[:, 0::bin_size[1]] + large[:, 1::bin_size[1]]) / 2
     output_1 = np.empty((shape[0], shape[1] // bin_size[1]))
-    downscale_kernel._reduce_2d_1(large, output_1)
+    downscale_kernel._downscale_2d(large, output_1,
+                                   downscale_kernel.make_scratch(output_1.shape, large.dtype))
     assert np.all(np.isclose(output_1, reference_1))
 
     reference = (large[::3, ::2] + large[1::3, ::2] + large[2::3, ::2]
                  + large[::3, 1::2] + large[1::3, 1::2] + large[2::3, 1::2]) / 6
     output = np.empty((shape[0] // bin_size[0], shape[1] // bin_size[1]))
-    downscale_kernel._downscale_2d(large, output)
+    downscale_kernel._downscale_2d(large, output,
+                                   downscale_kernel.make_scratch(output.shape, large.dtype))
     assert np.all(np.isclose(reference, output))
 
 
@@ -55,5 +70,658 @@ def test_3d():
                  + large[1::2, ::3, 1::2] + large[1::2, 1::3, 1::2] + large[1::2, 2::3, 1::2]
                  + large[::2, ::3, 1::2] + large[::2, 1::3, 1::2] + large[::2, 2::3, 1::2]) / 12
     output = np.empty((shape[0] // bin_size[0], shape[1] // bin_size[1], shape[2] // bin_size[2]))
-    downscale_kernel._downscale_3d(large, output)
+    downscale_kernel._downscale_3d(large, output,
+                                   downscale_kernel.make_scratch(output.shape, large.dtype))
     assert np.all(np.isclose(reference, output))
+
+
+@pytest.mark.parametrize("precision", ["native", "float64"])
+def test_float32_stays_float32(precision):
+    shape = (40, 30, 20)
+    large = np.random.random(shape).astype(np.float32)
+    output = np.empty((20, 10, 5), dtype=np.float32)
+    scratch = downscale_kernel.make_scratch(output.shape, large.dtype, precision)
+    assert scratch.dtype == (np.float32 if precision == "native" else np.float64)
+    assert scratch.shape == (20, 5)
+    downscale_kernel.downscale(large, output, scratch)
+    reference = large.astype(np.float64).reshape(20, 2, 10, 3, 5, 4).mean(axis=(1, 3, 5))
+    assert np.allclose(output, reference, rtol=1e-5)
+    # without scratch a buffer in the input precision is allocated
+    output_default = np.empty_like(output)
+    downscale_kernel.downscale(large, output_default)
+    assert np.allclose(output_default, reference, rtol=1e-5)
+
+
+@pytest.mark.parametrize("ndim", [1, 2, 3])
+def test_reduction_operators(ndim):
+    bins = (2, 3, 4)[:ndim]
+    out_shape = (5, 4, 3)[:ndim]
+    large = np.random.random([oo * bb for oo, bb in zip(out_shape, bins)])
+    blocks = large.reshape([vv for pair in zip(out_shape, bins) for vv in pair])
+    bin_axes = tuple(range(1, 2 * ndim, 2))
+    references = {
+        "mean": blocks.mean(axis=bin_axes),
+        "sum": blocks.sum(axis=bin_axes),
+        "min": blocks.min(axis=bin_axes),
+        "max": blocks.max(axis=bin_axes),
+        "rms": np.sqrt((blocks ** 2).mean(axis=bin_axes)),
+        "decimate": large[tuple(slice(None, None, bb) for bb in bins)],
+    }
+    for name, reference in references.items():
+        output = np.empty(out_shape)
+        downscale_kernel.get_operator(name)(large, output)
+        assert np.allclose(output, reference), name
+    # a strided reader hands decimate only every bin-th plane along the first axis
+    output = np.empty(out_shape)
+    downscale_kernel.get_operator("decimate")(np.ascontiguousarray(large[::bins[0]]), output)
+    assert np.allclose(output, references["decimate"])
+
+
+def test_unknown_operator():
+    with pytest.raises(ValueError):
+        downscale_kernel.get_operator("median")
+
+
+@pytest.mark.parametrize("ndim", [1, 2, 3])
+def test_partial_bins(ndim):
+    bins = (4, 3, 5)[:ndim]
+    shape = (13, 7, 11)[:ndim]
+    large = np.random.random(shape)
+    partial_shape = [-(-nn // bb) for nn, bb in zip(shape, bins)]
+    # reference: each output cell reduces the cells of its bin that exist
+    references = {name: np.empty(partial_shape)
+                  for name in ("mean", "sum", "min", "max", "rms", "decimate")}
+    for index in np.ndindex(*partial_shape):
+        cells = large[tuple(slice(ii * bb, (ii + 1) * bb) for ii, bb in zip(index, bins))]
+        references["mean"][index] = cells.mean()
+        references["sum"][index] = cells.sum()
+        references["min"][index] = cells.min()
+        references["max"][index] = cells.max()
+        references["rms"][index] = np.sqrt((cells ** 2).mean())
+        references["decimate"][index] = cells.flat[0]
+    drop_shape = [nn // bb for nn, bb in zip(shape, bins)]
+    for name, reference in references.items():
+        output = np.empty(partial_shape)
+        downscale_kernel.get_operator(name)(large, output, bins=bins)
+        assert np.allclose(output, reference), name
+        output = np.empty(drop_shape)
+        downscale_kernel.get_operator(name)(large, output, bins=bins)
+        assert np.allclose(output, reference[tuple(slice(0, nn) for nn in drop_shape)]), name
+    with pytest.raises(ValueError):
+        downscale_kernel.get_operator("mean")(large, np.empty([nn + 1 for nn in partial_shape]),
+                                              bins=bins)
+
+
+@pytest.mark.parametrize("ndim", [1, 2, 3])
+def test_output_encoding(ndim):
+    bins = (2, 3, 4)[:ndim]
+    out_shape = (5, 4, 3)[:ndim]
+    large = np.random.random([oo * bb for oo, bb in zip(out_shape, bins)]) * 4 - 2
+    for name in ("mean", "max", "decimate"):
+        reference = np.empty(out_shape)
+        operator = downscale_kernel.get_operator(name)
+        operator(large, reference)
+        # downcast
+        output = np.empty(out_shape, dtype=np.float32)
+        absolute, relative = operator(large, output,
+                                      encoding=downscale_kernel.get_encoding("float32"))
+        assert np.all(output == reference.astype(np.float32)), name
+        assert absolute == pytest.approx(np.abs(output - reference).max())
+        assert 0 < relative < 1e-7
+        # quantisation, 1.0 is stored as 0 and the values below 1.0 - 128.5 * 0.02 are clipped
+        encoding = downscale_kernel.get_encoding("int8:0.01:1.0")
+        output = np.empty(out_shape, dtype=np.int8)
+        absolute, relative = operator(large, output, encoding=encoding)
+        decoded = output * encoding.step + encoding.offset
+        valid = reference >= 1.0 - 128.5 * 0.02
+        assert np.abs(decoded - reference)[valid].max(initial=0.0) <= 0.01 + 1e-12, name
+        assert np.all(output[~valid] == -128)
+        assert absolute == pytest.approx(np.abs(decoded - reference).max())
+        assert relative == pytest.approx((np.abs(decoded - reference) / np.abs(reference)).max())
+        assert encoding.clipped(absolute) == bool(np.any(~valid)), name
+    with pytest.raises(ValueError):
+        downscale_kernel.get_operator("mean")(large, np.empty(out_shape, dtype=np.float32),
+                                              encoding=downscale_kernel.get_encoding("int16:1e-3"))
+
+
+def test_warm_up_compiles_kernels():
+    operator = downscale_kernel.get_operator('decimate')
+    downscale_kernel.warm_up(['decimate'], dtypes=[np.float32], ndims=[2])
+    downscale_kernel.COMPILER.join()
+    assert operator.argument_types(2, np.float32) in operator.kernels[2].overloads
+    large = np.random.random((6, 8)).astype(np.float32)
+    output = np.empty((3, 4), dtype=np.float32)
+    operator(large, output, bins=(2, 2))
+    assert np.array_equal(output, large[::2, ::2])
+
+
+@pytest.mark.skipif(downscale_kernel._aot_kernels is None, reason="ahead-of-time kernels not built")
+@pytest.mark.parametrize("name", ["mean", "rms", "decimate"])
+def test_aot_kernels_match(name):
+    operator = downscale_kernel.get_operator(name)
+    large = np.random.random((9, 8, 7)).astype(np.float32)
+    output = np.empty((5, 4, 4), dtype=np.float32)
+    scratch = downscale_kernel.make_scratch(output.shape, large.dtype,
+                                            'float64') if operator.needs_scratch else None
+    aot_kernel = getattr(downscale_kernel._aot_kernels,
+                         downscale_kernel.aot_kernel_name(name, 3, large.dtype,
+                                                          getattr(scratch, 'dtype', None)))
+    aot_kernel(large, output, *([] if scratch is None else [scratch]), np.array([2, 2, 2]))
+    reference = np.empty_like(output)
+    operator.kernels[3](large, reference, scratch, (2, 2, 2), None, None)
+    assert np.allclose(output, reference, rtol=1e-6)
+
+
+def test_help_does_not_load_numba():
+    code = ("import sys\nfrom field_reduce import main\nsys.argv = ['field-reduce', "
+            "'--help']\ntry:\n    main()\nexcept SystemExit:\n    pass\nprint([name for name in "
+            "('numba', 'openpmd_api') if name in sys.modules])\nimport "
+            "field_reduce.output_reducer\nfrom field_reduce import OutputReducer, "
+            "Reduction\nprint(isinstance(OutputReducer, type), isinstance(Reduction, type))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True)
+    # the classes are exported, not the modules they are defined in
+    assert result.stdout.splitlines()[-2:] == ["[]", "True True"]
+    assert arguments.OPERATOR_NAMES == tuple(downscale_kernel.REDUCTION_OPERATORS)
+
+
+def test_reduction_in_memory():
+    reducer = reduction.Reduction(2, 2, 1, pyramid=[(4, 4, 2)], roi={'x': (2, 18)},
+                                  operators={'rho': 'sum'}, exclude=['B'])
+    arrays = [np.random.random((20, 8)), np.random.random((20, 12)).astype(np.float32)]
+    batch = reducer.reduce_arrays(arrays, ['x', 'y'], mesh_name='rho')
+    for data, (binned, binned_more) in zip(arrays, batch):
+        region = data[2:18]
+        assert binned.dtype == data.dtype and binned.shape == (8, data.shape[1] // 2)
+        assert np.allclose(binned, region.reshape(8, 2, -1, 2).sum(axis=(1, 3)), rtol=1e-5)
+        assert np.allclose(binned_more, region.reshape(4, 4, -1, 4).sum(axis=(1, 3)), rtol=1e-5)
+    # meshes that are not reduced are passed on without a copy, cut to the region of interest
+    copied = reducer.reduce_array(arrays[0], ['x', 'y'], mesh_name='B')
+    assert len(copied) == 2 and np.shares_memory(copied[0],
+                                                 arrays[0]) and copied[0].shape == (16, 8)
+    grid = ([1.0, 0.0], [0.5, 2.0], 1.0)
+    assert reduction.region_origin(grid, [2, 0]) == [2.0, 0.0]
+    assert reduction.binned_spacing(grid[1], reducer.scalings(['x', 'y'])[1]) == [2.0, 8.0]
+    with pytest.raises(ValueError):
+        reduction.Reduction(2, 2, 2, roi={'x': (0.1, 0.2)},
+                            roi_units='si').reduce_array(arrays[0], ['x', 'y'])
+    with pytest.raises(ValueError):
+        reduction.Reduction(2, 2, 2, pyramid=[(3, 3, 3)])
+
+
+def test_output_encoding_specs():
+    assert downscale_kernel.get_encoding("native") is None
+    assert downscale_kernel.get_encoding("int16:0.001").step == 0.002
+    assert downscale_kernel.get_encoding("float32").parameters() == (1.0, 0.0, 1.0, -np.inf, np.inf)
+    for spec in ("int16", "float32:0.1", "float16", "int16:1:2:3", "bool", "complex"):
+        with pytest.raises(ValueError):
+            downscale_kernel.get_encoding(spec)
+        # rejected when parsing the command line already
+        with pytest.raises(argparse.ArgumentTypeError):
+            arguments.parse_output_dtype("E=" + spec)
+    assert arguments.parse_output_dtype("E=int16:1e-3") == ("E", "int16:1e-3")
+    assert arguments.parse_output_dtype("float32") == (None, "float32")
+    encoding = downscale_kernel.get_encoding("int8:0.01:1.0")
+    assert encoding.value_range() == pytest.approx((1.0 - 128.5 * 0.02, 1.0 + 127.5 * 0.02))
+    assert not encoding.clipped(0.01) and encoding.clipped(0.02)
+    assert not downscale_kernel.get_encoding("float32").clipped(1.0)
+
+
+def test_pipeline_keeps_order():
+    times = pipeline.StageTimes()
+    written = []
+    pipe = pipeline.Pipeline(lambda item: isinstance(item, list),
+                             lambda item: item.append("reduced"), written.append, times, depth=1,
+                             memory_budget=10)
+    pipe.start()
+    items = [["a"], "b", ["c"], "d"]
+    for item in items:
+        pipe.acquire(4)
+        pipe.submit(item)
+        pipe.budget.release(4)
+    pipe.close()
+    assert written == [["a", "reduced"], "b", ["c", "reduced"], "d"]
+    assert pipe.budget.in_use == 0
+    assert pipe.budget.high_water_mark <= 8
+
+
+def test_pipeline_budget_wait_is_not_busy():
+    times = pipeline.StageTimes()
+    pipe = pipeline.Pipeline(lambda item: True, lambda item: None, lambda item: None, times,
+                             depth=1, memory_budget=10)
+    pipe.acquire(8)
+    assert times.budget_wait < 0.1
+    releaser = threading.Timer(0.2, pipe.budget.release, [8])
+    releaser.start()
+    # blocks until the first reservation is released
+    pipe.acquire(8)
+    releaser.join()
+    assert times.budget_wait >= 0.15
+    assert times.busy == {"read": 0.0, "reduce": 0.0, "write": 0.0}
+    assert "waited for memory" in times.summary()
+
+
+def test_component_scheduler_splits_threads():
+    assert pipeline.kernel_width(rows=1000, cells=1 << 30, total_threads=64) == 64
+    assert pipeline.kernel_width(rows=3, cells=1 << 30, total_threads=64) == 3
+    assert pipeline.kernel_width(rows=1000, cells=4 * pipeline.MIN_CELLS_PER_THREAD,
+                                 total_threads=64) == 4
+    assert pipeline.kernel_width(rows=1000, cells=10, total_threads=64) == 1
+    running = [0]
+    peak = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(4, timeout=10)
+
+    def reduce(item):
+        with lock:
+            running[0] += 1
+            peak.append(running[0])
+        if item["width"] == 2:
+            # the four small items only get past this if they run at the same time
+            barrier.wait()
+        with lock:
+            running[0] -= 1
+        item["reduced"] = True
+
+    times = pipeline.StageTimes()
+    scheduler = pipeline.ComponentScheduler(reduce, lambda item: item["width"],
+                                            lambda threads: None, 8, times=times)
+    items = [{"width": 8}] + [{"width": 2} for _ in range(4)] + [{"width": 100}]
+    futures = [scheduler.submit(item) for item in items]
+    for future in futures:
+        future.result()
+    scheduler.close()
+    assert all(item["reduced"] for item in items)
+    assert max(peak) == 4
+    assert scheduler.budget.in_use == 0
+    assert [scheduler.threads_for(item) for item in items] == [8, 2, 2, 2, 2, 8]
+    fixed = pipeline.ComponentScheduler(reduce, None, None, 8, component_threads=2)
+    assert fixed.threads_for(items[0]) == 4
+    fixed.close()
+
+
+def test_pipeline_reraises_worker_errors():
+    def fail(item):
+        raise ValueError("broken")
+
+    pipe = pipeline.Pipeline(lambda item: True, fail, lambda item: None, pipeline.StageTimes(),
+                             depth=1)
+    pipe.start()
+    with pytest.raises(RuntimeError):
+        for ii in range(100):
+            pipe.submit(ii)
+        pipe.close()
+
+
+def test_telemetry_records_and_aggregates(tmp_path):
+    class SerialComm:
+        rank = 0
+        size = 1
+
+    records = []
+    recorder = telemetry.Telemetry()
+    recorder.add_hook(records.append)
+    recorder.add_hook(telemetry.make_sink(str(tmp_path / "telemetry.csv")))
+    with recorder.time("load", 100, "E", "x", nbytes=2000):
+        pass
+    recorder.record("reduce", 0.5, 100, "E", "x", 2000)
+    recorder.record("store", 0.25, 100, "E", "x", 250)
+    recorder.record("close_output", 0.25, 100)
+    recorder.end_iteration(100)
+    run = {record["stage"]: record for record in recorder.aggregate(SerialComm(), wall=2.0)}
+    recorder.close()
+    assert [record["type"] for record in records[:4]] == ["stage"] * 4
+    iteration = {record["stage"]: record for record in records if record["type"] == "iteration"}
+    assert iteration["reduce"]["seconds"] == 0.5 and iteration["load"]["bytes"] == 2000
+    assert iteration["write"]["seconds"] == 0.5 and iteration["write"]["bytes"] == 250
+    assert run["write"]["bandwidth_MBps"] == 250 / 0.5 / 1e6
+    assert run["wall"]["max_s"] == 2.0 and run["wall"]["slowest_rank"] == 0
+    assert (tmp_path / "telemetry.csv").read_text().count("\n") == 1 + len(records)
+    assert "reduce" in telemetry.summary(list(run.values()))
+
+
+def test_chunk_split_into_slabs():
+    chunk = Chunk([6, 0], [14, 5])
+    slabs = chunk.split(4)
+    assert [slab.offset for slab in slabs] == [[6, 0], [10, 0], [14, 0], [18, 0]]
+    assert [slab.extent for slab in slabs] == [[4, 5], [4, 5], [4, 5], [2, 5]]
+    reduced = slabs[1].downscaled([2, 5])
+    assert reduced.offset == [5, 0] and reduced.extent == [2, 1]
+
+
+@pytest.mark.parametrize("shape, divisible", [([256, 256, 256], [2, 2, 2]),
+                                              ([24, 1024, 1024], [4, 2, 2]),
+                                              ([2051, 67, 10], [3, 2, 1]), ([640, 480], [2, 2])])
+def test_block_decomposition_scaling(shape, divisible):
+    global_chunk = Chunk([0 for _ in shape], shape)
+    bins = [ee // dd for ee, dd in zip(shape, divisible)]
+    output_cells = int(np.prod(bins))
+    for mpi_size in list(range(1, 65)) + [96, 100, 128, 250, 256, 300, 512, 1000]:
+        blocks = [global_chunk.slice_blocks(rank, mpi_size, divisible) for rank in range(mpi_size)]
+        covered = np.zeros(bins, dtype=np.int32)
+        for block in blocks:
+            # bin aligned, so the output chunk is exact
+            assert all(oo % dd == 0 and ee % dd == 0
+                       for oo, ee, dd in zip(block.offset, block.extent, divisible))
+            reduced = block.downscaled(divisible)
+            covered[tuple(slice(oo, oo + ee)
+                          for oo, ee in zip(reduced.offset, reduced.extent))] += 1
+        # every output cell is computed by exactly one rank
+        assert np.all(covered == 1)
+        largest = max(int(np.prod(block.downscaled(divisible).extent)) for block in blocks)
+        if mpi_size <= output_cells:
+            # the largest block is close to the ideal share whenever the rank count factorizes
+            # reasonably
+            grid = rank_grid(mpi_size, bins)
+            assert largest == int(np.prod([-(-bb // gg) for bb, gg in zip(bins, grid)]))
+            slab_largest = -(-bins[0] // mpi_size) * output_cells // bins[0]
+            assert largest <= slab_largest
+        if mpi_size in (8, 64, 512) and len(shape) == 3 and shape[0] == shape[1]:
+            assert largest * mpi_size == output_cells
+
+
+def test_written_blocks_bin_aligned():
+    # blocks written along the first axis at 0, 5, 10, 14, 21 of 24 cells, bins of 4 cells (6 bins)
+    blocks = [Chunk([o, 0], [e, 3]) for o, e in [(0, 5), (5, 5), (10, 4), (14, 7), (21, 3)]]
+    aligned = [block.bin_aligned([4, 1], [24, 3]) for block in blocks]
+    assert [(block.offset[0], block.extent[0])
+            for block in aligned] == [(0, 8), (8, 4), (12, 4), (16, 8), (24, 0)]
+
+
+def test_assign_written_blocks():
+    # 4 reader ranks on 2 hosts, 8 writers on the same 2 hosts
+    reader_hosts = ["a", "a", "b", "b"]
+    writer_hosts = {source_id: "a" if source_id < 4 else "b" for source_id in range(8)}
+    nbytes = [100, 100, 100, 100, 100, 100, 100, 100]
+    assignment = assign_blocks(nbytes, list(range(8)), reader_hosts, writer_hosts)
+    assert sorted(bb for blocks in assignment for bb in blocks) == list(range(8))
+    for rank, blocks in enumerate(assignment):
+        assert len(blocks) == 2
+        assert all(writer_hosts[bb] == reader_hosts[rank] for bb in blocks)
+    # a host without readers, its blocks go to the least loaded ranks
+    writer_hosts = {source_id: "c" if source_id >= 6 else writer_hosts[source_id]
+                    for source_id in range(8)}
+    assignment = assign_blocks(nbytes, list(range(8)), reader_hosts, writer_hosts)
+    assert sorted(len(blocks) for blocks in assignment) == [2, 2, 2, 2]
+    # unbalanced block sizes without a rank table are balanced by bytes
+    nbytes = [400, 100, 100, 100, 100, 300, 200, 200]
+    loads = [sum(nbytes[bb] for bb in blocks)
+             for blocks in assign_blocks(nbytes, list(range(8)), reader_hosts)]
+    assert max(loads) == 400
+
+
+def test_schedule_iterations_largest_first():
+    sizes = {0: 10, 100: 80, 200: 30, 300: 30, 400: 20, 500: 50}
+    schedule = schedule_largest_first(sizes, 3)
+    assert schedule == [[100], [500, 400], [200, 300, 0]]
+    assert schedule_largest_first({0: 1}, 3) == [[0], [], []]
+
+
+def test_backpressure_degrades_steps_while_behind():
+    monitor = backpressure.Backpressure('skip', margin=0.1, every=2)
+    # the first step sets everything up and is not counted, steps that are ready right away mean
+    # falling behind
+    decisions = []
+    for wait, busy in [(0.0, 5.0), (0.0, 1.0), (0.0, 1.0), (0.0, 1.0), (0.0, 1.0), (0.0, 1.0)]:
+        decisions.append(monitor.begin_step(wait))
+        monitor.end_step(0.0 if decisions[-1] == 'skip' else busy)
+    assert decisions == [None, None, None, 'skip', None, 'skip']
+    assert monitor.degraded == 2
+    # a writer that is slower again lets the reader wait, steps are processed fully
+    assert monitor.begin_step(2.0) is None
+    coarsen = backpressure.Backpressure('coarsen', margin=0.5)
+    coarsen.end_step(1.0)
+    coarsen.end_step(1.0)
+    assert coarsen.begin_step(0.1) == 'coarsen'
+    with pytest.raises(ValueError):
+        backpressure.Backpressure('meshes')
+    with pytest.raises(ValueError):
+        backpressure.Backpressure('drop')
+
+
+def test_buffer_pool_reuses_buffers():
+    pool = buffers.BufferPool(large_buffers='mmap', large_buffer_size=1024)
+    small = pool.acquire((4, 4), np.float32)
+    large = pool.acquire((16, 16), np.float64)
+    assert large.shape == (16, 16) and large.dtype == np.float64
+    # foreign buffers, None and buffers given back twice are ignored
+    pool.release(small, large, large, None, np.empty(3))
+    assert pool.acquire((4, 4), np.float32) is small
+    assert pool.acquire((4, 4), np.float64) is not small
+    assert (pool.allocated, pool.reused) == (3, 1)
+    # idle buffers that were not handed out since the previous trim are freed
+    pool.release(small)
+    pool.trim()
+    assert pool.idle_bytes == small.nbytes + large.nbytes
+    assert pool.acquire((4, 4), np.float32) is small
+    pool.trim()
+    assert pool.idle_bytes == 0
+    unpooled = buffers.BufferPool(reuse=False)
+    buffer = unpooled.acquire((2,), np.float32)
+    unpooled.release(buffer)
+    assert unpooled.acquire((2,), np.float32) is not buffer
+    with pytest.raises(ValueError):
+        buffers.BufferPool(large_buffers='shm')
+
+
+def test_checkpoint_lists_completed_iterations(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    write_checkpoint(path, [200, 0])
+    append_checkpoint(path, 300)
+    assert load_checkpoint(path, None, -1) == ({0, 200, 300}, -1)
+    # an explicit first iteration overrides the checkpoint
+    assert load_checkpoint(path, None, 100) == (set(), 100)
+    # an output that is not file based is created anew, without the completed iterations
+    output_paths = [str(tmp_path / "data_%T.h5"), str(tmp_path / "coarse.h5")]
+    assert load_checkpoint(path, None, -1, output_paths=output_paths) == (set(), -1)
+    assert load_checkpoint(path, None, -1) == (set(), -1)
+
+
+def test_checkpoint_verifies_output_files(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    pattern = str(tmp_path / "data_%06T.h5")
+    for idx in (0, 100):
+        with open(str(tmp_path / f"data_{idx:06d}.h5"), 'wb') as f:
+            f.write(bytes(range(idx, idx + 50)))
+    assert output_files(pattern, 100) == [str(tmp_path / "data_000100.h5")]
+    assert output_files(pattern, 200) == []
+    write_checkpoint(path, [])
+    for idx in (0, 100):
+        append_checkpoint(path, idx, output_files(pattern, idx))
+    # a torn line from an append that was interrupted is ignored
+    with open(path, 'a') as f:
+        f.write('{"files": [], "iteration": 2')
+    assert load_checkpoint(path, None, -1, 'checksum') == ({0, 100}, -1)
+    # same size, different content
+    with open(str(tmp_path / "data_000100.h5"), 'r+b') as f:
+        f.write(b"x")
+    assert load_checkpoint(path, None, -1, 'size') == ({0, 100}, -1)
+    assert load_checkpoint(path, None, -1, 'checksum') == ({0}, -1)
+    # the checkpoint was repaired, the changed iteration is not listed any more
+    assert load_checkpoint(path, None, -1, 'none') == ({0}, -1)
+    with open(str(tmp_path / "data_000000.h5"), 'ab') as f:
+        f.write(b"x")
+    assert load_checkpoint(path, None, -1, 'size') == (set(), -1)
+
+
+def test_block_decomposition_partial_bins():
+    shape, divisible = [103, 30, 17], [4, 4, 3]
+    global_chunk = Chunk([0, 0, 0], shape)
+    for mpi_size in (1, 5, 12, 64, 200):
+        covered = np.zeros(shape, dtype=np.int32)
+        reduced_cells = 0
+        for rank in range(mpi_size):
+            block = global_chunk.slice_blocks(rank, mpi_size, divisible, partial=True)
+            covered[tuple(slice(oo, oo + ee) for oo, ee in zip(block.offset, block.extent))] += 1
+            reduced_cells += int(np.prod(block.downscaled(divisible, partial=True).extent))
+        # all cells, including the trailing partial bins, are read by exactly one rank
+        assert np.all(covered == 1)
+        assert reduced_cells == 26 * 8 * 6
+
+
+def test_region_of_interest_decomposition():
+    shape, roi, divisible = [40, 30, 20], Chunk([5, 3, 0], [27, 20, 20]), [4, 3, 2]
+    assert Chunk([0, 0, 0],
+                 shape).intersection(Chunk([35, -2, 5], [10, 10, 10])).extent == [5, 8, 10]
+    assert Chunk([0, 0], [4, 4]).intersection(Chunk([5, 0], [2, 2])).extent == [0, 2]
+    for mpi_size in (1, 3, 8):
+        covered = np.zeros(shape, dtype=np.int32)
+        for rank in range(mpi_size):
+            block = roi.slice_blocks(rank, mpi_size, divisible, partial=True)
+            # blocks start at whole bins counted from the start of the region
+            assert all((oo - rr) % dd == 0
+                       for oo, rr, dd in zip(block.offset, roi.offset, divisible))
+            covered[tuple(slice(oo, oo + ee) for oo, ee in zip(block.offset, block.extent))] += 1
+        inside = tuple(slice(oo, oo + ee) for oo, ee in zip(roi.offset, roi.extent))
+        assert np.all(covered[inside] == 1)
+        assert covered.sum() == np.prod(roi.extent)
+    # a written block cut to the region and aligned to its bins
+    written = Chunk([0, 0, 0], [12, 30, 20]).intersection(roi)
+    aligned = written.shifted([-oo for oo in roi.offset]).bin_aligned(divisible, roi.extent)
+    aligned = aligned.shifted(roi.offset)
+    assert aligned.offset == [5, 3, 0] and aligned.extent == [8, 18, 20]
+
+
+def write_series(api, path, data):
+    """ Creates a series with the mesh rho at iteration 0, returns it and the open iteration """
+    series = api.Series(path, api.Access.create)
+    iteration = series.write_iterations()[0]
+    mesh = iteration.meshes["rho"]
+    mesh.axis_labels = ["x", "y", "z"]
+    mesh.grid_spacing = [1.0, 1.0, 1.0]
+    mesh.grid_global_offset = [0.0, 0.0, 0.0]
+    rho = mesh[api.Mesh_Record_Component.SCALAR]
+    rho.reset_dataset(api.Dataset(data.dtype, data.shape))
+    rho.store_chunk(data)
+    return series, iteration
+
+
+def run_field_reduce(cwd, *args):
+    code = "import sys\nfrom field_reduce import main\nsys.argv = sys.argv[1:]\nmain()"
+    return subprocess.run([sys.executable, "-c", code, "field-reduce"] + list(args), cwd=str(cwd),
+                          capture_output=True, text=True, check=True)
+
+
+@pytest.mark.parametrize("decomposition", ["block", "slab", "chunks"])
+def test_pyramid_covers_first_level(tmp_path, decomposition):
+    api = pytest.importorskip("openpmd_api")
+    # whole bins of the first level along every axis, but not of the coarsest level
+    data = np.random.default_rng(5).random((36, 22, 16))
+    write_series(api, str(tmp_path / "in_%T.h5"), data)[0].close()
+    run_field_reduce(tmp_path, "in_%T.h5", "out_%T.h5", "-x", "2", "--pyramid", "coarse_%T.h5",
+                     "8", "2", "4", "--decomposition", decomposition)
+    for name, factors in (("out_%T.h5", (2, 1, 1)), ("coarse_%T.h5", (8, 2, 4))):
+        series = api.Series(str(tmp_path / name), api.Access.read_only)
+        rho = series.iterations[0].meshes["rho"][api.Mesh_Record_Component.SCALAR]
+        binned = rho.load_chunk()
+        series.flush()
+        bins = [ee // ff for ee, ff in zip(data.shape, factors)]
+        region = data[tuple(slice(0, bb * ff) for bb, ff in zip(bins, factors))]
+        blocks = region.reshape(bins[0], factors[0], bins[1], factors[1], bins[2], factors[2])
+        expected = blocks.mean(axis=(1, 3, 5))
+        assert binned.shape == expected.shape and np.allclose(binned, expected)
+        series.close()
+
+
+def test_restart_into_group_based_output(tmp_path):
+    api = pytest.importorskip("openpmd_api")
+    data = np.random.default_rng(9).random((8, 4, 4))
+    write_series(api, str(tmp_path / "in_%T.h5"), data)[0].close()
+    args = ["in_%T.h5", "out.h5", "-x", "2", "--checkpoint", "checkpoint"]
+    run_field_reduce(tmp_path, *args)
+    # the restarted run creates the output anew, so it must not skip the checkpointed iteration
+    result = run_field_reduce(tmp_path, *args)
+    assert "Not resuming from checkpoint" in result.stdout
+    series = api.Series(str(tmp_path / "out.h5"), api.Access.read_only)
+    assert list(series.iterations) == [0]
+    rho = series.iterations[0].meshes["rho"][api.Mesh_Record_Component.SCALAR]
+    binned = rho.load_chunk()
+    series.flush()
+    assert np.allclose(binned, data.reshape(4, 2, 4, 4).mean(axis=1))
+    series.close()
+
+
+@pytest.mark.parametrize("weighting_dtype", [np.float32, np.uint64])
+def test_subsampled_species(tmp_path, weighting_dtype):
+    api = pytest.importorskip("openpmd_api")
+    rng = np.random.default_rng(7)
+    count, stride = 20, 3
+    series, iteration = write_series(api, str(tmp_path / "in_%T.h5"), rng.random((8, 4, 4)))
+    species = iteration.particles["e"]
+    records = {"position": rng.random(count), "weighting": rng.integers(1, 100, count),
+               "momentum": rng.normal(size=count)}
+    for record_name, values in records.items():
+        values = values.astype(weighting_dtype if record_name == "weighting" else np.float64)
+        name = "x" if record_name != "weighting" else api.Record_Component.SCALAR
+        species[record_name][name].reset_dataset(api.Dataset(values.dtype, [count]))
+        species[record_name][name].store_chunk(values)
+    # the weighting is left without macroWeighted, the momentum is per macroparticle
+    species["momentum"].set_attribute("macroWeighted", np.uint32(1))
+    species["momentum"].set_attribute("weightingPower", 1.0)
+    charge = species["charge"][api.Record_Component.SCALAR]
+    charge.make_constant(-1.5)
+    charge.reset_dataset(api.Dataset(np.dtype("float64"), [count]))
+    series.close()
+    run_field_reduce(tmp_path, "in_%T.h5", "out_%T.h5", "-x", "2", "--particles", "e",
+                     "--particle-quantities", "--particle-stride", str(stride), "--particle-chunk",
+                     "7")
+    series = api.Series(str(tmp_path / "out_%T.h5"), api.Access.read_only)
+    species = series.iterations[0].particles["e"]
+    loaded = {record_name: species[record_name][name].load_chunk()
+              for record_name, name in (("position", "x"),
+                                        ("weighting", api.Record_Component.SCALAR),
+                                        ("momentum", "x"))}
+    series.flush()
+    assert loaded["weighting"].dtype == weighting_dtype
+    assert np.array_equal(loaded["weighting"], records["weighting"][::stride] * stride)
+    assert np.allclose(loaded["momentum"], records["momentum"][::stride] * stride)
+    assert np.allclose(loaded["position"], records["position"][::stride])
+    assert species["charge"][api.Record_Component.SCALAR].get_attribute("value") == -1.5
+    series.close()
+
+
+def test_particle_deposition():
+    rng = np.random.default_rng(3)
+    count = 1000
+    grid = particles.ParticleGrid(["x", "y"], [-1.0, 0.0], [0.5, 0.25], [8, 6])
+    position = rng.random((2, count)) * [[5.0], [2.0]] - [[1.5], [0.25]]
+    weighting = rng.random(count) + 0.5
+    momentum = rng.normal(size=(3, count)) * 1e-22
+    mass = np.full(count, 9.1e-31)
+    charge = np.full(count, -1.6e-19)
+    sums = particles.make_sums(grid)
+    # in two chunks, like the reducer streams them
+    for part in (slice(0, 400), slice(400, count)):
+        particles.deposit(grid, sums, position[:, part], weighting[part], momentum[:, part],
+                          mass[part], charge[part])
+    results = particles.finalize(sums, grid.shape, grid.cell_volume, particles.QUANTITIES)
+
+    cell = np.floor((position - grid.origin[:, None]) / grid.cell_size[:, None]).astype(int)
+    inside = np.all((cell >= 0) & (cell < np.array(grid.shape)[:, None]), axis=0)
+    flat = np.ravel_multi_index(cell[:, inside], grid.shape)
+    cells = int(np.prod(grid.shape))
+    gamma = np.sqrt(1 + (momentum ** 2).sum(axis=0) / (mass * particles.SPEED_OF_LIGHT) ** 2)
+    weights = np.bincount(flat, weighting[inside], cells)
+    energy = np.bincount(flat,
+                         (weighting * (gamma - 1) * mass * particles.SPEED_OF_LIGHT ** 2)[inside],
+                         cells)
+    current_y = np.bincount(flat, (weighting * charge * momentum[1] / (gamma * mass))[inside],
+                            cells)
+    assert np.allclose(results["density"][0][1], (weights / 0.125).reshape(grid.shape))
+    assert np.allclose(results["energy"][0][1].ravel()[weights > 0],
+                       energy[weights > 0] / weights[weights > 0])
+    assert np.all(results["energy"][0][1].ravel()[weights == 0] == 0.0)
+    assert [name for name, _ in results["current"]] == ["x", "y", "z"]
+    assert np.allclose(results["current"][1][1], (current_y / 0.125).reshape(grid.shape))
+
+
+def test_particle_ranges():
+    assert [particles.particle_range(10, rank, 3) for rank in range(3)] == [(0, 3), (3, 6), (6, 10)]
+    assert particles.particle_chunks(3, 10, 3) == [(3, 6), (6, 9), (9, 10)]
+    # every third particle of 0..9 is kept: 0, 3, 6, 9
+    kept = []
+    for start, stop in particles.particle_chunks(0, 10, 4):
+        first, offset, number = particles.subsample_range(start, stop, 3)
+        assert offset == len(kept)
+        kept.extend(range(start + first, stop, 3)[:number])
+    assert kept == [0, 3, 6, 9]